@@ -144,7 +144,7 @@ class PB():
         else:
             bag = bag_doc['_id']
             bag_name = bag_doc[self.db.schema_name(id=bag)]
-            bag_photo = self.db.photo_load(item=bag)
+            bag_photo = self.db.photo_load(item=bag, size=500)
 
             if bag_photo != None:
                 self.newphoto(img=bag_photo)
@@ -143,7 +143,7 @@ class GC():
             person = person_doc['_id']
             person_name = person_doc[self.db.schema_name(id=person)]
             person_flags = person_doc.get("flags", [])
-            person_photo = self.db.photo_load(item=person)
+            person_photo = self.db.photo_load(item=person, size=500)
 
             if person_photo != None:
                 self.newphoto(img=person_photo)
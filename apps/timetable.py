@@ -1,5 +1,7 @@
 '''The module containing the timetable application.'''
 
+import io
+
 from PIL import Image, ImageTk
 
 import tkinter as tk
@@ -93,13 +95,14 @@ class TT():
 
     def get_vessels(self, container: str):
         children = self.db.container_children_all(container=container, cat="Vessel", result="DOC")
+        photos = dict(self.db.photos_load(items=[child['_id'] for child in children], size=512))
         response = []
         for child in children:
             id = child['_id']
             dn = child['Display Name']
             ea = child['Estimated Arrival']
             ed = child['Estimated Departure']
-            img = self.db.photo_load(item=id)
+            img = Image.open(io.BytesIO(photos[id])) if id in photos else None
             response.append((id, dn, ea, ed, img))
         return response
 
@@ -41,7 +41,7 @@ os.mkdir(BASEDIR)
 
 print("Exporting items...")
 for cat in db.schema_cats():
-    docs = db.items_list(cat=cat)
+    docs = db.items_iter(cat=cat)
     schema = db.schema_schema(cat=cat)
     fields = [
         field for field, value in schema.items() 
@@ -52,20 +52,20 @@ for cat in db.schema_cats():
     write_csv(filename=f"items-{cat}", docs=docs, keys=keys)
 
 print("Exporting containers...")
-docs = db.containers_list()
-docs = [doc for doc in docs if "container" in doc and "child" in doc]
+docs = db.containers_iter()
+docs = (doc for doc in docs if "container" in doc and "child" in doc)
 keys = ["container", "child"]
 write_csv(filename="containers", docs=docs, keys=keys)
 
 print("Exporting physical IDs...")
-docs = db.ids_list()
-docs = [doc for doc in docs if "item" in doc and "physid" in doc]
+docs = db.ids_iter()
+docs = (doc for doc in docs if "item" in doc and "physid" in doc)
 keys = ["item", "physid"]
 write_csv(filename="ids", docs=docs, keys=keys)
 
 print("Exporting photos...")
-docs = db.photos_list()
-docs = [doc for doc in docs if "item" in doc and "photo" in doc]
+docs = ({"item": item, "photo": db.photo_load_base64(item=item)} for item in db.photos_iter(result="ITEM"))
+docs = (doc for doc in docs if doc["photo"] != None)
 keys = ["item", "photo"]
 write_csv(filename="files", docs=docs, keys=keys)
 
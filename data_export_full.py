@@ -38,6 +38,7 @@ STARTTIME = str(datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S'))
 BASEDIR = args.ndir
 ITEMDICT = {}
 PHOTODICT = {}
+PHOTOSET = set()
 IDDICT = {}
 NAMEFIELD = "Display Name"
 
@@ -96,6 +97,12 @@ def write_odt(template_filepath: str, target_filepath: str, doc: dict, img: str
         pass
 
 
+def load_photos(uuids: list):
+    uuids = [uuid for uuid in uuids if uuid in PHOTOSET]
+    for uuid, data in db.photos_load(items=uuids):
+        PHOTODICT[uuid] = base64.b64encode(data).decode('utf-8')
+
+
 def create_node(rootpath: str, uuid: str):
     # Obtain the sanitized display name
     name = ITEMDICT[uuid][NAMEFIELD]
@@ -123,8 +130,8 @@ def create_node(rootpath: str, uuid: str):
     write_json(filepath=filepath, doc=ITEMDICT[uuid])
     if uuid in IDDICT:
         write_txt(filepath=filepath, docs=IDDICT[uuid])
-    if uuid in PHOTODICT:
-        img = PHOTODICT[uuid]
+    img = PHOTODICT.pop(uuid, None)
+    if img != None:
         write_jpg(filepath=filepath, b64=img)
         write_odt(template_filepath=os.path.join('templates', ITEMDICT[uuid]['category']), target_filepath=filepath, doc=ITEMDICT[uuid], img=img)
     else:
@@ -132,6 +139,7 @@ def create_node(rootpath: str, uuid: str):
 
     # Create the children directories
     children = db.container_children(container=uuid, result="DOC")
+    load_photos(uuids=[child["_id"] for child in children])
     for child in children:
         uuid = child["_id"]
         if uuid not in ITEMDICT:
@@ -151,12 +159,11 @@ if len(evacuations) == 1:
 else:
     raise RuntimeError("Expected one Evacuation in the database.")
 
-# Prepopulate a list of photos
-photos = db.photos_list()
-PHOTODICT = {photo["item"]: photo["photo"] for photo in photos if "item" in photo and "photo" in photo}
+# Prepopulate a list of items with photos, which are fetched in bulk a level at a time during export
+PHOTOSET = set(db.photos_iter(result="ITEM"))
 
 # Prepopulate a list of physical IDs
-physids = db.ids_list()
+physids = db.ids_iter()
 for physid in physids:
     if "item" in physid and "physid" in physid:
         item = physid["item"]
@@ -183,6 +190,7 @@ logpath = os.path.join(BASEDIR, "log")
 write_txt(filepath=logpath, docs=["Export initiated at:", STARTTIME])
 
 # Export the item tree
+load_photos(uuids=[base_uuid])
 create_node(rootpath=BASEDIR, uuid=base_uuid)
 
 sys.exit(0)
@@ -19,10 +19,12 @@ parser.add_argument('-f','--forc', help="if included, forces the app to use the
 parser.add_argument('-n','--name', type=str, default="dehc", help="which database namespace to use", metavar="NAME")
 parser.add_argument('-s','--sche', type=str, default="db_schema.json", help="relative path to database schema file", metavar="PATH")
 parser.add_argument('-v','--vers', type=str, default=DBVERSION, help="schema version to expect", metavar="VERS")
+parser.add_argument('-w','--work', type=int, default=4, help="max number of bulk requests to send to the database at once", metavar="N")
 parser.add_argument('-O','--ovdb', help="if included, disables database version detection. Use with caution, as it may result in lost data", action='store_true')
+parser.add_argument('-P','--part', help="if included, creates the databases partitioned by item category. Requires -d if they already exist", action='store_true')
 args = parser.parse_args()
 
-db = md.DEHCDatabase(config=args.auth, version=args.vers, forcelocal=args.forc, level="INFO", namespace=args.name, overridedbversion=args.ovdb, schema=args.sche, quickstart=False)
+db = md.DEHCDatabase(config=args.auth, version=args.vers, forcelocal=args.forc, level="INFO", namespace=args.name, overridedbversion=args.ovdb, partitioned=True if args.part == True else None, schema=args.sche, quickstart=False)
 
 db.schema_load(schema=args.sche)
 if args.drop == True:
@@ -159,13 +161,13 @@ recy = {"Display Name": "Recycle Bin", "Locked": 1}
 evac = db.item_create("Evacuation", evac)
 stat = db.items_create("Station", stat)
 lane = db.items_create("Lane", lane)
-pers = db.items_create("Person", pers)
-vess = db.items_create("Vessel", vess)
+pers = db.items_create("Person", pers, workers=args.work)
+vess = db.items_create("Vessel", vess, workers=args.work)
 recy = db.item_create("Trash", recy)
 
 db.container_adds(container=evac, items=stat+[recy])
 db.container_adds(container=stat[0], items=lane)
-db.container_adds(container=stat[6], items=pers)
-db.container_adds(container=stat[4], items=vess)
+db.container_adds(container=stat[6], items=pers, workers=args.work)
+db.container_adds(container=stat[4], items=vess, workers=args.work)
 
 sys.exit(0)
\ No newline at end of file
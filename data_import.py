@@ -19,6 +19,7 @@ parser.add_argument('-f','--forc', help="if included, forces the app to use the
 parser.add_argument('-n','--name', type=str, default="dehc", help="which database namespace to use", metavar="NAME")
 parser.add_argument('-s','--sche', type=str, default="db_schema.json", help="relative path to database schema file", metavar="PATH")
 parser.add_argument('-v','--vers', type=str, default=DBVERSION, help="schema version to expect", metavar="VERS")
+parser.add_argument('-w','--work', type=int, default=4, help="max number of bulk requests to send to the database at once", metavar="N")
 parser.add_argument('-D','--drop', help="if included, drops databases instead of deleting files from them; requires -d too", action='store_true')
 parser.add_argument('-N','--ndir', type=str, default="csv", help="the directory to import the csv files from", metavar="NAME")
 parser.add_argument('-O','--ovdb', help="if included, disables database version detection. Use with caution, as it may result in lost data", action='store_true')
@@ -63,13 +64,19 @@ for cat in db.schema_cats():
                 else:
                     doc["Locked"] = 0
             ids.append(id)
-        db.items_create(cat=cat, docs=docs, ids=ids)
+        db.items_create(cat=cat, docs=docs, ids=ids, workers=args.work)
 
 print("Importing containers...")
 if os.path.isfile(os.path.join(BASEDIR, "containers.csv")):
     docs = read_csv("containers")
+    container_dict = {}
     for doc in docs:
-        db.container_add(container=doc['container'], item=doc['child'])
+        container = doc["container"]
+        if container not in container_dict:
+            container_dict[container] = []
+        container_dict[container].append(doc["child"])
+    for container in container_dict.keys():
+        db.container_adds(container=container, items=container_dict[container], workers=args.work)
 
 print("Importing physical IDs...")
 db.index_prepare()
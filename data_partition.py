@@ -0,0 +1,124 @@
+'''The script that copies a DEHC namespace into a new one, partitioned by item category.'''
+
+import argparse
+import re
+import sys
+
+import mods.database as md
+
+# ----------------------------------------------------------------------------
+
+DBVERSION = "RC1"
+parser = argparse.ArgumentParser(description='Copies a DEHC namespace into a new namespace whose databases are partitioned by item category, rewriting every item id from "CATEGORY/HEX" to "CATEGORY:HEX".')
+parser.add_argument('target', type=str, help="which database namespace to copy into. Its databases must not exist yet, unless -d is included", metavar="TARGET")
+parser.add_argument('-a','--auth', type=str, default="db_auth.json", help="relative path to database authentication file", metavar="PATH")
+parser.add_argument('-d','--drop', help="if included, drops the target namespace's databases first", action='store_true')
+parser.add_argument('-f','--forc', help="if included, forces the app to use the local copy of the database schema", action='store_true')
+parser.add_argument('-g','--glob', help="if included, copies into global databases instead, rewriting ids back to \"CATEGORY/HEX\"", action='store_true')
+# '-h' brings up help
+parser.add_argument('-n','--name', type=str, default="dehc", help="which database namespace to copy from", metavar="NAME")
+parser.add_argument('-s','--sche', type=str, default="db_schema.json", help="relative path to database schema file", metavar="PATH")
+parser.add_argument('-v','--vers', type=str, default=DBVERSION, help="schema version to expect", metavar="VERS")
+parser.add_argument('-w','--work', type=int, default=4, help="max number of bulk requests to send to the database at once", metavar="N")
+parser.add_argument('-O','--ovdb', help="if included, disables database version detection. Use with caution, as it may result in lost data", action='store_true')
+args = parser.parse_args()
+
+if args.target == args.name:
+    print("The target namespace must differ from the one being copied")
+    sys.exit(1)
+
+source = md.DEHCDatabase(config=args.auth, version=args.vers, forcelocal=args.forc, level="INFO", namespace=args.name, overridedbversion=args.ovdb, schema=args.sche, quickstart=False)
+source.schema_load(schema=args.sche)
+target = md.DEHCDatabase(config=args.auth, version=args.vers, forcelocal=True, level="INFO", namespace=args.target, overridedbversion=args.ovdb, partitioned=args.glob == False, schema=args.sche, quickstart=False)
+target.schema = source.schema
+if args.drop == True:
+    target.databases_delete(lazy=True)
+target.databases_create(lazy=False)
+
+SEPARATOR = "/" if args.glob == True else ":"
+CATS = "|".join(re.escape(cat) for cat in sorted(source.schema_cats(), key=len, reverse=True))
+ITEM_ID = re.compile(r"(?<![^/\-])(" + CATS + r")[/:]([0-9a-f]{" + str(source.id_len) + r"})(?![0-9a-f])")
+SKIP = {source.db_configs: ["indexes"]}  # Rebuilt by index_prepare once copied
+
+
+def rewrite(value):
+    '''Returns a copy of a value with every item id in it rewritten to use SEPARATOR, searching lists and dicts recursively.
+
+    Item ids are found at the start of strings, or after a / or - (container, ids and photo UUIDs).
+
+    value: The value to rewrite.
+    '''
+    if isinstance(value, str):
+        return ITEM_ID.sub(lambda match: match.group(1)+SEPARATOR+match.group(2), value)
+    if isinstance(value, list):
+        return [rewrite(element) for element in value]
+    if isinstance(value, dict):
+        return {key: rewrite(element) for key, element in value.items()}
+    return value
+
+
+def attach(from_db: str, to_db: str, statuses: list, attachments: dict):
+    '''Copies the attachments of newly copied documents, such as photos, as raw bytes.
+
+    from_db: Name of the database to copy from.
+    to_db: Name of the database to copy into.
+    statuses: The results of creating the documents in to_db.
+    attachments: The original id and attachment stubs of each copied document that has any: {"NEW ID": ("OLD ID", {"NAME": stub, ...}), ...}
+    '''
+    for status in statuses:
+        if "error" in status or status["id"] not in attachments:
+            continue
+        id, names = attachments[status["id"]]
+        rev = status["rev"]
+        for name, stub in names.items():
+            data = source.db.attachment_get(dbname=from_db, id=id, name=name)
+            rev = target.db.attachment_put(dbname=to_db, id=status["id"], name=name, data=data, content_type=stub.get("content_type", "application/octet-stream"), rev=rev)
+
+
+def copy(from_db: str, to_db: str):
+    '''Copies every document, other than design documents, from one database into another, rewriting their ids.
+
+    from_db: Name of the database to copy from.
+    to_db: Name of the database to copy into.
+    '''
+    docs = []
+    ids = []
+    attachments = {}
+    copied = 0
+    failed = 0
+    for doc in source.db.documents_iter(dbname=from_db):
+        id = doc.pop('_id')
+        doc.pop('_rev', None)
+        if id.startswith("_design/") or id in SKIP.get(from_db, []):
+            continue
+        if "_attachments" in doc:
+            attachments[rewrite(id)] = (id, doc.pop("_attachments"))
+        docs.append(rewrite(doc))
+        ids.append(rewrite(id))
+        if len(docs) == source.db.chunk_size*args.work:
+            statuses = target.db.documents_create(dbname=to_db, docs=docs, ids=ids, workers=args.work)
+            attach(from_db=from_db, to_db=to_db, statuses=statuses, attachments=attachments)
+            copied += len([status for status in statuses if "error" not in status])
+            failed += len([status for status in statuses if "error" in status])
+            docs = []
+            ids = []
+            attachments = {}
+    if len(docs) > 0:
+        statuses = target.db.documents_create(dbname=to_db, docs=docs, ids=ids, workers=args.work)
+        attach(from_db=from_db, to_db=to_db, statuses=statuses, attachments=attachments)
+        copied += len([status for status in statuses if "error" not in status])
+        failed += len([status for status in statuses if "error" in status])
+    print(f"Copied {copied} documents from {from_db} to {to_db}{f', {failed} failed' if failed > 0 else ''}")
+    return failed
+
+
+failures = 0
+for from_db, to_db in zip(source.db_list, target.db_list):
+    print(f"Copying {from_db}...")
+    failures += copy(from_db=from_db, to_db=to_db)
+
+print("Preparing indexes...")
+target.index_prepare()
+
+print("Done copying" if failures == 0 else f"Done copying, but {failures} documents failed")
+sys.exit(0 if failures == 0 else 1)
\ No newline at end of file
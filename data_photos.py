@@ -0,0 +1,27 @@
+'''The script that moves photos saved as base64 strings inside documents into binary attachments.'''
+
+import argparse
+import sys
+
+import mods.database as md
+
+# ----------------------------------------------------------------------------
+
+DBVERSION = "RC1"
+parser = argparse.ArgumentParser(description='Moves every photo in a DEHC namespace saved as a base64 string inside its document into a binary attachment, and adds any missing renditions. Safe to run more than once.')
+parser.add_argument('-a','--auth', type=str, default="db_auth.json", help="relative path to database authentication file", metavar="PATH")
+parser.add_argument('-f','--forc', help="if included, forces the app to use the local copy of the database schema", action='store_true')
+# '-h' brings up help
+parser.add_argument('-n','--name', type=str, default="dehc", help="which database namespace to migrate", metavar="NAME")
+parser.add_argument('-s','--sche', type=str, default="db_schema.json", help="relative path to database schema file", metavar="PATH")
+parser.add_argument('-v','--vers', type=str, default=DBVERSION, help="schema version to expect", metavar="VERS")
+parser.add_argument('-O','--ovdb', help="if included, disables database version detection. Use with caution, as it may result in lost data", action='store_true')
+args = parser.parse_args()
+
+db = md.DEHCDatabase(config=args.auth, version=args.vers, forcelocal=args.forc, level="INFO", namespace=args.name, overridedbversion=args.ovdb, schema=args.sche, quickstart=False)
+
+print("Migrating photos...")
+moved = db.photos_migrate()
+
+print(f"Done migrating {moved} photos")
+sys.exit(0)
\ No newline at end of file
@@ -48,7 +48,7 @@ if __name__ == "__main__": # Multiprocessing library complains if this guard isn
     if args.forc == True:
         logger.warning(f"Application will load schema from '{args.auth}' save it to the database")
 
-    db = md.DEHCDatabase(config=args.auth, version=args.vers, forcelocal=args.forc, level=args.logg, namespace=args.name, overridedbversion=args.ovdb, schema=args.sche, updateschema=args.upda, quickstart=True)
+    db = md.DEHCDatabase(config=args.auth, version=args.vers, forcelocal=args.forc, level=args.logg, namespace=args.name, overridedbversion=args.ovdb, photocache="cache/photos", physidcache=True, revcache=True, schema=args.sche, updateschema=args.upda, quickstart=True)
 
     if args.app == "EMS":
         hardware = None
@@ -1,17 +1,305 @@
 '''The module containing objects that manage the CouchDB database.'''
 
+import abc
+import asyncio
 import base64
+import contextlib
+import contextvars
+import copy
+import functools
+import hashlib
+import http.server
+import inspect
 import io
 import json
+import os
 import random
-
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from ibm_cloud_sdk_core import ApiException
 from ibmcloudant import CouchDbSessionAuthenticator
-from ibmcloudant.cloudant_v1 import CloudantV1, BulkDocs, Document, IndexDefinition, IndexField
+from ibmcloudant.cloudant_v1 import CloudantV1, AllDocsQuery, BulkDocs, DesignDocument, DesignDocumentOptions, DesignDocumentViewsMapReduce, Document, IndexDefinition, IndexField
 from PIL import Image
+from requests.adapters import HTTPAdapter
 
 import mods.log as ml
 
 
+# ----------------------------------------------------------------------------
+
+class TransportAdapter(HTTPAdapter):
+    '''An HTTP adapter which pools connections, and gives each kind of CouchDB operation its own timeout.
+    
+    stats: The RequestStats requests are recorded in, if any.
+    timeouts: Seconds to wait on each operation, keyed by endpoint: {"_find": 60, "_view": 60, ..., "default": 10}
+    '''
+
+    def __init__(self, *, timeouts: dict, pool_size: int = 10, stats: "RequestStats" = None):
+        '''Constructs a TransportAdapter object.
+        
+        timeouts: Seconds to wait on each operation, keyed by endpoint. Endpoints not listed use "default".
+        pool_size: Max number of connections kept open to the server.
+        stats: If included, records every request sent in it.
+        '''
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.stats = stats
+        self.timeouts = timeouts
+
+
+    def send(self, request, **kwargs):
+        '''Sends a request, waiting as long as its operation allows.'''
+        kwargs["timeout"] = self.timeout(url=request.url)
+        if self.stats == None:
+            return super().send(request, **kwargs)
+        start = time.perf_counter()
+        status = None
+        try:
+            response = super().send(request, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            self.stats.record(url=request.url, seconds=time.perf_counter()-start, status=status)
+
+
+    def timeout(self, url: str):
+        '''Returns the timeout of the operation a url points to.
+        
+        url: The url of the request.
+        '''
+        for segment in urllib.parse.urlsplit(url).path.split("/"):
+            if segment in self.timeouts:
+                return self.timeouts[segment]
+        return self.timeouts.get("default", 10)
+
+
+# ----------------------------------------------------------------------------
+
+class RequestStats:
+    '''A class which counts the HTTP requests a Database makes, and how long they take.
+
+    Requests are grouped by endpoint: the last path segment starting with "_", or "default" for plain documents.
+    They're also attributed to the operation that made them: the outermost DEHCDatabase method, decorated with 
+    wrap_operation, on the calling thread's operation stack, or "-" if there isn't one. Latencies are kept as histograms, with bucket bounds
+    in milliseconds.
+
+    budgets: Context-local list of request counters open in budget blocks.
+    buckets: Upper bounds of the latency histogram buckets, in milliseconds.
+    endpoints: Totals per endpoint: {"ENDPOINT": {"requests": N, "errors": N, "seconds": S, "histogram": [N, ...]}, ...}
+    interval: Seconds between summaries being logged. 0 disables them.
+    lock: Lock guarding the totals, as requests are made from several threads.
+    logged: When a summary was last logged.
+    logger: The logger object used for logging.
+    operations: Totals per operation: {"OPERATION": {"calls": N, "requests": N, "seconds": S, "endpoints": {"ENDPOINT": N, ...}, "histogram": [N, ...]}, ...}
+    server: The HTTP server serving the totals as text, if started. See serve.
+    stack: Context-local tuple of the operations currently running, outermost first.
+    '''
+
+    budgets = contextvars.ContextVar("budgets", default=())
+    buckets = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+    stack = contextvars.ContextVar("operations", default=())
+
+    def __init__(self, *, interval: float = 0, level: str = "NOTSET"):
+        '''Constructs a RequestStats object.
+
+        interval: Seconds between summaries being logged. 0 disables them.
+        level: Minimum level of logging messages to report; "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "NONE".
+        '''
+        self.logger = ml.get("RequestStats", level=level)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.logged = time.monotonic()
+        self.server = None
+        self.reset()
+
+
+    @contextlib.contextmanager
+    def budget(self, requests: int, operation: str = None):
+        '''Raises an AssertionError if the code run in a with block makes more than a number of requests.
+
+        Only counts requests made by the calling thread, and by asyncio tasks and asyncio.to_thread calls started within 
+        the block. Other threads only count if they run in a copy of the caller's context, as the worker pool of 
+        documents_create does; plain threading.Thread and ThreadPoolExecutor calls don't.
+
+        requests: Max number of requests allowed.
+        operation: Name to describe the block with in the error.
+        '''
+        counter = {}
+        token = self.budgets.set(self.budgets.get() + (counter,))
+        try:
+            yield counter
+        finally:
+            self.budgets.reset(token)
+        made = sum(counter.values())
+        if made > requests:
+            name = operation if operation != None else "Block"
+            raise AssertionError(f"{name} made {made} requests, over its budget of {requests}: {counter}")
+
+
+    def histogram(self, counts: list):
+        '''Returns a histogram as a dictionary of bucket bounds to counts: {"1": N, ..., "+Inf": N}
+
+        counts: The counts of each bucket, as kept in the totals.
+        '''
+        return {str(bound): count for bound, count in zip(self.buckets + ["+Inf"], counts)}
+
+
+    @contextlib.contextmanager
+    def measure(self, operation: str, call: bool = True):
+        '''Pushes an operation onto the operation stack for the duration of a with block.
+
+        operation: Name of the operation, usually a DEHCDatabase method.
+        call: If false, doesn't count the block as a new call of the operation, eg when resuming a generator.
+        '''
+        stack = self.stack.get()
+        if len(stack) == 0 and call == True:
+            with self.lock:
+                self.operation_totals(operation=operation)["calls"] += 1
+        token = self.stack.set(stack + (operation,))
+        try:
+            yield
+        finally:
+            self.stack.reset(token)
+
+
+    def operation(self):
+        '''Returns the name of the operation running on the calling thread, or "-" if there isn't one.'''
+        stack = self.stack.get()
+        return stack[0] if len(stack) > 0 else "-"
+
+
+    def operation_totals(self, operation: str):
+        '''Returns the totals of an operation, adding them if they don't exist yet. Must be called holding lock.
+
+        operation: Name of the operation.
+        '''
+        if operation not in self.operations:
+            self.operations[operation] = {"calls": 0, "requests": 0, "seconds": 0.0, "endpoints": {}, "histogram": [0]*(len(self.buckets)+1)}
+        return self.operations[operation]
+
+
+    def record(self, url: str, seconds: float, status: int = None):
+        '''Records a request that has been made.
+
+        url: The url the request was sent to.
+        seconds: How long the request took.
+        status: The HTTP status of the response, or None if no response was received.
+        '''
+        endpoint = "default"
+        for segment in urllib.parse.urlsplit(url).path.split("/"):
+            if segment.startswith("_"):
+                endpoint = segment
+        bucket = len(self.buckets)
+        for index, bound in enumerate(self.buckets):
+            if seconds*1000 <= bound:
+                bucket = index
+                break
+        operation = self.operation()
+        with self.lock:
+            for counter in self.budgets.get():
+                counter[endpoint] = counter.get(endpoint, 0) + 1
+            if endpoint not in self.endpoints:
+                self.endpoints[endpoint] = {"requests": 0, "errors": 0, "seconds": 0.0, "histogram": [0]*(len(self.buckets)+1)}
+            totals = self.endpoints[endpoint]
+            totals["requests"] += 1
+            totals["errors"] += 1 if status == None or status >= 400 else 0
+            totals["seconds"] += seconds
+            totals["histogram"][bucket] += 1
+            totals = self.operation_totals(operation=operation)
+            totals["requests"] += 1
+            totals["seconds"] += seconds
+            totals["endpoints"][endpoint] = totals["endpoints"].get(endpoint, 0) + 1
+            totals["histogram"][bucket] += 1
+            due = self.interval > 0 and time.monotonic() - self.logged >= self.interval
+            if due == True:
+                self.logged = time.monotonic()
+        if due == True:
+            self.logger.info(self.summary())
+
+
+    def reset(self):
+        '''Clears all totals.'''
+        with self.lock:
+            self.endpoints = {}
+            self.operations = {}
+
+
+    def serve(self, host: str = "127.0.0.1", port: int = 9100):
+        '''Starts serving the totals as plain text over HTTP, on a background thread. Returns the server.
+
+        host: The address to listen on.
+        port: The port to listen on. 0 picks a free one.
+        '''
+        stats = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = stats.text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, format: str, *args):
+                pass
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name="RequestStats", daemon=True).start()
+        self.logger.info(f"Serving request stats at http://{host}:{self.server.server_address[1]}/")
+        return self.server
+
+
+    def snapshot(self):
+        '''Returns a copy of the totals, with histograms as dictionaries:
+
+        {"requests": N, "seconds": S, "endpoints": {"ENDPOINT": {...}, ...}, "operations": {"OPERATION": {...}, ...}}
+        '''
+        with self.lock:
+            endpoints = copy.deepcopy(self.endpoints)
+            operations = copy.deepcopy(self.operations)
+        for totals in list(endpoints.values()) + list(operations.values()):
+            totals["histogram"] = self.histogram(counts=totals["histogram"])
+        return {
+            "requests": sum(totals["requests"] for totals in endpoints.values()),
+            "seconds": sum(totals["seconds"] for totals in endpoints.values()),
+            "endpoints": endpoints,
+            "operations": operations
+        }
+
+
+    def summary(self):
+        '''Returns a one line summary of the totals, busiest operations first.'''
+        stats = self.snapshot()
+        operations = sorted(stats["operations"].items(), key=lambda pair: pair[1]["requests"], reverse=True)
+        text = f"{stats['requests']} requests in {stats['seconds']:.2f} s"
+        for name, totals in operations[:5]:
+            text += f"; {name}: {totals['requests']} requests over {totals['calls']} calls, {totals['seconds']:.2f} s"
+        return text
+
+
+    def text(self):
+        '''Returns the totals in the Prometheus text exposition format.'''
+        stats = self.snapshot()
+        lines = ["# TYPE dehc_requests_total counter"]
+        lines += [f'dehc_requests_total{{endpoint="{name}"}} {totals["requests"]}' for name, totals in stats["endpoints"].items()]
+        lines += ["# TYPE dehc_request_errors_total counter"]
+        lines += [f'dehc_request_errors_total{{endpoint="{name}"}} {totals["errors"]}' for name, totals in stats["endpoints"].items()]
+        lines += ["# TYPE dehc_operation_calls_total counter"]
+        lines += [f'dehc_operation_calls_total{{operation="{name}"}} {totals["calls"]}' for name, totals in stats["operations"].items()]
+        lines += ["# TYPE dehc_request_seconds histogram"]
+        for name, totals in stats["operations"].items():
+            cumulative = 0
+            for bound, count in totals["histogram"].items():
+                cumulative += count
+                le = bound if bound == "+Inf" else str(int(bound)/1000)
+                lines.append(f'dehc_request_seconds_bucket{{operation="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'dehc_request_seconds_sum{{operation="{name}"}} {totals["seconds"]}')
+            lines.append(f'dehc_request_seconds_count{{operation="{name}"}} {totals["requests"]}')
+        return "\n".join(lines) + "\n"
+
+
 # ----------------------------------------------------------------------------
 
 class Database:
@@ -21,16 +309,31 @@ class Database:
     For helper methods specific to the DEHC application, use the DEHCDatabase 
     class down below.
     
+    chunk_size: Max number of documents to send in a single bulk request.
     client: The Cloudant-CouchDB client object.
+    id_clocks: The last period and counter used by id_create, per length of hex component: {LENGTH: (PERIOD, COUNTER), ...}
+    id_epoch: The Unix time id_create counts seconds from.
+    id_lock: Lock guarding id_clocks, so UUIDs generated by different threads never repeat.
     index_cache: Cache of indexes that have been created.
     logger: The logger object used for logging.
+    metrics: The RequestStats every request is recorded in. See stats.
+    page_size: Default number of documents fetched per request when iterating over a database.
+    rev_cache: If enabled, the last known revision and body of recently used documents, oldest first.
+    rev_cache_size: Max number of documents kept in the revision cache.
+    rev_lock: Lock guarding the revision cache, so a Database can be shared between threads.
+    rev_retries: Max number of attempts at saving a document before giving up on conflicts.
+    scan_warnings: Shapes of queries already warned about for not using an index: {("DBNAME", ("FIELD", ...)), ...}
+    slow_queries: The most recent queries that took longer than slow_query_seconds, oldest first. See query_record.
+    slow_query_seconds: Queries taking at least this long are explained and recorded in slow_queries.
+    transport: The HTTP transport profile in use. See transport_setup.
     '''
 
-    def __init__(self, *, config: str, level: str = "NOTSET"):
+    def __init__(self, *, config: str, level: str = "NOTSET", revcache: bool = False):
         '''Constructs a Database object.
         
         config: Path to .json file containing database server credentials.
         level: Minimum level of logging messages to report; "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "NONE".
+        revcache: If true, remembers the revisions of documents read and written, so they can be saved without fetching them first.
         '''
         self.logger = ml.get("Database", level=level)
         self.logger.debug("Database object instantiated")
@@ -42,21 +345,106 @@ class Database:
 
         auth = CouchDbSessionAuthenticator(username=self.data['user'], password=self.data['pass'])
         self.client = CloudantV1(authenticator=auth)
-        #self.client.http_adapter = self.httpAdapter
-        self.client.set_http_config({'timeout': 10})
         self.client.set_service_url(self.data['url'])
-        self.client.set_enable_gzip_compression(False)
+        self.metrics = RequestStats(interval=self.data.get('stats', {}).get('interval', 0), level=level)
+        if self.data.get('stats', {}).get('port', None) != None:
+            self.metrics.serve(port=self.data['stats']['port'])
+        self.transport_setup(profile=self.data.get('transport', {}))
         self.logger.info(f"Connection to {self.data['url']} established")
+        self.id_clocks = {}
+        self.id_epoch = 1577836800  # 2020-01-01 UTC
+        self.id_lock = threading.Lock()
         self.index_cache = {}
+        self.chunk_size = 1000
+        self.page_size = 500
+        self.rev_cache = OrderedDict() if revcache == True else None
+        self.rev_cache_size = 256
+        self.rev_lock = threading.Lock()
+        self.rev_retries = 3
+        self.scan_warnings = set()
+        self.slow_queries = deque(maxlen=self.data.get('slow_queries', {}).get('size', 100))
+        self.slow_query_seconds = self.data.get('slow_queries', {}).get('seconds', 1.0)
+
+
+    def attachment_get(self, dbname: str, id: str, name: str, lazy: bool = False):
+        '''Retrieves an attachment of a document and returns its contents as bytes.
+
+        Uses a single request, and the attachment is sent as raw bytes rather than as base64 inside JSON.
+        
+        dbname: Name of database to fetch from.
+        id: The UUID of the document the attachment is on.
+        name: The name of the attachment.
+        lazy: If true, returns None instead of erroring if the document or attachment doesn't exist.
+        '''
+        try:
+            res = self.client.get_attachment(db=dbname, doc_id=id, attachment_name=name).get_result()
+        except ApiException as e:
+            if e.code != 404 or lazy == False:
+                raise
+            self.logger.debug(f"Could not fetch attachment {dbname} {id} {name}")
+            return None
+        self.logger.debug(f"Fetched attachment {dbname} {id} {name}")
+        return res.content
+
 
+    def attachment_put(self, dbname: str, id: str, name: str, data: bytes, content_type: str, rev: str = None):
+        '''Adds or replaces an attachment of a document, creating the document if it doesn't exist, and returns the document's new revision.
 
-    def database_create(self, dbname: str):
+        The attachment is sent as raw bytes rather than as base64 inside JSON. Uses a single request if rev is given, 
+        the document is new or its revision is cached, otherwise looks the revision up on conflict.
+        
+        dbname: Name of database the document is in.
+        id: The UUID of the document.
+        name: The name of the attachment.
+        data: The contents of the attachment.
+        content_type: The MIME type of the attachment, eg "image/jpeg".
+        rev: If included, the revision of the document being added to.
+        '''
+        if rev == None:
+            cached = self.rev_cache_get(dbname=dbname, id=id)
+            rev = cached[0] if cached != None else None
+        for attempt in range(1, self.rev_retries+1):
+            try:
+                res = self.client.put_attachment(db=dbname, doc_id=id, attachment_name=name, attachment=io.BytesIO(data), content_type=content_type, rev=rev).get_result()
+                break
+            except ApiException as e:
+                if e.code != 409 or attempt == self.rev_retries:
+                    raise
+                try:
+                    rev = self.client.head_document(db=dbname, doc_id=id).get_headers()['ETag'].strip('"')
+                except ApiException as e:
+                    if e.code != 404:
+                        raise
+                    rev = None
+                self.logger.debug(f"Looked up revision of document {dbname} {id} after conflict ({attempt}/{self.rev_retries})")
+        self.rev_cache_set(dbname=dbname, id=id, rev=res['rev'])
+        self.logger.debug(f"Saved attachment {dbname} {id} {name}")
+        return res['rev']
+
+
+    def changes(self, dbname: str, since: str = "0", include_docs: bool = False, feed: str = "normal", timeout: int = None, limit: int = None):
+        '''Returns the changes made to a database since a sequence id, along with the new last sequence id.
+
+        dbname: Name of database to follow.
+        since: Sequence id to start from. "0" for the beginning, "now" for only the latest sequence id.
+        include_docs: If true, includes the current body of each changed document.
+        feed: "normal" to return immediately, "longpoll" to wait for a change before returning.
+        timeout: If feed is "longpoll", milliseconds to wait for a change before returning empty.
+        limit: If included, the max number of changes to return.
+        '''
+        res = self.client.post_changes(db=dbname, since=since, include_docs=include_docs, feed=feed, timeout=timeout, limit=limit).get_result()
+        self.logger.debug(f"Fetched {len(res['results'])} changes to database {dbname} since {since}")
+        return res
+
+
+    def database_create(self, dbname: str, partitioned: bool = False):
         '''Creates a new database.
         
         dbname: Name of the database to create.
+        partitioned: If true, creates a partitioned database, whose document ids must be "PARTITION:ID".
         '''
-        self.client.put_database(db=dbname)
-        self.logger.debug(f"Created database {dbname}")
+        self.client.put_database(db=dbname, partitioned=True if partitioned == True else None)
+        self.logger.debug(f"Created {'partitioned ' if partitioned == True else ''}database {dbname}")
 
 
     def database_delete(self, dbname: str):
@@ -65,6 +453,10 @@ class Database:
         dbname: Name of the database to delete.
         '''
         self.client.delete_database(db=dbname)
+        if self.rev_cache != None:
+            with self.rev_lock:
+                for key in [key for key in self.rev_cache if key[0] == dbname]:
+                    del self.rev_cache[key]
         self.logger.debug(f"Deleted database {dbname}")
 
 
@@ -93,6 +485,15 @@ class Database:
         return res
 
 
+    def database_partitioned(self, dbname: str):
+        '''Returns whether or not a database is partitioned.
+
+        dbname: Name of the database to check.
+        '''
+        info = self.client.get_database_information(db=dbname).get_result()
+        return info.get('props', {}).get('partitioned', False) == True
+
+
     def document_create(self, dbname: str, doc: dict, id: str = None):
         '''Creates a new document, returning its id.
         
@@ -100,44 +501,78 @@ class Database:
         doc: The contents of the document.
         id: The UUID of the document. If omitted, one is generated by CouchDB.
         '''
-        new_doc = Document(id=self.id_get()[0], **doc) if id == None else Document(id=id, **doc)
+        new_doc = Document(id=self.id_create(length=32)[0], **doc) if id == None else Document(id=id, **doc)
         res = self.client.post_document(db=dbname, document=new_doc).get_result()
         id = res['id']
+        self.rev_cache_set(dbname=dbname, id=id, rev=res['rev'], doc={**doc, "_id": id})
         self.logger.debug(f"Created document {dbname} {id}")
         return id
 
 
     def document_delete(self, dbname: str, id: str, lazy: bool = False):
         '''Deletes an existing document.
+
+        Uses two requests; one to look up its revision, using HEAD so the body isn't sent, and one to delete it.
         
         dbname: Name of database to delete document in.
         id: The UUID of document to delete.
         lazy: If true, won't error if document doesn't exist.
         '''
-        if lazy == False or self.document_exists(dbname=dbname, id=id) == True:
-            doc = self.client.get_document(db=dbname, doc_id=id).get_result()
+        self.rev_cache_drop(dbname=dbname, id=id)
+        try:
             if id.startswith('_design/'):
                 _, ddoc = id.split('_design/')
+                doc = self.client.get_document(db=dbname, doc_id=id).get_result()
                 self.client.delete_design_document(db=dbname, ddoc=ddoc, rev=doc["_rev"])
             else:
-                self.client.delete_document(db=dbname, doc_id=id, rev=doc["_rev"])
-            self.logger.debug(f"Deleted document {dbname} {id}")
-        else:
+                rev = self.client.head_document(db=dbname, doc_id=id).get_headers()['ETag'].strip('"')
+                self.client.delete_document(db=dbname, doc_id=id, rev=rev)
+        except ApiException as e:
+            if e.code != 404 or lazy == False:
+                raise
             self.logger.debug(f"Could not lazy delete document {dbname} {id}")
+            return
+        self.logger.debug(f"Deleted document {dbname} {id}")
 
 
     def document_edit(self, dbname: str, doc: dict, id: str, lazy: bool = False):
         '''Edits an existing document.
+
+        If the document is in the revision cache, the edit is merged into the cached body and saved in a single request.
+        Otherwise, or if the document has changed since, it's fetched and merged first, retrying up to rev_retries times on conflicts.
         
         dbname: Name of database to edit document in.
         doc: Fields and values to be edited.
         id: The UUID of the document to edit.
         lazy: If true, won't error if document doesn't exist.
         '''
-        if lazy == False or self.document_exists(dbname=dbname, id=id) == True:
-            remote_doc = self.client.get_document(db=dbname, doc_id=id).get_result()
+        cached = self.rev_cache_get(dbname=dbname, id=id)
+        if cached != None and cached[1] != None:
+            rev, remote_doc = cached
             remote_doc.update(doc)
-            self.client.post_document(db=dbname, document=remote_doc)
+            remote_doc.update({"_id": id, "_rev": rev})
+            try:
+                res = self.client.post_document(db=dbname, document=remote_doc).get_result()
+                self.rev_cache_set(dbname=dbname, id=id, rev=res['rev'], doc=remote_doc)
+                self.logger.debug(f"Edited document {dbname} {id} using cached revision")
+                return
+            except ApiException as e:
+                if e.code != 409:
+                    raise
+                self.rev_cache_drop(dbname=dbname, id=id)
+                self.logger.debug(f"Cached revision of document {dbname} {id} is out of date")
+        if lazy == False or self.document_exists(dbname=dbname, id=id) == True:
+            for attempt in range(1, self.rev_retries+1):
+                remote_doc = self.client.get_document(db=dbname, doc_id=id).get_result()
+                remote_doc.update(doc)
+                try:
+                    res = self.client.post_document(db=dbname, document=remote_doc).get_result()
+                    break
+                except ApiException as e:
+                    if e.code != 409 or attempt == self.rev_retries:
+                        raise
+                    self.logger.warning(f"Conflict editing document {dbname} {id}, retrying ({attempt}/{self.rev_retries})")
+            self.rev_cache_set(dbname=dbname, id=id, rev=res['rev'], doc=remote_doc)
             self.logger.debug(f"Edited document {dbname} {id}")
         else:
             self.logger.debug(f"Could not lazy edit document {dbname} {id}")
@@ -171,80 +606,161 @@ class Database:
         '''
         if lazy == False or self.document_exists(dbname=dbname, id=id) == True:
             remote_doc = self.client.get_document(db=dbname, doc_id=id).get_result()
+            self.rev_cache_set(dbname=dbname, id=id, rev=remote_doc['_rev'], doc=remote_doc)
             self.logger.debug(f"Fetched document {dbname} {id}")
         else:
             remote_doc = {}
             self.logger.debug(f"Could not fetch document {dbname} {id}")
         return remote_doc
-    
 
-    def documents_create(self, dbname: str, docs: list, ids: list):
-        '''Creates multiple documents at once, returning their ids.
+
+    def document_save(self, dbname: str, doc: dict, id: str, rev: str = None):
+        '''Saves a document in full, creating it if it doesn't exist or replacing it if it does, and returns its new revision.
+
+        Uses a single request if rev is given, the document is new or its revision is cached, otherwise looks the revision up on conflict.
+        Replacing a document drops any attachments not listed in its "_attachments", eg as {"NAME": {"stub": True}}.
+        
+        dbname: Name of database to save document in.
+        doc: The contents of the document.
+        id: The UUID of the document.
+        rev: If included, the revision of the document being replaced.
+        '''
+        if rev == None:
+            cached = self.rev_cache_get(dbname=dbname, id=id)
+            rev = cached[0] if cached != None else None
+        for attempt in range(1, self.rev_retries+1):
+            try:
+                document = {**doc, "_id": id, **({"_rev": rev} if rev != None else {})}  # A dict, so "_attachments" is kept
+                res = self.client.post_document(db=dbname, document=document).get_result()
+                break
+            except ApiException as e:
+                if e.code != 409 or attempt == self.rev_retries:
+                    raise
+                try:
+                    rev = self.client.head_document(db=dbname, doc_id=id).get_headers()['ETag'].strip('"')
+                except ApiException as e:
+                    if e.code != 404:
+                        raise
+                    rev = None
+                self.logger.debug(f"Looked up revision of document {dbname} {id} after conflict ({attempt}/{self.rev_retries})")
+        self.rev_cache_set(dbname=dbname, id=id, rev=res['rev'])
+        self.logger.debug(f"Saved document {dbname} {id}")
+        return res['rev']
+
+
+    def documents_create(self, dbname: str, docs: list, ids: list = None, workers: int = 1):
+        '''Creates multiple documents at once, returning the status of each: [{"id": "UUID", "ok": True, "rev": "REV"}, ...]
+
+        Documents are created in chunks of chunk_size, with up to workers chunks being sent at once.
+        Failed creations are reported as {"id": "UUID", "error": "ERROR", "reason": "REASON"} instead.
         
         dbname: Name of database to create documents in.
         doc: A list of the contents of each document.
-        ids: A list of UUIDs of the documents. If omitted, they are generated by CouchDB.
+        ids: A list of UUIDs of the documents. If omitted, they're generated locally, in the same format CouchDB uses.
+        workers: Max number of chunks to send concurrently.
         '''
-        doc_list = []
         if ids == None:
-            for doc in docs:
-                doc = Document(id=self.id_get()[0], **doc)
-                doc_list.append(doc)
+            ids = self.id_create(n=len(docs), length=32)
+        chunks = []
+        for start in range(0, len(docs), self.chunk_size):
+            doc_list = [Document(id=id, **doc) for doc, id in zip(docs[start:start+self.chunk_size], ids[start:start+self.chunk_size])]
+            chunks.append(BulkDocs(docs=doc_list))
+        post = lambda chunk: self.client.post_bulk_docs(db=dbname, bulk_docs=chunk).get_result()
+        if workers > 1 and len(chunks) > 1:
+            context = contextvars.copy_context()  # So requests are still attributed to the calling operation
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(lambda chunk: context.copy().run(post, chunk), chunks))
         else:
-            for index, doc in enumerate(docs):
-                doc = Document(id=ids[index], **doc)
-                doc_list.append(doc)
+            results = [post(chunk) for chunk in chunks]
+
+        statuses = []
+        for res in results:
+            for re in res:
+                if "error" in re:
+                    self.logger.warning(f"Could not bulk create document {dbname} {re['id']}: {re['error']}")
+                else:
+                    self.logger.debug(f"Bulk created document {dbname} {re['id']}")
+                statuses.append(re)
+        self.logger.debug(f"Finished bulk creating documents in {len(chunks)} chunks")
+        return statuses
 
-        doc_list = BulkDocs(docs=doc_list)
-        res = self.client.post_bulk_docs(db=dbname, bulk_docs=doc_list).get_result()
-        ids = []
-        for re in res:
-            id = re['id']
-            self.logger.debug(f"Bulk created document {dbname} {id}")
-            ids.append(id)
-        self.logger.debug(f"Finished bulk creating documents")
-        return ids
 
+    def documents_delete(self, dbname: str, ids: str, lazy: bool = False, revs: dict = None):
+        '''Deletes multiple documents at once, returning the status of each: [{"id": "UUID", "ok": True}, ...]
 
-    def documents_delete(self, dbname: str, ids: str, lazy: bool = False):
-        '''Deletes multiple documents at once.
+        Documents are deleted in chunks, using one request to look up revisions and one to delete per chunk. Every 
+        chunk is looked up before any is deleted, so unless lazy, nothing is deleted if any document doesn't exist.
+        Chunks whose revisions are all in revs aren't looked up; if one is out of date, that document isn't deleted.
+        Failed deletions are reported as {"id": "UUID", "error": "ERROR", "reason": "REASON"} instead.
         
         dbname: Name of database to delete documents in.
         ids: The UUIDs of the documents to delete.
         lazy: If true, won't error if any documents doesn't exist.
-        '''
-        remote_docs = self.client.post_all_docs(db=dbname, limit=len(ids), keys=ids).get_result()['rows']
-        for remote_doc in remote_docs:
-            id = remote_doc["key"]
-            if lazy == False or self.document_exists(dbname=dbname, id=id) == True:
-                rev = remote_doc["value"]["rev"]
-                if id.startswith("_design/"):
-                    _, ddoc = id.split("_design/")
-                    self.client.delete_design_document(db=dbname, ddoc=ddoc, rev=rev)
+        revs: If included, the known revisions of the documents: {"UUID": "REV", ...}
+        '''
+        ids = list(dict.fromkeys(ids))
+        revs = revs if revs != None else {}
+        chunks = []
+        missing = set()
+        for start in range(0, len(ids), self.chunk_size):
+            chunk = ids[start:start+self.chunk_size]
+            for id in chunk:
+                self.rev_cache_drop(dbname=dbname, id=id)
+            if all(id in revs for id in chunk):
+                chunks.append([{"key": id, "value": {"rev": revs[id]}} for id in chunk])
+                continue
+            remote_docs = self.client.post_all_docs(db=dbname, keys=chunk).get_result()['rows']
+            missing.update(row["key"] for row in remote_docs if "error" in row or row["value"].get("deleted", False) == True)
+            chunks.append(remote_docs)
+        if lazy == False and len(missing) > 0:
+            raise RuntimeError(f"Can't bulk delete documents that don't exist in {dbname}: {sorted(missing)}")
+        statuses = []
+        for remote_docs in chunks:
+            doc_list = []
+            for remote_doc in remote_docs:
+                id = remote_doc["key"]
+                if id in missing:
+                    self.logger.debug(f"Could not bulk lazy delete document {dbname} {id}")
+                    statuses.append({"id": id, "ok": True})
                 else:
-                    self.client.delete_document(db=dbname, doc_id=id, rev=rev)
-                self.logger.debug(f"Bulk deleted document {dbname} {id}")
-            else:
-                self.logger.debug(f"Could not bulk lazy delete document {dbname} {id}")
+                    doc_list.append(Document(id=id, rev=remote_doc["value"]["rev"], deleted=True))
+            if len(doc_list) > 0:
+                res = self.client.post_bulk_docs(db=dbname, bulk_docs=BulkDocs(docs=doc_list)).get_result()
+                for re in res:
+                    if "error" in re:
+                        self.logger.warning(f"Could not bulk delete document {dbname} {re['id']}: {re['error']}")
+                    else:
+                        self.logger.debug(f"Bulk deleted document {dbname} {re['id']}")
+                    statuses.append(re)
         self.logger.debug(f"Finished bulk deleting documents")
+        return statuses
 
 
     def documents_edit(self, dbname: str, docs: list, ids: list, lazy: bool = False):
         '''Edits multiple documents at once, returning a list of id and rev numbers. 
+
+        Uses exactly two requests, however many documents are edited; one to fetch them and one to save them.
         
         dbname: Name of database to edit documents in.
         docs: Lists of fields and values to be edited.
         ids:  List of IDs of documents being edited.
         lazy: If true, won't error if any documents doesn't exist.
         '''
-        remote_docs = self.client.post_all_docs(db=dbname, include_docs=True, limit=len(ids), keys=ids).get_result()['rows']
+        edits = {}
+        for id, doc in zip(ids, docs):
+            edits.setdefault(id, doc)
+            self.rev_cache_drop(dbname=dbname, id=id)
+        remote_docs = self.client.post_all_docs(db=dbname, include_docs=True, keys=list(edits)).get_result()['rows']
+        missing = {row["key"] for row in remote_docs if row.get("doc", None) == None}
+        if lazy == False and len(missing) > 0:
+            raise RuntimeError(f"Can't bulk edit documents that don't exist in {dbname}: {sorted(missing)}")
         doc_list = []
         for remote_doc in remote_docs:
             id = remote_doc["key"]
-            if lazy == False or self.document_exists(dbname=dbname, id=id) == True:
+            if id not in missing:
                 rev = remote_doc["value"]["rev"]
                 remote_doc = remote_doc['doc']
-                remote_doc.update(docs[ids.index(id)])
+                remote_doc.update(edits[id])
                 remote_doc = Document(id=id, rev=rev, **remote_doc)
                 doc_list.append(remote_doc)
             else:
@@ -253,58 +769,128 @@ class Database:
         doc_list = BulkDocs(docs=doc_list)
         res = self.client.post_bulk_docs(db=dbname, bulk_docs=doc_list).get_result()
         for re in res:
-            self.logger.debug(f"Bulk edited document {dbname} {re['id']}")
+            if "error" in re:
+                self.logger.warning(f"Could not bulk edit document {dbname} {re['id']}: {re['error']}")
+            else:
+                self.logger.debug(f"Bulk edited document {dbname} {re['id']}")
         self.logger.debug(f"Finished bulk editing documents")
+        return res
 
 
     def documents_get(self, dbname: str, ids: str, lazy: bool = False):
         '''Retrieves multiple documents and returns them.
+
+        Uses a single request. Documents that don't exist are skipped if lazy, otherwise returned as None.
         
         dbname:  Name of database to get documents from.
         ids: A list of UUIDs of documents to fetch.
         lazy: If true, won't error if any documents don't exist.
         '''
-        remote_docs = self.client.post_all_docs(db=dbname, include_docs=True, limit=len(ids), keys=ids).get_result()['rows']
+        remote_docs = self.client.post_all_docs(db=dbname, include_docs=True, keys=ids).get_result()['rows']
         doc_list = []
         for doc in remote_docs:
             id = doc["key"]
-            if lazy == False or self.document_exists(dbname=dbname, id=id) == True:
+            if doc.get("doc", None) != None:
                 self.logger.debug(f"Bulk fetched document {dbname} {id}")
                 doc_list.append(doc['doc'])
+            elif lazy == False:
+                self.logger.debug(f"Could not bulk fetch {dbname} {id}")
+                doc_list.append(None)
             else:
                 self.logger.debug(f"Could not bulk lazy fetch {dbname} {id}")
         self.logger.debug(f"Finished bulk fetching documents")
         return doc_list
 
 
-    def documents_list(self, dbname: str, startkey: str = None, endkey: str = None, limit: int = 25):
+    def documents_iter(self, dbname: str, startkey: str = None, endkey: str = None, include_docs: bool = True, page_size: int = None, partition: str = None):
+        '''Yields every document in a database, fetching them a page at a time so memory use stays bounded.
+
+        Each page starts at the last document of the previous page, skipping it. Pages are fetched one ahead of 
+        what's been yielded, so documents can safely be deleted while iterating.
+        
+        dbname: Name of database to iterate over.
+        startkey: If included, document UUID to start fetching from.
+        endkey: If included, document UUID to stop fetching at.
+        include_docs: If false, only yields the id and rev of each document: {"_id": "UUID", "_rev": "REV"}
+        page_size: Number of docs to fetch per request. If omitted, uses page_size.
+        partition: If included, only iterates over this partition of a partitioned database.
+        '''
+        page_size = page_size if page_size != None else self.page_size
+        rows = self.rows(dbname=dbname, include_docs=include_docs, startkey=startkey, endkey=endkey, limit=page_size, partition=partition)
+        pages = 1
+        while len(rows) > 0:
+            if len(rows) == page_size:
+                next_rows = self.rows(dbname=dbname, include_docs=include_docs, startkey=rows[-1]['id'], endkey=endkey, limit=page_size, skip=1, partition=partition)
+                pages += 1
+            else:
+                next_rows = []
+            for row in rows:
+                yield row['doc'] if include_docs == True else {"_id": row['id'], "_rev": row['value']['rev']}
+            rows = next_rows
+        self.logger.debug(f"Documents iterated from database {dbname}, {startkey if startkey != None else 'START'} to {endkey if endkey != None else 'END'}, in {pages} pages")
+
+
+    def documents_list(self, dbname: str, startkey: str = None, endkey: str = None, limit: int = 25, partition: str = None):
         '''Returns a list of all documents in a database. Intensive!
         
         dbname: Name of database to fetch all docs from.
         startkey: If included, document UUID to start fetching from.
         endkey: If included, document UUID to stop fetching at.
         limit: Number of docs to retrieve. Set arbitrary large to fetch all.
+        partition: If included, only lists documents in this partition of a partitioned database.
         '''
-        remote_docs = self.client.post_all_docs(db=dbname, include_docs=True, startkey=startkey, endkey=endkey, limit=limit).get_result()
+        remote_docs = self.rows(dbname=dbname, include_docs=True, startkey=startkey, endkey=endkey, limit=limit, partition=partition)
         docs = []
-        for remote_doc in remote_docs['rows']:
+        for remote_doc in remote_docs:
             docs.append(remote_doc['doc'])
         self.logger.debug(f"Documents listed from database {dbname}, {startkey if startkey != None else 'START'} to {endkey if endkey != None else 'END'}")
         return docs
 
 
+    def documents_ranges(self, dbname: str, ranges: list, include_docs: bool = False, limit: int = None):
+        '''Returns the rows of several UUID ranges in a database, using a single request.
+
+        Returns a list of lists of rows, one list per range: [[{"id": "UUID", "key": "UUID", "value": {"rev": "REV"}}, ...], ...]
+
+        dbname: Name of database to fetch rows from.
+        ranges: A list of (startkey, endkey) pairs, each the first and last document UUID of a range.
+        include_docs: If true, includes each row's document under "doc".
+        limit: If included, the max number of rows to retrieve per range.
+        '''
+        queries = [AllDocsQuery(startkey=startkey, endkey=endkey, include_docs=include_docs, limit=limit) for startkey, endkey in ranges]
+        res = self.client.post_all_docs_queries(db=dbname, queries=queries).get_result()
+        self.logger.debug(f"Listed {len(ranges)} document ranges from database {dbname}")
+        return [result['rows'] for result in res['results']]
+
+
     def id_create(self, n: int = 1, length: int = 12, prefix: str = ""):
-        '''Generates new UUIDs within Python and returns them.
+        '''Generates new time-ordered UUIDs within Python and returns them.
+
+        The hex component starts with the time since id_epoch, so new documents are added near each other in CouchDB's 
+        B-trees instead of being scattered through them, which speeds up bulk writes and keeps database files small.
+        The rest is a counter of at least 10 digits, which starts from a random value each period, then counts up, so 
+        UUIDs generated by one Database object never repeat and sort in the order they were generated, and ones 
+        generated by other clients, eg laptops writing offline, are as unlikely to collide as 40 random bits. If a 
+        period's counter runs out, the next period is used early. See id_parts.
         
         n: The number of UUIDs to create.
-        length: The length of the UUID's hex component.
+        length: The length of the UUID's hex component. At least 10.
         prefix: Prefix for the UUID.
         '''
+        time_len, count_len, period = self.id_parts(length=length)
         ids = []
-        for _ in range(0, n):
-            hexstr = hex(random.randint(0, 16 ** length))[2:]
-            id = prefix + "0" * (length - len(hexstr)) + hexstr
-            ids.append(id)
+        with self.id_lock:
+            clock, count = self.id_clocks.get(length, (-1, 0))
+            now = (int(time.time()) - self.id_epoch) // period
+            if now > clock:
+                clock, count = now, random.randrange(16 ** count_len // 2)
+            for _ in range(0, n):
+                count += 1
+                if count >= 16 ** count_len:
+                    clock, count = clock + 1, random.randrange(16 ** count_len // 2)
+                stamp = f"{clock % 16 ** time_len:0{time_len}x}" if time_len > 0 else ""
+                ids.append(f"{prefix}{stamp}{count:0{count_len}x}")
+            self.id_clocks[length] = (clock, count)
         self.logger.debug(f"{n} UUIDs generated by Python")
         return ids
 
@@ -321,12 +907,40 @@ class Database:
         return response
 
 
-    def index_create(self, dbname: str, name: str, fields: list):
+    def id_parts(self, length: int):
+        '''Returns how id_create lays out a hex component of a length: (TIME DIGITS, COUNTER DIGITS, SECONDS PER PERIOD)
+
+        The counter keeps at least 10 digits, the rest, up to 8, are the leading digits of the seconds since id_epoch.
+        Of a 12 digit item UUID, the first 2 are the timestamp, which moves on about every 194 days, and the last 10 
+        the counter. A 32 digit document UUID has an 8 digit timestamp, which moves on every second.
+
+        length: The length of the UUID's hex component.
+        '''
+        time_len = min(8, max(0, length - 10))
+        return time_len, length - time_len, 16 ** (8 - time_len)
+
+
+    def id_skip(self, length: int = 12):
+        '''Moves id_create's counter ahead by a random amount, so the UUIDs it generates next come from a new random range.
+
+        Used after a generated UUID turns out to be taken, most likely by another client counting through the same range.
+
+        length: The length of the hex component to skip ahead for.
+        '''
+        time_len, count_len, period = self.id_parts(length=length)
+        with self.id_lock:
+            clock, count = self.id_clocks.get(length, ((int(time.time()) - self.id_epoch) // period, 0))
+            self.id_clocks[length] = (clock, count + random.randrange(1, max(2, (16 ** count_len - count) // 2)))
+        self.logger.debug(f"UUID counter for length {length} skipped ahead")
+
+
+    def index_create(self, dbname: str, name: str, fields: list, partitioned: bool = None):
         '''Creates a new MongoDB-style index and returns its id (name).
         
         dbname: Name of database to index.
         name: Name of the index. Also used as design doc's name.
         fields: List of dictionaries of form {"FIELDNAME" : "asc" | "desc"}, defining the index.
+        partitioned: In a partitioned database, true for an index used by partition queries, false for one used by global queries.
         '''
         if (dbname not in list(self.index_cache)): #new database to add indexes to the cache
             self.index_cache[dbname] = []          #create a blank list in the dictionary
@@ -338,7 +952,7 @@ class Database:
         for field in fields:
             index_field_list.append(IndexField(**field))
         index_definition = IndexDefinition(fields=index_field_list)
-        res = self.client.post_index(db=dbname, index=index_definition, ddoc=name, name=name, type="json").get_result()
+        res = self.client.post_index(db=dbname, index=index_definition, ddoc=name, name=name, partitioned=partitioned, type="json").get_result()
         id = res['id'][8:]
         self.logger.debug(f"Created index {dbname} {name}")
         return id
@@ -379,7 +993,7 @@ class Database:
         return False
 
 
-    def query(self, dbname: str, selector: dict = {}, fields: list = None, sort: list = None, limit: int = 25):
+    def query(self, dbname: str, selector: dict = {}, fields: list = None, sort: list = None, limit: int = 25, partition: str = None):
         '''Queries a database using MongoDB-style selectors & indexes.
         
         An index involving the 'sort' fields must exist, otherwise the query will fail.
@@ -390,9 +1004,20 @@ class Database:
         fields: List of fields to return: ["FIELD1", "FIELD2", ...]. If omitted, returns all fields.
         sort: List defining sort order: [{"FIELD1": "ASC"}, {"FIELD2": "DESC"}, ...]. If omitted, returns in ascending UUID order.
         limit: Number of docs to retrieve. Set arbitrary large to fetch all.
+        partition: If included, only queries this partition of a partitioned database, using its partitioned indexes.
         '''
-        res = self.client.post_find(db=dbname, selector=selector, fields=fields, sort=sort, limit=limit).get_result()
-        log = f"Queried database {dbname} using {{'selector': {selector}"
+        start = time.perf_counter()
+        if partition != None:
+            res = self.client.post_partition_find(db=dbname, partition_key=partition, selector=selector, fields=fields, sort=sort, limit=limit, execution_stats=True).get_result()
+        else:
+            res = self.client.post_find(db=dbname, selector=selector, fields=fields, sort=sort, limit=limit, execution_stats=True).get_result()
+        seconds = time.perf_counter()-start
+        if 'warning' in res:
+            self.query_warn(dbname=dbname, selector=selector, warning=res['warning'])
+        if seconds >= self.slow_query_seconds:
+            stats = res.get('execution_stats', {})
+            self.query_record(dbname=dbname, selector=selector, fields=fields, sort=sort, limit=limit, seconds=seconds, examined=stats.get('total_docs_examined', None), returned=len(res['docs']), partition=partition)
+        log = f"Queried database {dbname}{f' partition {partition}' if partition != None else ''} using {{'selector': {selector}"
         log += f", 'fields': {fields}" if fields != None else ""
         log += f", 'sort': {sort}" if sort != None else ""
         log += f", 'limit': {limit}}}"
@@ -400,6 +1025,139 @@ class Database:
         return res['docs']
 
 
+    def query_explain(self, dbname: str, selector: dict = {}, fields: list = None, sort: list = None, limit: int = 25, partition: str = None):
+        '''Returns which index a query would use: {"name": "NAME", "ddoc": "DDOC", "type": "json" | "special", "fields": [...]}
+
+        An index of type "special" named "_all_docs" means the query has to scan the whole database.
+
+        dbname: Name of database being queried.
+        selector: A MongoDB style selector: {"FIELDNAME" : {"OPERATOR": "VALUE"}, ... }.
+        fields: List of fields to return: ["FIELD1", "FIELD2", ...].
+        sort: List defining sort order: [{"FIELD1": "ASC"}, {"FIELD2": "DESC"}, ...].
+        limit: Number of docs to retrieve.
+        partition: If included, explains the query on this partition of a partitioned database.
+        '''
+        if partition != None:
+            res = self.client.post_partition_explain(db=dbname, partition_key=partition, selector=selector, fields=fields, sort=sort, limit=limit).get_result()
+        else:
+            res = self.client.post_explain(db=dbname, selector=selector, fields=fields, sort=sort, limit=limit).get_result()
+        index = res.get('index', {})
+        self.logger.debug(f"Explained query on database {dbname}; it uses index {index.get('name', None)}")
+        return {"name": index.get('name', None), "ddoc": index.get('ddoc', None), "type": index.get('type', None), "fields": index.get('def', {}).get('fields', [])}
+
+
+    def query_record(self, dbname: str, selector: dict, fields: list, sort: list, limit: int, seconds: float, examined: int = None, returned: int = None, partition: str = None):
+        '''Explains a slow query, then logs it and adds it to slow_queries:
+
+        {"time": "ISO TIME", "dbname": "DBNAME", "partition": "PARTITION", "selector": {...}, "fields": [...], "sort": [...], "limit": N, "seconds": S, 
+         "index": {see query_explain}, "examined": N, "returned": N}
+
+        dbname: Name of database that was queried.
+        selector: The query's selector.
+        fields: The query's fields.
+        sort: The query's sort order.
+        limit: The query's limit.
+        seconds: How long the query took.
+        examined: How many documents the server examined to answer it, if known.
+        returned: How many documents it returned.
+        partition: The partition queried, if any.
+        '''
+        try:
+            index = self.query_explain(dbname=dbname, selector=selector, fields=fields, sort=sort, limit=limit, partition=partition)
+        except ApiException as e:
+            index = {"name": None, "ddoc": None, "type": None, "fields": [], "error": e.message}
+        entry = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "dbname": dbname, "partition": partition, "selector": selector, "fields": fields, "sort": sort, "limit": limit, "seconds": seconds, "index": index, "examined": examined, "returned": returned}
+        self.slow_queries.append(entry)
+        self.logger.warning(f"Slow query on database {dbname} took {seconds:.3f} s, using index {index['name']}, examining {examined} docs to return {returned}: {json.dumps(selector)}")
+        if index['type'] == "special":
+            self.query_warn(dbname=dbname, selector=selector, warning=f"Query used the default {index['name']} index")
+
+
+    def query_warn(self, dbname: str, selector: dict, warning: str):
+        '''Warns that a query didn't use an index, once per database and set of selector fields.
+
+        dbname: Name of database that was queried.
+        selector: The query's selector.
+        warning: Why the query didn't use an index.
+        '''
+        shape = (dbname, tuple(sorted(selector)))
+        if shape in self.scan_warnings:
+            return
+        self.scan_warnings.add(shape)
+        self.logger.warning(f"Query on database {dbname} by fields {list(shape[1])} scans every document; consider indexing them. {warning}")
+
+
+    def rev_cache_drop(self, dbname: str, id: str):
+        '''Forgets the cached revision of a document, if any.
+
+        dbname: Name of database the document is in.
+        id: The UUID of the document.
+        '''
+        if self.rev_cache != None:
+            with self.rev_lock:
+                self.rev_cache.pop((dbname, id), None)
+
+
+    def rev_cache_get(self, dbname: str, id: str):
+        '''Returns the cached (revision, body) of a document, or None if it isn't cached.
+
+        The body is a copy, and is None if only the revision is known.
+
+        dbname: Name of database the document is in.
+        id: The UUID of the document.
+        '''
+        if self.rev_cache == None:
+            return None
+        with self.rev_lock:
+            if (dbname, id) not in self.rev_cache:
+                return None
+            self.rev_cache.move_to_end((dbname, id))
+            rev, doc = self.rev_cache[(dbname, id)]
+        return rev, copy.deepcopy(doc)
+
+
+    def rev_cache_set(self, dbname: str, id: str, rev: str, doc: dict = None):
+        '''Caches the latest revision of a document, evicting the least recently used if the cache is full.
+
+        dbname: Name of database the document is in.
+        id: The UUID of the document.
+        rev: The document's latest revision.
+        doc: If included, the document's latest body. A copy is kept.
+        '''
+        if self.rev_cache != None:
+            doc = copy.deepcopy(doc)
+            with self.rev_lock:
+                self.rev_cache[(dbname, id)] = (rev, doc)
+                self.rev_cache.move_to_end((dbname, id))
+                while len(self.rev_cache) > self.rev_cache_size:
+                    self.rev_cache.popitem(last=False)
+
+
+    def rows(self, dbname: str, startkey: str = None, endkey: str = None, include_docs: bool = False, limit: int = None, skip: int = 0, partition: str = None):
+        '''Returns the rows of a UUID range in a database: [{"id": "UUID", "key": "UUID", "value": {"rev": "REV"}}, ...]
+
+        dbname: Name of database to fetch rows from.
+        startkey: If included, document UUID to start fetching from.
+        endkey: If included, document UUID to stop fetching at.
+        include_docs: If true, includes each row's document under "doc".
+        limit: If included, the max number of rows to retrieve.
+        skip: Number of rows to skip first.
+        partition: If included, only fetches rows in this partition of a partitioned database.
+        '''
+        if partition != None:
+            res = self.client.post_partition_all_docs(db=dbname, partition_key=partition, include_docs=include_docs, startkey=startkey, endkey=endkey, limit=limit, skip=skip)
+        else:
+            res = self.client.post_all_docs(db=dbname, include_docs=include_docs, startkey=startkey, endkey=endkey, limit=limit, skip=skip)
+        return res.get_result()['rows']
+
+
+    def scheduler_docs(self):
+        '''Returns the replication scheduler's docs, describing the state of each replication on the server.'''
+        docs = self.client.get_scheduler_docs().get_result()['docs']
+        self.logger.debug(f"Fetched {len(docs)} replication scheduler docs")
+        return docs
+
+
     def server_check(self):
         '''Returns whether or not the CouchDB server is accessible.'''
         try:
@@ -413,6 +1171,621 @@ class Database:
         return False
 
 
+    def stats(self):
+        '''Returns the number and latency of requests made, per endpoint and per operation. See RequestStats.snapshot.
+
+        Set "stats" in the connection config to log a summary every so often, or serve the stats as text:
+        {"interval": SECONDS, "port": PORT}
+        '''
+        return self.metrics.snapshot()
+
+
+    def transport_setup(self, profile: dict = {}):
+        '''Configures how the client talks to the server over HTTP.
+
+        The profile is normally read from the "transport" section of the connection config. Keys left out keep their defaults:
+        {
+            "compress_requests": false,  # gzip request bodies
+            "compress_responses": true,  # ask for gzipped responses, which CouchDB or a proxy in front of it may honour
+            "keep_alive": true,  # reuse connections between requests
+            "pool_size": 10,  # max number of connections kept open
+            "timeouts": {"default": 10}  # seconds to wait, per endpoint: "_all_docs", "_bulk_docs", "_changes", "_find", "_view", ...
+        }
+        
+        profile: Settings to override the defaults with.
+        '''
+        self.transport = {"compress_requests": False, "compress_responses": True, "keep_alive": True, "pool_size": 10, "timeouts": {"default": 10}}
+        self.transport.update({key: value for key, value in profile.items() if key != "timeouts"})
+        self.transport["timeouts"] = {**self.transport["timeouts"], **profile.get("timeouts", {})}
+
+        session = requests.Session()
+        adapter = TransportAdapter(timeouts=self.transport["timeouts"], pool_size=self.transport["pool_size"], stats=self.metrics)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Accept-Encoding"] = "gzip" if self.transport["compress_responses"] == True else "identity"
+        if self.transport["keep_alive"] == False:
+            session.headers["Connection"] = "close"
+        self.client.set_http_client(session)
+        self.client.set_enable_gzip_compression(self.transport["compress_requests"])
+        self.logger.debug(f"Transport configured: {self.transport}")
+
+
+    def view_create(self, dbname: str, name: str, views: dict, version: int = None, lazy: bool = False, partitioned: bool = None):
+        '''Creates or replaces a design document of map-only views.
+
+        dbname: Name of database to create the views in.
+        name: Name of the design document.
+        views: Dictionary of {"VIEWNAME": "MAP FUNCTION SOURCE", ...}, defining the views.
+        version: If included, stored in the design document to tell revisions of it apart.
+        lazy: If true, won't replace an existing design document with the same version.
+        partitioned: In a partitioned database, false for views queried across every partition.
+
+        Returns true if the design document was created or replaced, false if it already existed.
+        '''
+        id = "_design/"+name
+        remote_doc = self.document_get(dbname=dbname, id=id, lazy=True)
+        if lazy == True and len(remote_doc) > 0 and remote_doc.get("version", None) == version:
+            self.logger.debug(f"Views {dbname} {name} version {version} already exist")
+            return False
+        view_list = {view: DesignDocumentViewsMapReduce(map=source) for view, source in views.items()}
+        options = DesignDocumentOptions(partitioned=partitioned) if partitioned != None else None
+        ddoc = DesignDocument(id=id, rev=remote_doc.get("_rev", None), language="javascript", options=options, views=view_list, version=version)
+        self.client.put_design_document(db=dbname, ddoc=name, design_document=ddoc)
+        self.logger.debug(f"Created views {dbname} {name} version {version}")
+        return True
+
+
+    def view_query(self, dbname: str, name: str, view: str, keys: list = None, include_docs: bool = False, limit: int = None):
+        '''Queries a map-only view and returns its rows: [{"id": "DOC ID", "key": KEY, "value": VALUE}, ...].
+
+        Rows are sorted by key, then by the id of the document that emitted them.
+
+        dbname: Name of database the view is in.
+        name: Name of the design document the view is in.
+        view: Name of the view.
+        keys: If included, only returns rows emitted with these keys. Should be sorted to keep rows sorted.
+        include_docs: If true, includes the document that emitted each row.
+        limit: If included, the max number of rows to retrieve.
+        '''
+        res = self.client.post_view(db=dbname, ddoc=name, view=view, keys=keys, include_docs=include_docs, limit=limit).get_result()
+        self.logger.debug(f"Queried view {dbname} {name}/{view}{f' for {len(keys)} keys' if keys != None else ''}")
+        return res['rows']
+
+
+# ----------------------------------------------------------------------------
+
+class ChangesFollower(abc.ABC):
+    '''A base class for in-memory copies of a database, kept up to date by following its _changes feed.
+
+    The database is loaded once, then its _changes feed is followed on a background thread. Subclasses implement 
+    load() and refresh(), which must set seq, and set synced after each successful feed response.
+
+    db: The associated Database object.
+    dbname: The name of the database being mirrored.
+    lock: Lock guarding the copy, so it can be read while the feed is being applied.
+    logger: The logger object used for logging.
+    seq: The last sequence id of the _changes feed that has been applied.
+    staleness: Max number of seconds since the last successful feed response before lookups fall back.
+    stopping: Event set once stop() is called.
+    synced: Time of the last successful feed response, as per time.monotonic().
+    thread: The thread following the feed, once started.
+    '''
+
+    def __init__(self, *, db: Database, dbname: str, level: str = "NOTSET", staleness: float = 10.0):
+        '''Constructs a ChangesFollower object. The copy is empty until start() or load() is called.
+
+        db: The Database object to load and follow the database with.
+        dbname: The name of the database.
+        level: Minimum level of logging messages to report; "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "NONE".
+        staleness: Max number of seconds since the last successful feed response before lookups fall back.
+        '''
+        self.logger = ml.get(type(self).__name__, level=level)
+        self.logger.debug(f"{type(self).__name__} object instantiated")
+        self.db = db
+        self.dbname = dbname
+        self.staleness = staleness
+        self.seq = None
+        self.synced = None
+        self.lock = threading.RLock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+
+    def follow(self):
+        '''Loads the copy, then applies changes from the _changes feed until stop() is called.'''
+        timeout = int(self.staleness*500)
+        while not self.stopping.is_set():
+            try:
+                if self.seq == None:
+                    self.load()
+                else:
+                    self.refresh(feed="longpoll", timeout=timeout)
+            except Exception as e:
+                self.logger.warning(f"Could not follow changes to {self.dbname}; will reload: {e}")
+                self.seq = None
+                self.stopping.wait(timeout=self.staleness/2)
+
+
+    def fresh(self):
+        '''Returns whether or not the copy is loaded and recently synced. Starts following the feed if needed.'''
+        if self.stopping.is_set() == False and (self.thread == None or self.thread.is_alive() == False):
+            self.start()
+        if self.seq == None or self.synced == None:
+            return False
+        age = time.monotonic() - self.synced
+        if age > self.staleness:
+            self.logger.debug(f"Copy of {self.dbname} is {age:.1f} seconds stale")
+            return False
+        return True
+
+
+    @abc.abstractmethod
+    def load(self):
+        '''Loads the database, replacing what's in memory. Implemented by subclasses.'''
+
+
+    @abc.abstractmethod
+    def refresh(self, feed: str = "normal", timeout: int = None):
+        '''Applies changes made to the database since the copy was last synced. Implemented by subclasses.
+
+        feed: "normal" to return immediately, "longpoll" to wait for a change before returning.
+        timeout: If feed is "longpoll", milliseconds to wait for a change before returning.
+        '''
+
+
+    def start(self):
+        '''Starts loading the copy and following the feed on a background thread.'''
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.follow, name=f"{type(self).__name__}-{self.dbname}", daemon=True)
+        self.thread.start()
+        self.logger.debug(f"Started following {self.dbname}")
+
+
+    def stop(self):
+        '''Stops following the feed. The copy stays in memory, but will go stale.'''
+        self.stopping.set()
+        self.logger.debug(f"Stopped following {self.dbname}")
+
+
+# ----------------------------------------------------------------------------
+
+class ContainmentIndex(ChangesFollower):
+    '''A class which keeps an in-memory copy of a container database's parent/child relationships.
+
+    The container database is loaded once, then its _changes feed is followed on a background
+    thread. Lookups made through rows() are answered from memory. Callers should check fresh()
+    first, and fall back to querying the database when the copy may be out of date.
+
+    children: Dictionary of {container: {child: container id}}.
+    edges: Dictionary of {container id: (container, child)}.
+    parents: Dictionary of {child: {container: container id}}.
+    See ChangesFollower for the rest.
+    '''
+
+    def __init__(self, *, db: Database, dbname: str, level: str = "NOTSET", staleness: float = 10.0):
+        '''Constructs a ContainmentIndex object. The index is empty until start() or load() is called.
+
+        db: The Database object to load and follow the container database with.
+        dbname: The name of the container database.
+        level: Minimum level of logging messages to report; "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "NONE".
+        staleness: Max number of seconds since the last successful feed response before lookups fall back.
+        '''
+        super().__init__(db=db, dbname=dbname, level=level, staleness=staleness)
+        self.children = {}
+        self.parents = {}
+        self.edges = {}
+
+
+    def add(self, container: str, child: str, id: str = None):
+        '''Records that a container contains a child.
+
+        container: The UUID of the container.
+        child: The UUID of the child.
+        id: The container id of the relationship. If omitted, it's built from the container and child.
+        '''
+        id = id if id != None else container+"/"+child
+        with self.lock:
+            self.edges[id] = (container, child)
+            self.children.setdefault(container, {})[child] = id
+            self.parents.setdefault(child, {})[container] = id
+
+
+    def discard(self, id: str):
+        '''Forgets a container/child relationship, if it's known.
+
+        id: The container id of the relationship.
+        '''
+        with self.lock:
+            if id in self.edges:
+                container, child = self.edges.pop(id)
+                self.children.get(container, {}).pop(child, None)
+                self.parents.get(child, {}).pop(container, None)
+                if len(self.children.get(container, {})) == 0:
+                    self.children.pop(container, None)
+                if len(self.parents.get(child, {})) == 0:
+                    self.parents.pop(child, None)
+
+
+    def load(self):
+        '''Loads every container/child relationship from the database, replacing what's in memory.'''
+        self.logger.info(f"Loading containment index from {self.dbname}")
+        seq = self.db.changes(dbname=self.dbname, since="now")["last_seq"]
+        docs = self.db.documents_list(dbname=self.dbname, limit=None)
+        with self.lock:
+            self.children = {}
+            self.parents = {}
+            self.edges = {}
+        for doc in docs:
+            if "container" in doc and "child" in doc:
+                self.add(container=doc["container"], child=doc["child"], id=doc["_id"])
+        self.seq = seq
+        self.refresh()
+        self.logger.debug(f"Done loading containment index; {len(self.edges)} relationships")
+
+
+    def refresh(self, feed: str = "normal", timeout: int = None):
+        '''Applies changes made to the database since the index was last synced.
+
+        feed: "normal" to return immediately, "longpoll" to wait for a change before returning.
+        timeout: If feed is "longpoll", milliseconds to wait for a change before returning.
+        '''
+        res = self.db.changes(dbname=self.dbname, since=self.seq, include_docs=True, feed=feed, timeout=timeout)
+        for change in res["results"]:
+            doc = change.get("doc") or {}
+            if change.get("deleted", False) == True:
+                self.discard(id=change["id"])
+            elif "container" in doc and "child" in doc:
+                self.add(container=doc["container"], child=doc["child"], id=change["id"])
+        self.seq = res["last_seq"]
+        self.synced = time.monotonic()
+
+
+    def rows(self, items: list, up: bool = False):
+        '''Returns the relationships of some items, shaped and sorted like a containers query.
+
+        Returns a list of {"_id": container id, "container": container, "child": child}.
+
+        items: Items to return the relationships of.
+        up: If true, returns relationships where the items are the child, instead of the container.
+        '''
+        adjacency = self.parents if up == True else self.children
+        rows = []
+        with self.lock:
+            for near in sorted(set(items)):
+                for far, id in sorted(adjacency.get(near, {}).items()):
+                    if up == True:
+                        rows.append({"_id": id, "container": far, "child": near})
+                    else:
+                        rows.append({"_id": id, "container": near, "child": far})
+        return rows
+
+
+# ----------------------------------------------------------------------------
+
+class PhysidCache(ChangesFollower):
+    '''A class which keeps an in-memory mapping of physical IDs to the items they're associated with.
+
+    The ids database is loaded in bulk, then its _changes feed is followed on a background thread. Once more than 
+    size physical IDs are known, the least recently used are evicted. Lookups made through lookup() are answered from 
+    memory; callers should check fresh() first, and fall back to querying the database on a miss.
+
+    complete: Whether or not every physical ID in the database is in memory, so unknown ones don't exist.
+    hits: Number of lookups answered from memory.
+    misses: Number of lookups that had to fall back to the database.
+    physids: OrderedDict of {physid: [item, ...]}, least recently used first.
+    size: Max number of physical IDs kept in memory.
+    See ChangesFollower for the rest.
+    '''
+
+    def __init__(self, *, db: Database, dbname: str, level: str = "NOTSET", size: int = 100000, staleness: float = 10.0):
+        '''Constructs a PhysidCache object. The cache is empty until start() or load() is called.
+
+        db: The Database object to load and follow the ids database with.
+        dbname: The name of the ids database.
+        level: Minimum level of logging messages to report; "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "NONE".
+        size: Max number of physical IDs kept in memory.
+        staleness: Max number of seconds since the last successful feed response before lookups fall back.
+        '''
+        super().__init__(db=db, dbname=dbname, level=level, staleness=staleness)
+        self.complete = False
+        self.hits = 0
+        self.misses = 0
+        self.physids = OrderedDict()
+        self.size = size
+
+
+    def add(self, physid: str, item: str):
+        '''Records that a physical ID is associated with an item, evicting the least recently used if needed.
+
+        physid: The physical ID.
+        item: The UUID of the item.
+        '''
+        with self.lock:
+            items = self.physids.get(physid, [])
+            if item not in items:
+                self.store(physid=physid, items=sorted(items+[item]))
+
+
+    def discard(self, id: str):
+        '''Forgets that a physical ID is associated with an item, if it's known.
+
+        id: The UUID of the ids doc: "ITEM/PHYSID".
+        '''
+        item, physid = self.split(id=id)
+        with self.lock:
+            if item in self.physids.get(physid, []):
+                self.physids[physid] = [known for known in self.physids[physid] if known != item]
+
+
+    def load(self):
+        '''Loads physical IDs from the database, a page at a time, replacing what's in memory.'''
+        self.logger.info(f"Loading physical ID cache from {self.dbname}")
+        seq = self.db.changes(dbname=self.dbname, since="now")["last_seq"]
+        with self.lock:
+            self.physids = OrderedDict()
+            self.complete = True
+        for doc in self.db.documents_iter(dbname=self.dbname):
+            if "physid" in doc and "item" in doc:
+                self.add(physid=doc["physid"], item=doc["item"])
+        self.seq = seq
+        self.refresh()
+        self.logger.debug(f"Done loading physical ID cache; {len(self.physids)} physical IDs{'' if self.complete == True else ', some evicted'}")
+
+
+    def lookup(self, physid: str):
+        '''Returns the items associated with a physical ID, or None if it isn't in memory.
+
+        If every physical ID is in memory, unknown ones return an empty list instead.
+
+        physid: The physical ID to look up.
+        '''
+        with self.lock:
+            if physid in self.physids:
+                self.physids.move_to_end(physid)
+                self.hits += 1
+                return list(self.physids[physid])
+            if self.complete == True:
+                self.hits += 1
+                return []
+            self.misses += 1
+            return None
+
+
+    def refresh(self, feed: str = "normal", timeout: int = None):
+        '''Applies changes made to the database since the cache was last synced.
+
+        feed: "normal" to return immediately, "longpoll" to wait for a change before returning.
+        timeout: If feed is "longpoll", milliseconds to wait for a change before returning.
+        '''
+        res = self.db.changes(dbname=self.dbname, since=self.seq, include_docs=True, feed=feed, timeout=timeout)
+        for change in res["results"]:
+            doc = change.get("doc") or {}
+            if change.get("deleted", False) == True:
+                self.discard(id=change["id"])
+            elif "physid" in doc and "item" in doc:
+                self.add(physid=doc["physid"], item=doc["item"])
+        self.seq = res["last_seq"]
+        self.synced = time.monotonic()
+
+
+    def split(self, id: str):
+        '''Splits the UUID of an ids doc into its item and physical ID, returned as (ITEM, PHYSID).
+
+        id: The UUID: "CATEGORY/HEX/PHYSID", or if partitioned, "CATEGORY:HEX/PHYSID".
+        '''
+        cat, _ = id.split("/", 1)
+        parts = 1 if ":" in cat else 2
+        *item, physid = id.split("/", parts)
+        return "/".join(item), physid
+
+
+    def store(self, physid: str, items: list):
+        '''Stores the items associated with a physical ID, as found by querying the database.
+
+        physid: The physical ID.
+        items: The UUIDs of the items.
+        '''
+        with self.lock:
+            self.physids[physid] = list(items)
+            self.physids.move_to_end(physid)
+            while len(self.physids) > self.size:
+                self.physids.popitem(last=False)
+                self.complete = False
+
+
+# ----------------------------------------------------------------------------
+
+class PhotoCache:
+    '''A class which keeps photos on disk, so they're only downloaded again when they change.
+
+    Files are named after the MD5 digest of their contents, the same digest CouchDB reports for attachments, so a 
+    photo is found by looking up its item's current digests. Those are checked against the server in bulk, and 
+    trusted for staleness seconds; see DEHCDatabase.photos_validate. Once the files take up more than size bytes, 
+    the least recently used are deleted.
+
+    digests: The attachment digests of items' photos, and when they were checked: {UUID: ({"NAME": "md5-BASE64", ...} or None, SECONDS), ...}
+    directory: The folder the files are kept in.
+    files: OrderedDict of {filename: bytes}, least recently used first.
+    hits: Number of photos loaded from disk.
+    lock: Lock guarding the cache, so it can be shared between threads.
+    logger: The logger object used for logging.
+    misses: Number of photos that had to be downloaded.
+    size: Max number of bytes of files kept.
+    staleness: Max number of seconds since an item's digests were checked before they're checked again.
+    used: Number of bytes of files kept.
+    '''
+
+    def __init__(self, *, directory: str, level: str = "NOTSET", size: int = 256*1024*1024, staleness: float = 10.0):
+        '''Constructs a PhotoCache object, picking up any files already in its directory.
+
+        directory: The folder to keep files in. Created if it doesn't exist.
+        level: Minimum level of logging messages to report; "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "NONE".
+        size: Max number of bytes of files kept.
+        staleness: Max number of seconds since an item's digests were checked before they're checked again.
+        '''
+        self.logger = ml.get(name="PhotoCache", level=level)
+        self.logger.debug("PhotoCache object instantiated")
+        self.digests = {}
+        self.directory = directory
+        self.files = OrderedDict()
+        self.hits = 0
+        self.lock = threading.Lock()
+        self.misses = 0
+        self.size = size
+        self.staleness = staleness
+        self.used = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self.scan()
+
+
+    def digest(self, data: bytes):
+        '''Returns the digest CouchDB gives an attachment: "md5-BASE64".
+
+        data: The contents of the attachment.
+        '''
+        return "md5-" + base64.b64encode(hashlib.md5(data).digest()).decode('utf-8')
+
+
+    def evict(self):
+        '''Deletes the least recently used files until the rest fit in size. Must be called holding lock.'''
+        while self.used > self.size and len(self.files) > 0:
+            filename, length = self.files.popitem(last=False)
+            self.used -= length
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+
+
+    def filename(self, digest: str):
+        '''Returns the name of the file a digest's contents are kept in.
+
+        digest: The digest: "md5-BASE64".
+        '''
+        return base64.b64decode(digest.split("-", 1)[1]).hex() + ".jpg"
+
+
+    def get(self, digest: str):
+        '''Returns the contents with a digest, or None if they aren't on disk.
+
+        digest: The digest: "md5-BASE64".
+        '''
+        filename = self.filename(digest=digest)
+        with self.lock:
+            if filename not in self.files:
+                self.misses += 1
+                return None
+            self.files.move_to_end(filename)
+        try:
+            with open(os.path.join(self.directory, filename), "rb") as f:
+                data = f.read()
+            os.utime(os.path.join(self.directory, filename))  # So the order survives a restart
+        except OSError:
+            with self.lock:
+                self.used -= self.files.pop(filename, 0)
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return data
+
+
+    def lookup(self, item: str):
+        '''Returns (True, digests) if an item's attachment digests were checked recently enough to be trusted, otherwise (False, None).
+
+        digests is None if the item has no photo: {"NAME": "md5-BASE64", ...}
+
+        item: The UUID of the item.
+        '''
+        with self.lock:
+            digests, checked = self.digests.get(item, (None, None))
+        if checked == None or time.monotonic() - checked > self.staleness:
+            return False, None
+        return True, digests
+
+
+    def put(self, data: bytes):
+        '''Keeps some contents on disk, evicting the least recently used files if needed, and returns their digest.
+
+        data: The contents to keep.
+        '''
+        digest = self.digest(data=data)
+        filename = self.filename(digest=digest)
+        path = os.path.join(self.directory, filename)
+        with self.lock:
+            if filename in self.files:
+                self.files.move_to_end(filename)
+                return digest
+        with open(path+".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path+".tmp", path)
+        with self.lock:
+            if filename not in self.files:
+                self.files[filename] = len(data)
+                self.used += len(data)
+            self.evict()
+        return digest
+
+
+    def record(self, item: str, digests: dict):
+        '''Records the current attachment digests of an item's photo, as just checked.
+
+        item: The UUID of the item.
+        digests: The digests: {"NAME": "md5-BASE64", ...}, or None if the item has no photo.
+        '''
+        with self.lock:
+            self.digests[item] = (dict(digests) if digests != None else None, time.monotonic())
+
+
+    def scan(self):
+        '''Picks up the files already in the directory, least recently used first, evicting any over size.'''
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".jpg"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        with self.lock:
+            for _, filename, length in sorted(entries):
+                self.files[filename] = length
+                self.used += length
+            self.evict()
+        self.logger.debug(f"Found {len(self.files)} cached photos in {self.directory}, {self.used} bytes")
+
+
+# ----------------------------------------------------------------------------
+
+def wrap_operation(function):
+    '''Returns a version of a DEHCDatabase method which pushes its name onto the operation stack while it runs,
+    so the requests it makes are attributed to it. Generator functions only do so while fetching each item, and are 
+    closed as soon as the caller stops iterating, so their cleanup runs then instead of whenever they're collected.
+
+    function: The method to wrap.
+    '''
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def iterate(self, *args, **kwargs):
+            generator = function(self, *args, **kwargs)
+            call = True
+            try:
+                while True:
+                    with self.db.metrics.measure(operation=function.__name__, call=call):
+                        try:
+                            item = next(generator)
+                        except StopIteration:
+                            return
+                    call = False
+                    yield item
+            finally:
+                with self.db.metrics.measure(operation=function.__name__, call=False):
+                    generator.close()
+        return iterate
+    @functools.wraps(function)
+    def call(self, *args, **kwargs):
+        with self.db.metrics.measure(operation=function.__name__):
+            return function(self, *args, **kwargs)
+    return call
+
+
 # ----------------------------------------------------------------------------
 
 class DEHCDatabase:
@@ -421,6 +1794,7 @@ class DEHCDatabase:
     This class is specific to DEHC and is the one to import into the apps. 
     Importing the Database class up above should not be necessary.
     
+    containment: The associated ContainmentIndex object, if one is being used.
     db: The associated Database object.
     db_list: List of DEHC database names.
     db_items: The name of the items database.
@@ -433,23 +1807,35 @@ class DEHCDatabase:
     limit: Max number of documents to return from _list and _query methods.
     logger: The logger object used for logging.
     forcelocal: If true, uses local schema over one stored in the database.
+    partitioned: Whether or not the items, containers and ids databases are partitioned, with item categories as partition keys.
+    photo_cache: The associated PhotoCache object, if one is being used.
+    photo_name: The name of the attachment photos are saved as, on their "photo-UUID" documents in the files database.
+    photo_sizes: Sizes, in pixels, of the renditions saved alongside each photo, as "photo-SIZE.jpg" attachments.
+    physid_cache: The associated PhysidCache object, if one is being used.
     schema: Dictionary describing objects and fields in the database.
     schema_path: Path to .json file containing database schema.
+    views_ready: Whether or not the views used by queries are known to be up to date.
+    views_version: The version of the views used by queries. Bump it whenever their map functions change.
     '''
 
-    def __init__(self, *, config: str, version: str, forcelocal: bool = False, level: str = "NOTSET", namespace: str = "dehc", overridedbversion: bool = False, schema: str = "db_schema.json", updateschema: bool = False, quickstart: bool = False):
+    def __init__(self, *, config: str, version: str, containment: bool = False, forcelocal: bool = False, level: str = "NOTSET", namespace: str = "dehc", overridedbversion: bool = False, partitioned: bool = None, photocache: str = None, physidcache: bool = False, revcache: bool = False, schema: str = "db_schema.json", updateschema: bool = False, quickstart: bool = False):
         '''Constructs a DEHCDatabase object.
 
-        config: Required. Path to .json file containing database server credentials.
+        config: Required. Path to .json file containing database server credentials, or a local backend; see database_open.
         version: Required. The version of the schema the database is expecting to use.
+        containment: If true, answers container lookups from an in-memory ContainmentIndex whenever it's fresh.
         level: Minimum level of logging messages to report; "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "NONE".
         namespace: A name to prefix all CouchDB databases with.
+        partitioned: If true, creates databases partitioned by item category. If omitted, detects whether existing ones are.
+        photocache: If included, keeps photos in a PhotoCache in this folder, so they're only downloaded again when they change.
+        physidcache: If true, resolves physical IDs from an in-memory PhysidCache whenever it's fresh.
         quickstart: Creates databases and loads schema automatically.
+        revcache: If true, caches the revisions of documents read and written, so most edits take a single request.
         schema: Path to .json file containing database schema, if required.
         '''
         self.logger = ml.get(name="DEHCDatabase", level=level)
         self.logger.debug("DEHCDatabase object instantiated")
-        self.db = Database(config=config, level=level)
+        self.db = database_open(config=config, level=level, revcache=revcache)
 
         self.namespace = namespace
         self.db_items = self.namespace+"-items"
@@ -462,6 +1848,14 @@ class DEHCDatabase:
 
         self.id_len = 12
         self.limit = 1000000
+        self.partitioned = partitioned if partitioned != None else self.partitioned_detect()
+        self.photo_cache = PhotoCache(directory=photocache, level=level) if photocache != None else None
+        self.photo_name = "photo.jpg"
+        self.photo_sizes = [64, 256, 512]
+        self.containment = ContainmentIndex(db=self.db, dbname=self.db_containers, level=level) if containment == True else None
+        self.physid_cache = PhysidCache(db=self.db, dbname=self.db_ids, level=level) if physidcache == True else None
+        self.views_ready = False
+        self.views_version = 2
 
         self.forcelocal = forcelocal
         self.overridedbversion = overridedbversion
@@ -478,18 +1872,20 @@ class DEHCDatabase:
             self.logger.debug(f"Completed quickstart")
 
 
+    @wrap_operation
     def databases_create(self, lazy: bool = False):
         '''Creates DEHC databases.
         
         lazy: If true, won't error if databases already exist.
         '''
-        self.logger.info(f"Creating DEHC databases")
+        self.logger.info(f"Creating {'partitioned ' if self.partitioned == True else ''}DEHC databases")
         for db in self.db_list:
             if lazy == False or self.db.database_exists(db) == False:
-                self.db.database_create(db)
+                self.db.database_create(db, partitioned=self.partitioned == True and db in [self.db_items, self.db_containers, self.db_ids])
         self.logger.debug(f"Done creating DEHC databases")
 
 
+    @wrap_operation
     def databases_clear(self, lazy: bool = False):
         '''Removes all files from DEHC databases.
         
@@ -498,12 +1894,18 @@ class DEHCDatabase:
         self.logger.info(f"Emptying DEHC databases")
         for db in self.db_list:
             if lazy == False or self.db.database_exists(db) == True:
-                items = self.db.documents_list(dbname=db, limit=self.limit)
-                items = [item["_id"] for item in items]
+                items = []
+                for item in self.db.documents_iter(dbname=db, include_docs=False):
+                    items.append(item["_id"])
+                    if len(items) == self.db.chunk_size:
+                        self.db.documents_delete(dbname=db, ids=items)
+                        items = []
                 self.db.documents_delete(dbname=db, ids=items)
+        self.views_ready = False
         self.logger.debug(f"Done emptying DEHC databases")
 
     
+    @wrap_operation
     def databases_delete(self, lazy: bool = False):
         '''Deletes DEHC databases.
         
@@ -513,9 +1915,11 @@ class DEHCDatabase:
         for db in self.db_list:
             if lazy == False or self.db.database_exists(db) == True:
                 self.db.database_delete(db)
+        self.views_ready = False
         self.logger.debug(f"Done dropping DEHC databases")
 
 
+    @wrap_operation
     def container_add(self, container: str, item: str, lazy: bool = False):
         '''Puts an item in a container.
         
@@ -528,24 +1932,32 @@ class DEHCDatabase:
         if lazy == False or self.db.document_exists(dbname=self.db_containers, id=idc) == False:
             doc = {"container": container, "child": item}
             self.db.document_create(dbname=self.db_containers, doc=doc, id=idc)
+            if self.containment != None:
+                self.containment.add(container=container, child=item, id=idc)
         self.logger.debug(f"Done adding {item} to {container}")
         return idc
 
 
-    def container_adds(self, container: str, items: list):
+    @wrap_operation
+    def container_adds(self, container: str, items: list, workers: int = 1):
         '''Puts multiple items in a container.
         
         container: The UUID of the container.
         items: The UUIDs of the items.
+        workers: Max number of bulk requests to send concurrently.
         '''
         self.logger.info(f"Adding {len(items)} items to {container}")
         ids_list = [container+"/"+item for item in items]
         docs_list = [{"container": container, "child": item} for item in items]
-        self.db.documents_create(dbname=self.db_containers, ids=ids_list, docs=docs_list)
+        self.db.documents_create(dbname=self.db_containers, ids=ids_list, docs=docs_list, workers=workers)
+        if self.containment != None:
+            for id, doc in zip(ids_list, docs_list):
+                self.containment.add(container=doc["container"], child=doc["child"], id=id)
         self.logger.debug(f"Done adding {len(items)} items to {container}")
         return ids_list
 
 
+    @wrap_operation
     def container_children(self, container: str, cat: list = None, result: str = "ITEM", limit: int = None):
         '''Returns flat list, listing items contained by a container.
 
@@ -555,11 +1967,7 @@ class DEHCDatabase:
         fast: If true, the function only returns the first child (by UUID) instead of all children.
         '''
         self.logger.debug(f"Finding children of {container}")
-        limit = limit if limit != None else self.limit
-        selector = {'container': {'$eq': container}}
-        fields = ['_id', 'child']
-        sort = [{'container': 'asc'}, {'child': 'asc'}]
-        query = self.containers_query(selector=selector, fields=fields, sort=sort, limit=limit)
+        query = self.containers_edges(items=[container], limit=limit)
         if result == "CON":
             children = [row['_id'] for row in query if cat == None or self.id_cat(row['child']) in cat]
         elif result == "ITEM" or result == "DOC":
@@ -571,6 +1979,7 @@ class DEHCDatabase:
         return children
 
 
+    @wrap_operation
     def container_children_all(self, container: str, cat: list = None, result: str = "ITEM"):
         '''Returns flat list, listing items contained by a container and its sub-containers, recursively.
 
@@ -583,6 +1992,7 @@ class DEHCDatabase:
         return children
 
 
+    @wrap_operation
     def container_children_all_dict(self, container: str, cat: list = None):
         '''Returns nested dictionary, listing items contained by a container and all sub-containers, recursively.
 
@@ -596,6 +2006,7 @@ class DEHCDatabase:
         return children
 
 
+    @wrap_operation
     def container_children_dict(self, container: str, cat: list = None):
         '''Returns dictionary, listing items contained by a container.
 
@@ -606,6 +2017,7 @@ class DEHCDatabase:
         return children
 
 
+    @wrap_operation
     def container_exists(self, container: str, item: str):
         '''Returns whether or not a container-item relationship exists.
         
@@ -619,6 +2031,7 @@ class DEHCDatabase:
         return result
 
 
+    @wrap_operation
     def container_move(self, from_con: str, to_con: str, item: str, lazy: bool = False):
         '''Moves an item from one container to another.
         
@@ -634,6 +2047,7 @@ class DEHCDatabase:
         self.logger.debug(f"Done moving {item} from {from_con} to {to_con}")
 
 
+    @wrap_operation
     def container_moves(self, from_con: str, to_con: str, items: list, lazy: bool = False):
         '''Moves multiple items from one container to another.
         
@@ -649,6 +2063,7 @@ class DEHCDatabase:
         self.logger.debug(f"Done moving {len(items)} items from {from_con} to {to_con}")
 
 
+    @wrap_operation
     def container_remove(self, container: str, item: str, lazy: bool = False):
         '''Removes an item from a container.
         
@@ -659,9 +2074,12 @@ class DEHCDatabase:
         self.logger.info(f"Removing {item} from {container}")
         id = container+"/"+item
         self.db.document_delete(dbname=self.db_containers, id=id, lazy=lazy)
+        if self.containment != None:
+            self.containment.discard(id=id)
         self.logger.debug(f"Done removing {item} from {container}")
 
 
+    @wrap_operation
     def container_removes(self, container: str, items: list, lazy: bool = False):
         '''Removes multiple items from a container.
         
@@ -672,9 +2090,13 @@ class DEHCDatabase:
         self.logger.info(f"Removing {len(items)} items from {container}")
         ids = [container+"/"+item for item in items]
         self.db.documents_delete(dbname=self.db_containers, ids=ids, lazy=lazy)
+        if self.containment != None:
+            for id in ids:
+                self.containment.discard(id=id)
         self.logger.debug(f"Done removing {len(items)} items from {container}")
 
 
+    @wrap_operation
     def containers_children(self, containers: list, cat: list = None, result: str = "ITEM"):
         '''Returns flat list, listing items contained by multiple containers.
 
@@ -683,13 +2105,7 @@ class DEHCDatabase:
         result: "ITEM" to return item ids, "CON" to return container ids, "DOC" to return item documents.
         '''
         self.logger.debug(f"Finding children of {len(containers)} containers")
-        if len(containers) != 1:
-            selector = {'container': {'$in': containers}}
-        else:
-            selector = {'container': {'$eq': containers[0]}}
-        fields = ['_id', 'child']
-        sort = [{'container': 'asc'}, {'child': 'asc'}]
-        query = self.containers_query(selector=selector, fields=fields, sort=sort)
+        query = self.containers_edges(items=containers)
         if result == "CON":
             children = [row['_id'] for row in query if cat == None or self.id_cat(row['child']) in cat]
             children = list(dict.fromkeys(children))
@@ -703,6 +2119,7 @@ class DEHCDatabase:
         return children
 
 
+    @wrap_operation
     def containers_children_all(self, containers: str, cat: list = None, result: str = "ITEM"):
         '''Returns flat list, listing items contained by some containers and all sub-containers, recursively.
 
@@ -711,27 +2128,13 @@ class DEHCDatabase:
         result: "ITEM" to return item ids, "CON" to return container ids, "DOC" to return item documents.
         '''
         self.logger.debug(f"Finding all children and sub-children of {len(containers)} containers")
-        seen_ids = []
-        children = []
-        current_containers = containers
-        while True:
-            ids = self.containers_children(containers=current_containers, result="ITEM")
-
-            # Infinite loop protection
-            for id in ids:
-                if id not in seen_ids:
-                    seen_ids.append(id)
-                else:
-                    self.logger.error(f"Infinite container loop detected; '{id}' encountered twice")
-                    return children
-            if len(ids) > 0:
-                children += self.containers_children(containers=current_containers, result=result, cat=cat)
-                current_containers = ids
-            else:
-                break
-        return children
+        if result not in ["ITEM", "CON", "DOC"]:
+            raise ValueError("result should be one of ITEM, CON or DOC")
+        walk = self.tree_walk(items=containers, cat=cat, docs=result == "DOC")
+        return walk[result]
 
 
+    @wrap_operation
     def containers_children_all_dict(self, containers: list, cat: list = None):
         '''Returns nested dictionary, listing items contained by multiple containers and all sub-containers, recursively.
     
@@ -754,6 +2157,7 @@ class DEHCDatabase:
         return results
 
 
+    @wrap_operation
     def containers_children_dict(self, containers: list, cat: list = None):
         '''Returns dictionary of lists, listing items contained by multiple containers.
 
@@ -761,10 +2165,7 @@ class DEHCDatabase:
         cat: If included, only returns children of these categories.
         '''
         self.logger.debug(f"Finding children of {len(containers)} containers")
-        selector = {'container': {'$in': containers}}
-        fields = ['_id', 'container', 'child']
-        sort = [{'container': 'asc'}, {'child': 'asc'}]
-        query = self.containers_query(selector=selector, fields=fields, sort=sort)
+        query = self.containers_edges(items=containers)
         children = {container: [] for container in containers} 
         for row in query:
             child = row['child']
@@ -773,6 +2174,35 @@ class DEHCDatabase:
         return children
 
 
+    @wrap_operation
+    def containers_edges(self, items: list, up: bool = False, limit: int = None):
+        '''Returns the container docs relating some items to their children (or parents).
+
+        Answers from the containment index when it's fresh. Otherwise, children are found by UUID range,
+        as container ids are always "CONTAINER/CHILD", and parents are found using the containment view.
+        Returns a list of {"_id": container id, "container": container, "child": child}, sorted by item.
+
+        items: Items to return the relationships of.
+        up: If true, returns relationships where the items are the child, instead of the container.
+        limit: If specified, overrides the internally defined limit of for how many rows can be returned.
+        '''
+        limit = limit if limit != None else self.limit
+        if self.containment != None and self.containment.fresh() == True:
+            return self.containment.rows(items=items, up=up)[:limit]
+        if up == False:
+            containers = sorted(set(items))
+            ranges = [(container+"/", container+"/\ufff0") for container in containers]
+            results = self.db.documents_ranges(dbname=self.db_containers, ranges=ranges, limit=limit)
+            rows = [{'_id': row['id'], 'container': container, 'child': row['id'][len(container)+1:]} for container, result in zip(containers, results) for row in result]
+            return rows[:limit]
+        if self.views_ready == False:
+            self.views_prepare()
+        keys = sorted(set(items))
+        rows = self.db.view_query(dbname=self.db_containers, name="containment", view="parents", keys=keys, limit=limit)
+        return [{'_id': row['id'], 'child': row['key'], 'container': row['value']} for row in rows]
+
+
+    @wrap_operation
     def containers_list(self):
         '''Retrieves every doc from container database. Intensive!'''
         self.logger.debug(f"Retrieving all containers")
@@ -781,6 +2211,18 @@ class DEHCDatabase:
         return docs
 
 
+    @wrap_operation
+    def containers_iter(self, page_size: int = None):
+        '''Yields every doc from container database, a page at a time.
+        
+        page_size: Number of docs to fetch per request. If omitted, uses the database's default.
+        '''
+        self.logger.debug(f"Iterating over all containers")
+        yield from self.db.documents_iter(dbname=self.db_containers, page_size=page_size)
+        self.logger.debug(f"Done iterating over all containers")
+
+
+    @wrap_operation
     def containers_query(self, selector: dict = {}, fields: list = None, sort: list = None, limit: int = None):
         '''Queries the container database and returns the results.
 
@@ -799,12 +2241,13 @@ class DEHCDatabase:
                 key = next(iter(field.keys()))
                 index_name += f"-{key}"
             if self.db.index_exists(dbname=self.db_containers, name=index_name) == False:
-                self.db.index_create(dbname=self.db_containers, name=index_name, fields=sort)
+                self.db.index_create(dbname=self.db_containers, name=index_name, fields=sort, partitioned=False if self.partitioned == True else None)
         res = self.db.query(dbname=self.db_containers, selector=selector, fields=fields, sort=sort, limit=limit)
         self.logger.debug(f"Done querying the containers database")
         return res
 
 
+    @wrap_operation
     def flag_assign_tree(self, container: str, flag: str):
         '''Assigns a flag to an item and all its children recursively.
         
@@ -827,6 +2270,7 @@ class DEHCDatabase:
         self.items_edit(ids=ids, data=data, lazy=True)
 
 
+    @wrap_operation
     def flag_revoke_tree(self, container: str, flag: str):
         '''Revokes a flag from an item and all its children recursively.
         
@@ -852,20 +2296,26 @@ class DEHCDatabase:
     def id_cat(self, id: str):
         '''Takes a database id and returns its category.
         
-        id: The UUID to extract the category of.
+        id: The UUID to extract the category of, either "CATEGORY/HEX" or, if partitioned, "CATEGORY:HEX".
         '''
-        cat, *_ = id.split("/")
+        cat, *_ = id.replace(":", "/").split("/")
         return cat
 
 
+    @wrap_operation
     def ids_edit(self, item: str, ids: list):
         '''Edits what physical IDs are associated with an item.
+
+        They're also copied onto the item, under "physids", so the lookup view used by get_items_by_any_ids finds them.
+        The revisions of the old IDs are listed alongside them, so deleting them needn't look them up again.
         
         item: The item to edit the physical IDs of.
         ids: A list of strings, consisting of all physical IDs associated with an item.
         '''
         self.logger.info(f"Editing physical IDs of {item}")
-        old_ids = set(self.ids_get(item=item))
+        rows, = self.db.documents_ranges(dbname=self.db_ids, ranges=[(item+"/", item+"/\ufff0")])
+        revs = {row['id']: row['value']['rev'] for row in rows}
+        old_ids = {row['id'][len(item)+1:] for row in rows}
         new_ids = set(ids)
         ids_to_create = list(new_ids - old_ids)
         ids_to_delete = list(old_ids - new_ids)
@@ -873,34 +2323,71 @@ class DEHCDatabase:
             docs_create = [{"item": item, "physid": physid} for physid in ids_to_create]
             ids_create = [f"{item}/{physid}" for physid in ids_to_create]
             self.db.documents_create(dbname=self.db_ids, docs=docs_create, ids=ids_create)
+            if self.physid_cache != None:
+                for physid in ids_to_create:
+                    self.physid_cache.add(physid=physid, item=item)
         if len(ids_to_delete) > 0:
             ids_delete = [f"{item}/{physid}" for physid in ids_to_delete]
-            self.db.documents_delete(dbname=self.db_ids, ids=ids_delete, lazy=True)
+            self.db.documents_delete(dbname=self.db_ids, ids=ids_delete, lazy=True, revs=revs)
+            if self.physid_cache != None:
+                for id in ids_delete:
+                    self.physid_cache.discard(id=id)
+        if len(ids_to_create) > 0 or len(ids_to_delete) > 0:
+            try:
+                self.db.document_edit(dbname=self.db_items, id=item, doc={"physids": sorted(new_ids)})
+            except ApiException as e:
+                if e.code != 404:
+                    raise
+                self.logger.warning(f"Physical IDs of {item} were edited, but it doesn't exist")
         self.logger.debug(f"Done editing physical IDs of {item}")
 
 
+    @wrap_operation
     def ids_find(self, physid: str):
         '''Finds the items associated with a physical ID, and returns their database IDs.
+
+        Answers from the physical ID cache when it's fresh and knows the physical ID, otherwise queries the ids database.
         
         physid: The physical ID to search against.
         '''
         self.logger.debug(f"Finding item with physical ID of {physid}")
+        if self.physid_cache != None and self.physid_cache.fresh() == True:
+            items = self.physid_cache.lookup(physid=physid)
+            if items != None:
+                self.logger.debug(f"Done finding item with physical ID of {physid}, from cache")
+                return items
         res = self.db.query(dbname=self.db_ids, selector={'physid': {'$eq': physid}}, fields=['item'], sort=[{'physid': 'asc'}], limit=self.limit)
+        items = [row['item'] for row in res]
+        if self.physid_cache != None:
+            self.physid_cache.store(physid=physid, items=items)
         self.logger.debug(f"Done finding item with physical ID of {physid}")
-        return [row['item'] for row in res]
+        return items
 
 
+    @wrap_operation
     def ids_get(self, item: str):
         '''Fetches all physical IDs associated with an item.
         
         item: The item to get the physical IDs of.
         '''
         self.logger.debug(f"Finding physical IDs associated with {item}")
-        res = self.db.query(dbname=self.db_ids, selector={'item': {'$eq': item}}, fields=['physid'], sort=[{'item': 'asc'}], limit=self.limit)
+        rows, = self.db.documents_ranges(dbname=self.db_ids, ranges=[(item+"/", item+"/\ufff0")])
         self.logger.debug(f"Done finding physical IDs associated with {item}")
-        return [row['physid'] for row in res]
+        return [row['id'][len(item)+1:] for row in rows]
+
 
+    @wrap_operation
+    def ids_iter(self, page_size: int = None):
+        '''Yields every doc from ids database, a page at a time.
+        
+        page_size: Number of docs to fetch per request. If omitted, uses the database's default.
+        '''
+        self.logger.debug(f"Iterating over all physical IDs")
+        yield from self.db.documents_iter(dbname=self.db_ids, page_size=page_size)
+        self.logger.debug(f"Done iterating over all physical IDs")
 
+
+    @wrap_operation
     def ids_list(self):
         '''Retrieves every doc from ids database. Intensive!'''
         self.logger.debug(f"Retrieving all physical IDs")
@@ -909,31 +2396,132 @@ class DEHCDatabase:
         return docs
 
 
+    @wrap_operation
     def get_item_by_any_id(self,searchID: str):
         '''Returns item doc when given any ID either _id or physicalID.
         returns False on failure
 
+        Uses a single request. See get_items_by_any_ids.
+
         searchID: the any flavour ID to search for
         ''' 
-        try:
-            return self.item_get(id=searchID)      #cross our fingers hey
-        except:
-            try:
-                return self.item_get(self.ids_find(searchID)[0]) 
-            except:
-                return False
+        doc, = self.get_items_by_any_ids(searchIDs=[searchID])
+        return doc
 
 
-    def index_prepare(self):
-        '''Prepares certain known indexes used by database queries.'''
+    @wrap_operation
+    def get_items_by_any_ids(self, searchIDs: list):
+        '''Returns the item docs of several IDs at once, each either an item's UUID or one of its physical IDs.
+
+        Uses a single request to the lookup view, which indexes every item by its UUID and its physical IDs.
+        Returns a list in the same order as searchIDs, with False for each ID that doesn't match an item. Matching 
+        UUIDs take precedence over physical IDs, and physical IDs shared by several items return the first.
+
+        If the physical ID cache is fresh, IDs it can answer are resolved from it instead, and the items fetched by 
+        UUID in a single request, along with any IDs shaped like UUIDs. The rest fall back to the lookup view.
+
+        searchIDs: The IDs to search for.
+        '''
+        keys = sorted(set(searchIDs))
+        rest = keys
+        found = {}
+        if self.physid_cache != None and len(keys) > 0 and self.physid_cache.fresh() == True:
+            cached = {key: self.physid_cache.lookup(physid=key) for key in keys}
+            known = [key for key in keys if cached[key] != None]
+            cats = self.schema_cats()
+            fetch = sorted({key for key in known if self.id_cat(id=key) in cats} | {min(cached[key]) for key in known if len(cached[key]) > 0})
+            docs = dict(zip(fetch, self.db.documents_get(dbname=self.db_items, ids=fetch))) if len(fetch) > 0 else {}
+            for key in known:
+                doc = docs.get(key, None)
+                if doc == None and len(cached[key]) > 0:
+                    doc = docs.get(min(cached[key]), None)
+                if doc != None:
+                    found[key] = doc
+            rest = [key for key in keys if cached[key] == None]
+        if len(rest) > 0:
+            if self.views_ready == False:
+                self.views_prepare()
+            rows = self.db.view_query(dbname=self.db_items, name="lookup", view="ids", keys=rest, include_docs=True)
+            for row in rows:
+                if row.get('doc', None) != None and (row['key'] not in found or row['key'] == row['id']):
+                    found[row['key']] = row['doc']
+        self.logger.debug(f"Resolved {len(found)} of {len(keys)} IDs")
+        return [found.get(id, False) for id in searchIDs]
+
+
+    def index_plan(self):
+        '''Returns the indexes database queries are expected to use, derived from the schema:
+
+        [{"dbname": "DBNAME", "name": "NAME", "fields": [{"FIELD": "asc"}, ...], "partitioned": True | False | None}, ...]
+
+        Items get an index on category alone, one per category's keys (the sort order of searches), and one per field 
+        flagged with "index": 1. They're named the same way items_query names the indexes it creates.
+
+        If the databases are partitioned, the items indexes are partitioned ones, used by queries of a single category, 
+        plus a global "idx-category-global" for queries across them. The rest are global.
+        '''
+        part = self.partitioned == True
+        plan = [
+            {"dbname": self.db_ids, "name": "idx-physid", "fields": [{'physid': 'asc'}], "partitioned": False if part == True else None},
+            {"dbname": self.db_items, "name": "idx-category", "fields": [{'category': 'asc'}], "partitioned": True if part == True else None}
+        ]
+        if part == True:
+            plan.append({"dbname": self.db_items, "name": "idx-category-global", "fields": [{'category': 'asc'}], "partitioned": False})
+        sorts = []
+        for cat in self.schema_cats():
+            sorts.append([{key: 'asc'} for key in self.schema_keys(cat=cat)])
+            sorts += [[{field: 'asc'}] for field, info in self.schema_schema(cat=cat).items() if info.get('index', 0) == 1]
+        for sort in sorts:
+            name = "idx-" + "-".join(next(iter(field)) for field in sort)
+            if len(sort) > 0 and name not in [index['name'] for index in plan]:
+                plan.append({"dbname": self.db_items, "name": name, "fields": [{'category': 'asc'}]+sort, "partitioned": True if part == True else None})
+        return plan
+
+
+    @wrap_operation
+    def index_prepare(self, progress = None):
+        '''Creates and warms up every index in the index plan, so the first query using each doesn't stall.
+
+        Indexes already recorded in the "indexes" configs doc are trusted to exist, so restarts don't probe for them.
+        The rest are created, then each is built by querying it for no documents, and the doc is updated.
+
+        progress: If included, called after each step as progress(done, total, "DBNAME NAME").
+        '''
         self.logger.info(f"Preparing indexes")
-        if self.db.index_exists(dbname=self.db_ids, name="idx-item") == False:
-            self.db.index_create(dbname=self.db_ids, name="idx-item", fields=[{'item': 'asc'}])
-        if self.db.index_exists(dbname=self.db_ids, name="idx-physid") == False:
-            self.db.index_create(dbname=self.db_ids, name="idx-physid", fields=[{'physid': 'asc'}])
+        plan = self.index_plan()
+        record = self.db.document_get(dbname=self.db_configs, id="indexes", lazy=True)
+        known = record.get("indexes", {})
+        missing = [index for index in plan if known.get(index['dbname'], {}).get(index['name'], None) != index['fields']]
+        for index in plan:
+            if index not in missing:
+                self.db.index_cache.setdefault(index['dbname'], [])
+                if index['name'] not in self.db.index_cache[index['dbname']]:
+                    self.db.index_cache[index['dbname']].append(index['name'])
+        total = len(missing)*2
+        done = 0
+        for index in missing:
+            self.logger.info(f"Creating index {index['dbname']} {index['name']}")
+            self.db.index_create(dbname=index['dbname'], name=index['name'], fields=index['fields'], partitioned=index.get('partitioned', None))
+            done += 1
+            if progress != None:
+                progress(done, total, f"{index['dbname']} {index['name']}")
+        for index in missing:
+            self.logger.info(f"Warming up index {index['dbname']} {index['name']}")
+            selector = {next(iter(field)): {"$gt": None} for field in index['fields']}
+            partition = self.schema_cats()[0] if index.get('partitioned', None) == True else None
+            self.db.query(dbname=index['dbname'], selector=selector, fields=["_id"], sort=index['fields'], limit=0, partition=partition)
+            known.setdefault(index['dbname'], {})[index['name']] = index['fields']
+            done += 1
+            if progress != None:
+                progress(done, total, f"{index['dbname']} {index['name']}")
+        if len(missing) > 0:
+            self.db.document_save(dbname=self.db_configs, doc={"indexes": known}, id="indexes")
+        self.logger.info(f"Created {len(missing)} of {len(plan)} planned indexes")
+        self.views_prepare()
         self.logger.debug(f"Done preparing indexes")
 
 
+    @wrap_operation
     def item_create(self, cat: str, doc: dict, id: str = None):
         '''Creates new item in items database, returns id.
         
@@ -941,17 +2529,28 @@ class DEHCDatabase:
         doc: The item's data: {"field": "value", ...}
         id: If specified, this becomes the item's UUID in full
         '''
-        if id == None:
-            id, = self.db.id_create(length=self.id_len, prefix=cat+"/")
+        generated = id == None
+        if generated == True:
+            id, = self.db.id_create(length=self.id_len, prefix=cat+(":" if self.partitioned == True else "/"))
         self.logger.info(f"Creating new item {id}")
         doc['category'] = cat
         if 'flags' not in doc:
             doc['flags'] = []
-        self.db.document_create(dbname=self.db_items, doc=doc, id=id)
+        doc.pop('physids', None)  # Only ids_edit adds them
+        try:
+            self.db.document_create(dbname=self.db_items, doc=doc, id=id)
+        except ApiException as e:
+            if generated == False or e.code != 409:
+                raise
+            self.logger.warning(f"Generated UUID {id} is already taken, retrying with another")
+            self.db.id_skip(length=self.id_len)
+            id, = self.db.id_create(length=self.id_len, prefix=cat+(":" if self.partitioned == True else "/"))
+            self.db.document_create(dbname=self.db_items, doc=doc, id=id)
         self.logger.debug(f"Done creating new item {id}")
         return id
 
 
+    @wrap_operation
     def item_delete(self, id: str, all: bool = True, recur: bool = False, lazy: bool = False):
         '''Deletes item from items database.
         
@@ -971,10 +2570,14 @@ class DEHCDatabase:
             children = self.container_children(container=id, result="CON")
             parents = self.item_parents(item=id, result="CON")
             self.db.documents_delete(dbname=self.db_containers, ids=children+parents, lazy=lazy)
+            if self.containment != None:
+                for idc in children+parents:
+                    self.containment.discard(id=idc)
             self.photo_delete(item=id)
         self.logger.debug(f"Done deleting item {id}")
 
 
+    @wrap_operation
     def item_edit(self, id: str, data: dict, lazy: bool = False):
         '''Edits item in items database.
         
@@ -983,10 +2586,12 @@ class DEHCDatabase:
         lazy: If true, won't error if document doesn't exist.
         '''
         self.logger.info(f"Editing item {id}")
+        data = {field: value for field, value in data.items() if field != "physids"}  # Only ids_edit changes them
         self.db.document_edit(dbname=self.db_items, id=id, doc=data, lazy=lazy)
         self.logger.debug(f"Done editing item {id}")
 
 
+    @wrap_operation
     def item_exists(self, id: str):
         '''Returns whether or not an item exists.
         
@@ -996,6 +2601,7 @@ class DEHCDatabase:
         return result
 
 
+    @wrap_operation
     def item_get(self, id: str, fields: list = None, lazy: bool = False):
         '''Retrieves item from items database.
         
@@ -1011,6 +2617,7 @@ class DEHCDatabase:
         return doc
 
 
+    @wrap_operation
     def item_parents(self, item: str, cat: list = None, result: str = "ITEM"):
         '''Returns flat list, listing items containing an item.
 
@@ -1019,10 +2626,7 @@ class DEHCDatabase:
         result: "ITEM" to return item ids, "CON" to return container ids, "DOC" to return item documents.
         '''
         self.logger.debug(f"Finding parents of {item}")
-        selector = {'child': {'$eq': item}}
-        fields = ['_id', 'container']
-        sort = [{'child': 'asc'}, {'container': 'asc'}]
-        query = self.containers_query(selector=selector, fields=fields, sort=sort)
+        query = self.containers_edges(items=[item], up=True)
         if result == "CON":
             parents = [row['_id'] for row in query if cat == None or self.id_cat(row['container']) in cat]
         elif result == "ITEM" or result == "DOC":
@@ -1035,6 +2639,7 @@ class DEHCDatabase:
         return parents
 
 
+    @wrap_operation
     def item_parents_all(self, item: str, cat: list = None, result: str = "ITEM"):
         '''Returns flat list, listing all items containing an item, recursively.
 
@@ -1048,6 +2653,7 @@ class DEHCDatabase:
         return parents
 
 
+    @wrap_operation
     def item_parents_all_dict(self, item: str, cat: list = None):
         '''Returns nested dictionary, listing all items containing an item, recursively.
 
@@ -1062,6 +2668,7 @@ class DEHCDatabase:
         return parents
 
 
+    @wrap_operation
     def item_parents_dict(self, item: str, cat: list = None):
         '''Returns dictionary, listing items containing an item.
 
@@ -1072,27 +2679,44 @@ class DEHCDatabase:
         return parents
 
 
-    def items_create(self, cat: str, docs: list, ids: list = None):
+    @wrap_operation
+    def items_create(self, cat: str, docs: list, ids: list = None, workers: int = 1):
         '''Creates multiple new items at once, returns ids.
+
+        Ids of items that couldn't be created are left out, with a warning logged for each.
         
         cat: The items' category.
         docs: The items' data: [{"field": "value", ...}, {"field": "value", ...}, ...]
+        ids: If specified, these become the items' UUIDs in full. If omitted, they're generated locally, and any already taken are retried once.
+        workers: Max number of bulk requests to send concurrently.
         '''
-        if ids == None:
-            ids = self.db.id_create(n=len(docs), length=self.id_len, prefix=cat+"/")
+        generated = ids == None
+        if generated == True:
+            ids = self.db.id_create(n=len(docs), length=self.id_len, prefix=cat+(":" if self.partitioned == True else "/"))
         self.logger.info(f"Creating {len(ids)} new items")
         new_docs = []
         for doc in docs:
             doc_c = doc.copy()
             doc_c['category'] = cat
-            if 'flags' not in doc:
-                doc['flags'] = []
+            if 'flags' not in doc_c:
+                doc_c['flags'] = []
+            doc_c.pop('physids', None)  # Only ids_edit adds them
             new_docs.append(doc_c)
-        self.db.documents_create(dbname=self.db_items, docs=new_docs, ids=ids)
+        statuses = self.db.documents_create(dbname=self.db_items, docs=new_docs, ids=ids, workers=workers)
+        conflicts = [index for index, status in enumerate(statuses) if status.get("error", None) == "conflict"]
+        if generated == True and len(conflicts) > 0:
+            self.logger.warning(f"{len(conflicts)} generated UUIDs are already taken, retrying with others")
+            self.db.id_skip(length=self.id_len)
+            retry_ids = self.db.id_create(n=len(conflicts), length=self.id_len, prefix=cat+(":" if self.partitioned == True else "/"))
+            retried = self.db.documents_create(dbname=self.db_items, docs=[new_docs[index] for index in conflicts], ids=retry_ids, workers=workers)
+            for index, status in zip(conflicts, retried):
+                statuses[index] = status
+        ids = [status["id"] for status in statuses if "error" not in status]
         self.logger.debug(f"Done creating {len(ids)} new items")
         return ids
 
 
+    @wrap_operation
     def items_delete(self, ids: list, all: bool = True, recur: bool = False, lazy: bool = False):
         '''Deletes multiple items at once, returns ids.
         
@@ -1111,11 +2735,14 @@ class DEHCDatabase:
             children = self.containers_children(containers=ids, result="CON")
             parents = self.items_parents(items=ids, result="CON")
             self.db.documents_delete(dbname=self.db_containers, ids=children+parents, lazy=lazy)
-            for id in ids:
-                self.photo_delete(item=id)
+            if self.containment != None:
+                for idc in children+parents:
+                    self.containment.discard(id=idc)
+            self.db.documents_delete(dbname=self.db_files, ids=["photo-"+id for id in ids], lazy=True)
         self.logger.debug(f"Done deleting {len(ids)} items")
 
 
+    @wrap_operation
     def items_edit(self, ids: list, data: list, lazy: bool = False):
         '''Edits multiple items at once.
         
@@ -1124,10 +2751,12 @@ class DEHCDatabase:
         lazy: If true, won't error if document doesn't exist.
         '''
         self.logger.info(f"Editing {len(ids)} items")
+        data = [{field: value for field, value in doc.items() if field != "physids"} for doc in data]  # Only ids_edit changes them
         self.db.documents_edit(dbname=self.db_items, ids=ids, docs=data, lazy=lazy)
         self.logger.debug(f"Done editing {len(ids)} items")
 
 
+    @wrap_operation
     def items_get(self, ids: list, fields: list = None, lazy: bool = False):
         '''Retrieves multiple items at once.
         
@@ -1147,6 +2776,24 @@ class DEHCDatabase:
         return docs
 
 
+    @wrap_operation
+    def items_iter(self, cat: str = None, fields: list = None, page_size: int = None):
+        '''Yields every item in a category from items database, a page at a time.
+        
+        cat: Category to return. If omitted, returns all categories.
+        fields: If included, only returns listed fields.
+        page_size: Number of docs to fetch per request. If omitted, uses the database's default.
+        '''
+        self.logger.debug(f"Iterating over all items{f' of category {cat}' if cat != None else ''}")
+        startkey, endkey, partition = self.items_range(cat=cat)
+        for doc in self.db.documents_iter(dbname=self.db_items, startkey=startkey, endkey=endkey, page_size=page_size, partition=partition):
+            if fields != None:
+                doc = {field: doc.get(field, "") for field in fields}
+            yield doc
+        self.logger.debug(f"Done iterating over all items{f' of category {cat}' if cat != None else ''}")
+
+
+    @wrap_operation
     def items_list(self, cat: str = None, fields: list = None):
         '''Retrieves every item in a category from items database. Intensive!
         
@@ -1154,13 +2801,8 @@ class DEHCDatabase:
         fields: If included, only returns listed fields.
         '''
         self.logger.debug(f"Fetching all items{f' of category {cat}' if cat != None else ''}")
-        if cat == None:
-            startkey = None
-            endkey = None
-        else:
-            startkey = cat+"/"+self.id_len*"0"
-            endkey = cat+"/"+self.id_len*"f"
-        docs = self.db.documents_list(dbname=self.db_items, startkey=startkey, endkey=endkey, limit=self.limit)
+        startkey, endkey, partition = self.items_range(cat=cat)
+        docs = self.db.documents_list(dbname=self.db_items, startkey=startkey, endkey=endkey, limit=self.limit, partition=partition)
         if fields != None:
             new_docs = []
             for doc in docs:
@@ -1173,6 +2815,21 @@ class DEHCDatabase:
             return docs
 
 
+    def items_range(self, cat: str = None):
+        '''Returns the startkey, endkey and partition of the items of a category, as (STARTKEY, ENDKEY, PARTITION).
+
+        If the databases are partitioned, that's the category's partition. Otherwise, it's the range of UUIDs starting "CATEGORY/".
+
+        cat: Category to return the range of. If omitted, returns that of all categories: (None, None, None)
+        '''
+        if cat == None:
+            return None, None, None
+        if self.partitioned == True:
+            return None, None, cat
+        return cat+"/"+self.id_len*"0", cat+"/"+self.id_len*"f", None
+
+
+    @wrap_operation
     def items_parents(self, items: list, cat: list = None, result: str = "ITEM"):
         '''Returns flat list, listing items containing one of multiple items.
 
@@ -1181,13 +2838,7 @@ class DEHCDatabase:
         result: "ITEM" to return item ids, "CON" to return container ids, "DOC" to return item documents.
         '''
         self.logger.debug(f"Finding parents of {len(items)} items")
-        if len(items) != 1:
-            selector = {'child': {'$in': items}}
-        else:
-            selector = {'child': {'$eq': items[0]}}
-        fields = ['_id', 'container']
-        sort = [{'child': 'asc'}, {'container': 'asc'}]
-        query = self.containers_query(selector=selector, fields=fields, sort=sort)
+        query = self.containers_edges(items=items, up=True)
         if result == "CON":
             parents = [row['_id'] for row in query if cat == None or self.id_cat(row['container']) in cat]
             parents = list(dict.fromkeys(parents))
@@ -1202,6 +2853,7 @@ class DEHCDatabase:
         return parents
 
 
+    @wrap_operation
     def items_parents_all(self, items: str, cat: list = None, result: str = "ITEM"):
         '''Returns flat list, listing all items containing one of multiple items, recursively.
         
@@ -1210,31 +2862,14 @@ class DEHCDatabase:
         result: "ITEM" to return item ids, "CON" to return container ids, "DOC" to return item documents.
         '''
         self.logger.debug(f"Finding all parents and grandparents of {len(items)} items")
-        seen_ids = []
-        parents = []
-        current_containers = items
-        while True:
-            ids = self.items_parents(items=current_containers, result="ITEM")
-            repeat_ids = []
-
-            # Infinite loop protection
-            for id in ids:
-                if id not in seen_ids:
-                    seen_ids.append(id)
-                else:
-                    repeat_ids.append(id)
-            for repeat_id in repeat_ids:
-                ids.remove(repeat_id)
-            
-            if len(ids) > 0:
-                parents += self.items_parents(items=current_containers, result=result, cat=cat)
-                current_containers = ids
-            else:
-                break
+        if result not in ["ITEM", "CON", "DOC"]:
+            raise ValueError("result should be one of ITEM, CON or DOC")
+        walk = self.tree_walk(items=items, cat=cat, docs=result == "DOC", up=True)
         self.logger.debug(f"Done finding all parents and grandparents of {len(items)} items")
-        return parents
+        return walk[result]
 
 
+    @wrap_operation
     def items_parents_all_dict(self, items: str, cat: list = None):
         '''Returns nested dictionary, listing all items containing one of multiple items, recursively.
 
@@ -1257,6 +2892,7 @@ class DEHCDatabase:
         return results
 
 
+    @wrap_operation
     def items_parents_dict(self, items: list, cat: list = None):
         '''Returns nested dictionary, listing items containing one of multiple items.
 
@@ -1264,10 +2900,7 @@ class DEHCDatabase:
         cat: If included, only returns parents of these categories.
         '''
         self.logger.debug(f"Finding parents of {len(items)} items")
-        selector = {'child': {'$in': items}}
-        fields = ['_id', 'container', 'child']
-        sort = [{'child': 'asc'}, {'container': 'asc'}]
-        query = self.containers_query(selector=selector, fields=fields, sort=sort)
+        query = self.containers_edges(items=items, up=True)
         parents = {item: [] for item in items}
         for row in query:
             parent = row['container']
@@ -1277,12 +2910,13 @@ class DEHCDatabase:
         return parents
 
 
+    @wrap_operation
     def items_query(self, cat: str = None, selector: dict = {}, fields: list = None, sort: list = None):
         '''Queries the item database and returns the results.
 
         For selector operators, see: https://docs.mongodb.com/manual/reference/operator/query/
 
-        cat = Category to query. If omitted, checks all categories.
+        cat = Category to query. If omitted, checks all categories. If the databases are partitioned, only its partition is queried.
         selector = A MongoDB style selector: {"FIELDNAME" : {"OPERATOR": "VALUE"}, ... }. If omitted, returns all items.
         fields = List of fields to return: ["FIELD1", "FIELD2", ...]. If omitted, returns all fields.
         sort = List defining sort order: [{"FIELD1": "ASC"}, {"FIELD2": "DESC"}, ...]. If omitted, returns in ascending UUID order.
@@ -1292,28 +2926,57 @@ class DEHCDatabase:
             selector['category'] = {"$eq": cat}
         else:
             selector['category'] = {"$ne": ""}
+        _, _, partition = self.items_range(cat=cat)
         if sort != None:
             index_name = "idx"
             for field in sort:
                 key = next(iter(field.keys()))
                 index_name += f"-{key}"
+            if self.partitioned == True and partition == None:
+                index_name += "-global"
             if self.db.index_exists(dbname=self.db_items, name=index_name) == False:
-                self.db.index_create(dbname=self.db_items, name=index_name, fields=[{"category": "asc"}]+sort)
-        res = self.db.query(dbname=self.db_items, selector=selector, fields=fields, sort=sort, limit=self.limit)
+                self.db.index_create(dbname=self.db_items, name=index_name, fields=[{"category": "asc"}]+sort, partitioned=partition != None if self.partitioned == True else None)
+        res = self.db.query(dbname=self.db_items, selector=selector, fields=fields, sort=sort, limit=self.limit, partition=partition)
         self.logger.debug(f"Done querying the items database")
         return res
 
 
+    @wrap_operation
     def orphans_list(self, container: str):
         '''Returns a list of all items NOT contained by a container.
         
         container: The container used as reference.
         '''
-        items = [container]+self.container_children_all(container=container)
-        orphans = [item['_id'] for item in self.items_list(fields=["_id"]) if item['_id'] not in items and "_design/" not in item['_id']]
+        items = set([container]+self.container_children_all(container=container))
+        orphans = [item['_id'] for item in self.db.documents_iter(dbname=self.db_items, include_docs=False) if item['_id'] not in items and "_design/" not in item['_id']]
         return orphans
 
 
+    @wrap_operation
+    def partitioned_detect(self):
+        '''Returns whether or not the items database exists and is partitioned.'''
+        try:
+            partitioned = self.db.database_partitioned(dbname=self.db_items)
+        except ApiException as e:
+            if e.code != 404:
+                raise
+            partitioned = False
+        self.logger.debug(f"Detected {'partitioned' if partitioned == True else 'global'} databases")
+        return partitioned
+
+
+    def photo_attachment(self, size: int = None):
+        '''Returns the name of the attachment to load for a photo of a size; the smallest rendition at least that big, or the original.
+
+        size: The width and height, in pixels, the photo will be shown at. If omitted, returns the original.
+        '''
+        for rendition in sorted(self.photo_sizes):
+            if size != None and rendition >= size:
+                return f"photo-{rendition}.jpg"
+        return self.photo_name
+
+
+    @wrap_operation
     def photo_delete(self, item: str):
         '''Deletes the photo, associated with an item, from the database.
         
@@ -1321,91 +2984,320 @@ class DEHCDatabase:
         '''
         self.logger.info(f"Deleting photo of {item}")
         name = "photo-"+item
-        if self.db.document_exists(dbname=self.db_files, id=name) == True:
-            self.db.document_delete(dbname=self.db_files, id=name)
+        self.db.document_delete(dbname=self.db_files, id=name, lazy=True)
+        if self.photo_cache != None:
+            self.photo_cache.record(item=item, digests=None)
         self.logger.debug(f"Done deleting photo of {item}")
 
 
-    def photo_load(self, item: str):
+    @wrap_operation
+    def photo_load(self, item: str, size: int = None):
         '''Loads the photo, associated with an item, from the database.
         
         item: The item to load the photo of.
+        size: If included, loads the smallest rendition at least this many pixels wide and tall instead of the original.
         '''
-        self.logger.debug(f"Fetching photo of {item}")
-        name = "photo-"+item
-        if self.db.document_exists(dbname=self.db_files, id=name) == True:
-            doc = self.db.document_get(dbname=self.db_files, id=name)
-            img = base64.b64decode(doc['photo'])
-            buffer = io.BytesIO(img)
-            self.logger.debug(f"Done fetching photo of {item}")
-            return Image.open(buffer)
-        else:
-            self.logger.debug(f"Done fetching photo of {item}")
-            return None
+        data = self.photo_load_bytes(item=item, size=size)
+        return Image.open(io.BytesIO(data)) if data != None else None
 
 
-    def photo_load_base64(self, item: str):
+    @wrap_operation
+    def photo_load_base64(self, item: str, size: int = None):
         '''Loads the photo, associated with an item, from the database, leaves it in base64
         
         item: The item to load the photo of.
+        size: If included, loads the smallest rendition at least this many pixels wide and tall instead of the original.
         '''
-        self.logger.debug(f"Fetching photo of {item} as base64")
-        name = "photo-"+item
-        if self.db.document_exists(dbname=self.db_files, id=name) == True:
-            self.logger.debug(f"Done fetching photo of {item} as base64")
-            return self.db.document_get(dbname=self.db_files, id=name)['photo']            
-        else:
-            self.logger.debug(f"Done fetching photo of {item} as base64")
-            return None
+        data = self.photo_load_bytes(item=item, size=size)
+        return base64.b64encode(data).decode('utf-8') if data != None else None
+
 
+    @wrap_operation
+    def photo_load_bytes(self, item: str, size: int = None):
+        '''Loads the photo, associated with an item, from the database as JPEG bytes, or returns None if it has none.
 
+        Photos and their renditions are attachments, so this takes a single request. Photos saved before that, and not 
+        yet moved by photos_migrate, take up to three more. With a photo cache, photos already on disk are only 
+        checked for changes, in a single request at most; see photos_validate.
+        
+        item: The item to load the photo of.
+        size: If included, loads the smallest rendition at least this many pixels wide and tall instead of the original. See photo_sizes.
+        '''
+        self.logger.debug(f"Fetching photo of {item}")
+        name = "photo-"+item
+        attachment = self.photo_attachment(size=size)
+        if self.photo_cache != None:
+            fresh, digests = self.photo_cache.lookup(item=item)
+            if fresh == False:
+                self.photos_validate(items=[item])
+                fresh, digests = self.photo_cache.lookup(item=item)
+            if fresh == True and digests == None:
+                self.logger.debug(f"Done fetching photo of {item}; it has none")
+                return None
+            if fresh == True and (attachment in digests or self.photo_name in digests):
+                attachment = attachment if attachment in digests else self.photo_name
+                data = self.photo_cache.get(digest=digests[attachment])
+                if data == None:
+                    data = self.db.attachment_get(dbname=self.db_files, id=name, name=attachment, lazy=True)
+                    if data != None:
+                        self.photo_cache.put(data=data)
+                self.logger.debug(f"Done fetching photo of {item}")
+                return data
+        data = self.db.attachment_get(dbname=self.db_files, id=name, name=attachment, lazy=True)
+        if data == None and attachment != self.photo_name:
+            data = self.db.attachment_get(dbname=self.db_files, id=name, name=self.photo_name, lazy=True)
+        if data == None:
+            doc = self.db.document_get(dbname=self.db_files, id=name, lazy=True)
+            data = base64.b64decode(doc['photo']) if 'photo' in doc else None
+        self.logger.debug(f"Done fetching photo of {item}")
+        return data
+
+
+    def photo_renditions(self, data: bytes):
+        '''Returns the renditions of a photo to save alongside it: {"photo-SIZE.jpg": bytes, ...}
+
+        Each is a progressive JPEG no bigger than SIZE pixels wide and tall, for each of photo_sizes. Photos already 
+        that small are reused as they are, as are photos that can't be read, so no rendition outlives its photo.
+
+        data: The bytes of the original photo.
+        '''
+        try:
+            img = Image.open(io.BytesIO(data))
+            img.load()
+        except OSError as e:
+            self.logger.warning(f"Could not make renditions of photo: {e}")
+            return {self.photo_attachment(size=size): data for size in self.photo_sizes}
+        renditions = {}
+        for size in sorted(self.photo_sizes):
+            if max(img.size) <= size:
+                renditions[self.photo_attachment(size=size)] = data
+                continue
+            rendition = img.convert("RGB")
+            rendition.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            rendition.save(buffer, format="JPEG", quality=85, optimize=True, progressive=True)
+            renditions[self.photo_attachment(size=size)] = buffer.getvalue()
+        return renditions
+
+
+    @wrap_operation
     def photo_save(self, item: str, img: Image):
         '''Saves a photo, associated with an item, to the database.
 
-        Photos are saved as JPEG using base64 encoding.
+        Photos are saved as JPEG, along with their renditions. See photo_save_bytes.
         
         item: The item the photo is associated with.
         img: The PIL object to save to the database.
         '''
-        self.logger.info(f"Saving photo of {item}")
         buffer = io.BytesIO()
         img.save(buffer, format="JPEG")
-        data = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        name = "photo-"+item
-        if self.db.document_exists(dbname=self.db_files, id=name) == True:
-            self.db.document_edit(dbname=self.db_files, doc={"item": item, "photo": data}, id=name)
-        else:
-            self.db.document_create(dbname=self.db_files, doc={"item": item, "photo": data}, id=name)
-        self.logger.debug(f"Done saving photo of {item}")
+        self.photo_save_bytes(item=item, data=buffer.getvalue())
 
 
+    @wrap_operation
     def photo_save_base64(self, item: str, img: str):
         '''Saves a base64 representation of a photo, associated with an item, to the database.
         
         item: The item the photo is associated with.
         img: The base64-encoded string to save to the database.
         '''
-        self.logger.info(f"Saving base64 photo of {item}")
-        data = img
-        name = "photo-"+item
-        if self.db.document_exists(dbname=self.db_files, id=name) == True:
-            self.db.document_edit(dbname=self.db_files, doc={"item": item, "photo": data}, id=name)
+        self.photo_save_bytes(item=item, data=base64.b64decode(img))
+
+
+    @wrap_operation
+    def photo_save_bytes(self, item: str, data: bytes):
+        '''Saves the JPEG bytes of a photo, associated with an item, to the database.
+
+        Photos are saved as an attachment of the item's "photo-UUID" document in the files database, so they're stored
+        and replicated as binary, and can be loaded without parsing them out of JSON. Smaller renditions are saved 
+        alongside, so lists and scanners can load a few kilobytes instead of the original; see photo_renditions.
+        The document is saved with every attachment inline, in a single request and revision, so a photo is never 
+        left without its renditions.
+        
+        item: The item the photo is associated with.
+        data: The JPEG bytes to save to the database.
+        '''
+        self.logger.info(f"Saving photo of {item}")
+        uploads = {self.photo_name: data, **self.photo_renditions(data=data)}
+        attachments = {name: {"content_type": "image/jpeg", "data": base64.b64encode(upload).decode('utf-8')} for name, upload in uploads.items()}
+        self.db.document_save(dbname=self.db_files, doc={"item": item, "_attachments": attachments}, id="photo-"+item)
+        if self.photo_cache != None:
+            self.photo_cache.record(item=item, digests={name: self.photo_cache.put(data=upload) for name, upload in uploads.items()})
+        self.logger.debug(f"Done saving photo of {item}")
+
+
+    @wrap_operation
+    def photos_iter(self, result: str = "DOC", page_size: int = None):
+        '''Yields every doc from the files database, a page at a time.
+        
+        result: "DOC" to yield the photo docs, "ITEM" to only yield the UUIDs of items that have photos, without downloading them.
+        page_size: Number of docs to fetch per request. If omitted, uses 25 for docs, as photos are large, or the database's default for UUIDs.
+        '''
+        self.logger.debug(f"Iterating over all photos")
+        if result == "ITEM":
+            for doc in self.db.documents_iter(dbname=self.db_files, include_docs=False, page_size=page_size):
+                if doc["_id"].startswith("photo-"):
+                    yield doc["_id"][len("photo-"):]
         else:
-            self.db.document_create(dbname=self.db_files, doc={"item": item, "photo": data}, id=name)
-        self.logger.debug(f"Done saving base64 photo of {item}")
+            yield from self.db.documents_iter(dbname=self.db_files, page_size=page_size if page_size != None else 25)
+        self.logger.debug(f"Done iterating over all photos")
 
 
+    @wrap_operation
     def photos_list(self):
-        '''Retrieves every doc from the files database. VERY intensive!'''
+        '''Retrieves every doc from the files database. VERY intensive! Prefer photos_iter.'''
         self.logger.debug(f"Retrieving all photos")
         docs = self.db.documents_list(dbname=self.db_files, limit=self.limit)
         self.logger.debug(f"Done retrieving all photos")
         return docs
 
 
+    @wrap_operation
+    def photos_load(self, items: list, size: int = None, workers: int = 4):
+        '''Yields the photos of several items as JPEG bytes, as they arrive: (UUID, bytes). Items without photos are skipped.
+
+        Fetches the photo documents of chunk_size items at a time, without the photos themselves, in a single request, 
+        so items without photos cost nothing more. Only the rendition asked for is then downloaded from each, up to 
+        workers at once, and yielded in the order they finish, so no more than workers photos are held in memory. 
+        With a photo cache, items validated recently skip the first request, and photos already on disk skip the download.
+
+        items: The UUIDs of the items to load the photos of.
+        size: If included, loads the smallest renditions at least this many pixels wide and tall instead of the originals. See photo_sizes.
+        workers: Max number of photos to download concurrently.
+        '''
+        items = list(dict.fromkeys(items))
+        attachment = self.photo_attachment(size=size)
+        self.logger.debug(f"Fetching photos of {len(items)} items")
+        for start in range(0, len(items), self.db.chunk_size):
+            chunk = items[start:start+self.db.chunk_size]
+            stubs = {}
+            stale = []
+            for item in chunk:
+                fresh, digests = self.photo_cache.lookup(item=item) if self.photo_cache != None else (False, None)
+                if fresh == False:
+                    stale.append(item)
+                elif digests != None:
+                    stubs[item] = {name: {"digest": digest} for name, digest in digests.items()}
+            if len(stale) > 0:
+                docs = self.db.documents_get(dbname=self.db_files, ids=["photo-"+item for item in stale])
+                for item, doc in zip(stale, docs):
+                    if self.photo_cache != None:
+                        digests = {name: stub["digest"] for name, stub in doc.get("_attachments", {}).items() if "digest" in stub} if doc != None else None
+                        self.photo_cache.record(item=item, digests=digests)
+                    if doc != None and len(doc.get("_attachments", {})) > 0:
+                        stubs[item] = doc["_attachments"]
+                    elif doc != None and "photo" in doc:
+                        yield item, base64.b64decode(doc["photo"])  # Not yet moved by photos_migrate
+            downloads = []
+            for item, found in stubs.items():
+                name = attachment if attachment in found else self.photo_name
+                if name not in found:
+                    continue
+                data = self.photo_cache.get(digest=found[name]["digest"]) if self.photo_cache != None and "digest" in found[name] else None
+                if data != None:
+                    yield item, data
+                else:
+                    downloads.append((item, name))
+            if len(downloads) == 0:
+                continue
+            fetch = lambda item, name: self.db.attachment_get(dbname=self.db_files, id="photo-"+item, name=name, lazy=True)
+            context = contextvars.copy_context()  # So requests are still attributed to the calling operation
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                running = {}
+                while len(downloads) > 0 or len(running) > 0:
+                    while len(downloads) > 0 and len(running) < workers:
+                        item, name = downloads.pop(0)
+                        running[pool.submit(context.copy().run, fetch, item, name)] = item
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        item = running.pop(future)
+                        data = future.result()
+                        if data == None:
+                            continue
+                        if self.photo_cache != None:
+                            self.photo_cache.put(data=data)
+                        yield item, data
+        self.logger.debug(f"Done fetching photos of {len(items)} items")
+
+
+    @wrap_operation
+    def photos_migrate(self):
+        '''Moves photos saved as base64 strings inside their documents into attachments, adds any missing renditions, and returns how many photos were updated.
+
+        Each photo takes a single request, saving its document with the missing attachments inline and without the 
+        base64. Photos saved as attachments since are kept. Safe to run more than once, or to interrupt.
+        '''
+        self.logger.info(f"Migrating photos to attachments")
+        renditions = [self.photo_attachment(size=size) for size in self.photo_sizes]
+        moved = 0
+        for doc in self.photos_iter():
+            attachments = doc.get("_attachments", {})
+            if not doc["_id"].startswith("photo-") or ("photo" not in doc and self.photo_name not in attachments):
+                continue
+            if "photo" not in doc and all(name in attachments for name in renditions):
+                continue
+            if self.photo_name in attachments:
+                data = self.db.attachment_get(dbname=self.db_files, id=doc["_id"], name=self.photo_name)
+            else:
+                data = base64.b64decode(doc["photo"])
+            uploads = {self.photo_name: data, **self.photo_renditions(data=data)}
+            stubs = {name: {"stub": True} for name in attachments}
+            stubs.update({name: {"content_type": "image/jpeg", "data": base64.b64encode(upload).decode('utf-8')} for name, upload in uploads.items() if name not in attachments})
+            item = doc.get("item", doc["_id"][len("photo-"):])
+            self.db.document_save(dbname=self.db_files, doc={"item": item, "_attachments": stubs}, id=doc["_id"], rev=doc["_rev"])
+            moved += 1
+        self.logger.debug(f"Done migrating {moved} photos to attachments")
+        return moved
+
+
+    @wrap_operation
+    def photos_validate(self, items: list):
+        '''Checks the photos of several items against the server, so the photo cache knows which of its files are current.
+
+        Fetches their photo documents, without the photos themselves, in a single request per chunk_size items. 
+        Returns the digests recorded: {UUID: {"NAME": "md5-BASE64", ...} or None, ...}. Does nothing without a photo cache.
+
+        items: The UUIDs of the items to check.
+        '''
+        if self.photo_cache == None:
+            return {}
+        items = list(dict.fromkeys(items))
+        found = {}
+        self.logger.debug(f"Validating photos of {len(items)} items")
+        for start in range(0, len(items), self.db.chunk_size):
+            chunk = items[start:start+self.db.chunk_size]
+            docs = self.db.documents_get(dbname=self.db_files, ids=["photo-"+item for item in chunk])
+            for item, doc in zip(chunk, docs):
+                digests = {name: stub["digest"] for name, stub in doc.get("_attachments", {}).items() if "digest" in stub} if doc != None else None
+                self.photo_cache.record(item=item, digests=digests)
+                found[item] = digests
+        self.logger.debug(f"Done validating photos of {len(items)} items")
+        return found
+
+
+    @wrap_operation
+    def physids_sync(self):
+        '''Copies each item's physical IDs from the ids database onto the item, under "physids", and returns how many were updated.
+
+        ids_edit keeps them in step, so this is only needed once, for physical IDs saved before the lookup view existed.
+        '''
+        self.logger.info(f"Syncing physical IDs onto items")
+        physids = {}
+        for doc in self.ids_iter():
+            if "item" in doc and "physid" in doc:
+                physids.setdefault(doc['item'], []).append(doc['physid'])
+        items = sorted(physids)
+        for start in range(0, len(items), self.db.chunk_size):
+            chunk = items[start:start+self.db.chunk_size]
+            self.db.documents_edit(dbname=self.db_items, ids=chunk, docs=[{"physids": sorted(physids[item])} for item in chunk], lazy=True)
+        self.logger.debug(f"Done syncing physical IDs onto {len(items)} items")
+        return len(items)
+
+
+    @wrap_operation
     def replication_status(self):
         '''Returns whether or not the replications on the CouchDB database are all healthy'''
-        docs = self.db.client.get_scheduler_docs().get_result()['docs']
+        docs = self.db.scheduler_docs()
         for doc in docs:
             if self.namespace in doc.get("target", ""):
                 if doc.get("state", "error") in ["crashing", "error", "failed", "missing"]:
@@ -1462,6 +3354,7 @@ class DEHCDatabase:
         return keys
 
 
+    @wrap_operation
     def schema_load(self, schema: str = None):
         '''Loads database schema into memory.
 
@@ -1489,8 +3382,8 @@ class DEHCDatabase:
                 raise RuntimeError("Schema version doesn't match what the application was expecting, Program version: %s; DB Version %s." % (self.version, loaded_schema["#"]["version"]))
 
         for key, value in self.schema.items():
-            if "/" in key:
-                raise ValueError("Category names cannot contain / chars.")
+            if "/" in key or ":" in key:
+                raise ValueError("Category names cannot contain / or : chars.")
                 # ...because they're used in UUIDs to split category from number
             if "category" in value["fields"]:
                 raise ValueError("category can't be a field name.")
@@ -1528,14 +3421,12 @@ class DEHCDatabase:
         return field
 
 
+    @wrap_operation
     def schema_save(self):
         '''Saves database schema to the database.'''
         id = "schema"
         self.logger.info(f"Saving database schema {id}")
-        if self.db.document_exists(dbname=self.db_configs, id=id):
-            self.db.document_edit(dbname=self.db_configs, doc=self.schema, id=id)
-        else:
-            self.db.document_create(dbname=self.db_configs, doc=self.schema, id=id)
+        self.db.document_save(dbname=self.db_configs, doc=self.schema, id=id)
         self.logger.debug(f"Done saving database schema")
 
 
@@ -1564,6 +3455,21 @@ class DEHCDatabase:
         return list(dict.fromkeys(summables))
 
 
+    def stats(self):
+        '''Returns the number and latency of requests made, per endpoint and per DEHCDatabase method. See Database.stats.
+
+        If the physical ID cache is in use, also returns its hit rate: {"physids": {"hits": N, "misses": N, "size": N}, ...}
+        Likewise for the photo cache, along with the number of bytes it keeps: {"photos": {"hits": N, "misses": N, "size": N, "bytes": N}, ...}
+        '''
+        stats = self.db.stats()
+        if self.physid_cache != None:
+            stats["physids"] = {"hits": self.physid_cache.hits, "misses": self.physid_cache.misses, "size": len(self.physid_cache.physids)}
+        if self.photo_cache != None:
+            stats["photos"] = {"hits": self.photo_cache.hits, "misses": self.photo_cache.misses, "size": len(self.photo_cache.files), "bytes": self.photo_cache.used}
+        return stats
+
+
+    @wrap_operation
     def time_get(self, doc: bool = False):
         '''Retrieves the current server time. Returns None if there's an issue.
         
@@ -1580,4 +3486,218 @@ class DEHCDatabase:
             return None
 
 
+    @wrap_operation
+    def tree_walk(self, items: list, cat: list = None, docs: bool = False, up: bool = False):
+        '''Walks the container tree breadth-first from some items, returning everything found in one pass.
+
+        Makes one containers query per level of the tree, plus one fetch at the end if docs are wanted. Backends
+        with documents_walk fetch the whole tree in a single query instead.
+        Items already encountered are not followed again, so container loops end the walk cleanly.
+        Returns a dictionary: {"ITEM": [item ids], "CON": [container ids], "DOC": [item documents]}.
+
+        items: Items to start walking from.
+        cat: If included, only returns results of these categories. Every category is still walked through.
+        docs: If true, also fetches the documents of the returned items.
+        up: If true, walks towards parents instead of children.
+        '''
+        near, far = ('child', 'container') if up == True else ('container', 'child')
+        self.logger.debug(f"Walking {'up' if up == True else 'down'} the tree from {len(items)} items")
+        edges = lambda current: self.containers_edges(items=current, up=up)
+        if hasattr(self.db, "documents_walk") and (self.containment == None or self.containment.fresh() == False):
+            # Fetch every edge reachable in one statement, then replay the walk over them in order
+            walked = {}
+            for row in sorted(self.db.documents_walk(dbname=self.db_containers, starts=list(items), near=near, far=far), key=lambda row: row['_id']):
+                walked.setdefault(row[near], []).append(row)
+            edges = lambda current: [row for item in sorted(set(current)) for row in walked.get(item, [])]
+        via = dict.fromkeys(items)  # The item each item was first reached from, to tell loops from items in several containers
+        found = {"ITEM": [], "CON": [], "DOC": []}
+        current = list(dict.fromkeys(items))
+        while len(current) > 0:
+            query = edges(current)
+            current = []
+            for row in query:
+                id = row[far]
+                wanted = cat == None or self.id_cat(id) in cat
+                if wanted:
+                    found["CON"].append(row['_id'])
+                if id in via:
+                    # Infinite loop protection
+                    ancestor = row[near]
+                    while ancestor != None and ancestor != id:
+                        ancestor = via[ancestor]
+                    if ancestor == id and up == False:
+                        self.logger.error(f"Infinite container loop detected; '{id}' contains itself")
+                    else:
+                        self.logger.debug(f"'{id}' encountered twice")
+                    continue
+                via[id] = row[near]
+                current.append(id)
+                if wanted:
+                    found["ITEM"].append(id)
+        if docs == True and len(found["ITEM"]) > 0:
+            found["DOC"] = self.db.documents_get(dbname=self.db_items, ids=found["ITEM"])
+        self.logger.debug(f"Done walking {'up' if up == True else 'down'} the tree from {len(items)} items")
+        return found
+
+
+    @wrap_operation
+    def views_prepare(self):
+        '''Prepares the views used by database queries, replacing them if their version has changed.'''
+        self.logger.info(f"Preparing views")
+        containment = {
+            "parents": "function (doc) { if (doc.container && doc.child) { emit(doc.child, doc.container); } }"
+        }
+        self.db.view_create(dbname=self.db_containers, name="containment", views=containment, version=self.views_version, lazy=True, partitioned=False if self.partitioned == True else None)
+        lookup = {
+            "ids": "function (doc) { if (doc.category) { emit(doc._id, null); if (doc.physids) { for (var i = 0; i < doc.physids.length; i++) { emit(doc.physids[i], null); } } } }"
+        }
+        if self.db.view_create(dbname=self.db_items, name="lookup", views=lookup, version=self.views_version, lazy=True, partitioned=False if self.partitioned == True else None) == True:
+            self.physids_sync()
+        self.views_ready = True
+        self.logger.debug(f"Done preparing views")
+
+
+# ----------------------------------------------------------------------------
+
+class AsyncDatabase:
+    '''An asyncio interface to a Database object.
+
+    Has the same methods as Database, but each one is a coroutine which runs the blocking request on a worker 
+    thread, so many requests can be in flight at once from a single event loop. Methods which yield, such as 
+    documents_iter, become async iterators instead.
+
+    db: The Database object doing the actual work.
+    '''
+
+    def __init__(self, *, db: Database = None, **kwargs):
+        '''Constructs an AsyncDatabase object.
+
+        Creating a new Database connects to the server, so do it before the event loop starts, or in a thread.
+        
+        db: The Database object to wrap. If omitted, a new one is created from the remaining arguments.
+        kwargs: Arguments passed on to Database if db is omitted.
+        '''
+        self.db = db if db != None else database_open(**kwargs)
+
+
+    def __getattr__(self, name: str):
+        '''Returns an async version of a method of the wrapped object. Other attributes are returned as is.'''
+        return wrap_async(getattr(self.db, name))
+
+
+# ----------------------------------------------------------------------------
+
+class AsyncDEHCDatabase:
+    '''An asyncio interface to a DEHCDatabase object.
+
+    Has the same methods as DEHCDatabase, but each one is a coroutine which runs on a worker thread. Methods 
+    which fan out over many documents are overridden to send their requests concurrently.
+
+    db: An AsyncDatabase wrapping the DEHCDatabase's own Database object.
+    dehc: The DEHCDatabase object doing the actual work.
+    '''
+
+    def __init__(self, *, dehc: DEHCDatabase = None, **kwargs):
+        '''Constructs an AsyncDEHCDatabase object.
+
+        Creating a new DEHCDatabase connects to the server, so do it before the event loop starts, or in a thread.
+        
+        dehc: The DEHCDatabase object to wrap. If omitted, a new one is created from the remaining arguments.
+        kwargs: Arguments passed on to DEHCDatabase if dehc is omitted.
+        '''
+        self.dehc = dehc if dehc != None else DEHCDatabase(**kwargs)
+        self.db = AsyncDatabase(db=self.dehc.db)
+
+
+    def __getattr__(self, name: str):
+        '''Returns an async version of a method of the wrapped object. Other attributes are returned as is.'''
+        return wrap_async(getattr(self.dehc, name))
+
+
+    async def items_get(self, ids: list, fields: list = None, lazy: bool = False):
+        '''Retrieves multiple items at once, fetching chunks of chunk_size items concurrently.
+        
+        ids: The UUIDs of items to retrieve.
+        fields: If included, only returns listed fields.
+        lazy: If true, won't error if any documents don't exist.
+        '''
+        size = self.dehc.db.chunk_size
+        chunks = [ids[start:start+size] for start in range(0, len(ids), size)]
+        results = await asyncio.gather(*[asyncio.to_thread(self.dehc.items_get, ids=chunk, fields=fields, lazy=lazy) for chunk in chunks])
+        return [doc for result in results for doc in result]
+
+
+    async def items_get_many(self, groups: list, fields: list = None, lazy: bool = False):
+        '''Retrieves several groups of items concurrently, returning a list of docs per group.
+        
+        groups: Lists of UUIDs of items to retrieve: [[UUID1, UUID2, ...], [UUID3, ...], ...]
+        fields: If included, only returns listed fields.
+        lazy: If true, won't error if any documents don't exist.
+        '''
+        return list(await asyncio.gather(*[self.items_get(ids=ids, fields=fields, lazy=lazy) for ids in groups]))
+
+
+    async def photos_load_base64(self, items: list, size: int = None):
+        '''Loads the photos of multiple items in bulk, returning a {UUID: base64} dict. Items without photos map to None. See DEHCDatabase.photos_load.
+        
+        items: The items to load the photos of.
+        size: If included, loads the smallest renditions at least this many pixels wide and tall instead. See DEHCDatabase.photo_load.
+        '''
+        photos = await asyncio.to_thread(lambda: {item: base64.b64encode(data).decode('utf-8') for item, data in self.dehc.photos_load(items=items, size=size)})
+        return {item: photos.get(item, None) for item in items}
+
+
+    async def tree_walks(self, walks: list, cat: list = None, docs: bool = False, up: bool = False):
+        '''Walks the tree from several independent sets of items concurrently, returning a list of results. See tree_walk.
+        
+        walks: Lists of items to start walking from: [[UUID1, UUID2, ...], [UUID3, ...], ...]
+        cat: If included, only returns items of listed categories.
+        docs: If true, includes the docs of the items found.
+        up: If true, walks up to parents instead of down to children.
+        '''
+        return list(await asyncio.gather(*[asyncio.to_thread(self.dehc.tree_walk, items=items, cat=cat, docs=docs, up=up) for items in walks]))
+
+
+# ----------------------------------------------------------------------------
+
+def database_open(*, config: str, level: str = "NOTSET", revcache: bool = False):
+    '''Returns the Database object for a connection config, using the backend it names.
+
+    A config with "backend": "sqlite" opens a SQLiteDatabase on a local file. Anything else connects to CouchDB.
+
+    config: Path to .json file containing the connection config.
+    level: Minimum level of logging messages to report; "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "NONE".
+    revcache: If true, caches the revisions of documents read and written, so most edits take a single request.
+    '''
+    with open(config, "r") as f:
+        backend = json.loads(f.read()).get("backend", "couchdb")
+    if backend == "sqlite":
+        from mods.database_sqlite import SQLiteDatabase
+        return SQLiteDatabase(config=config, level=level, revcache=revcache)
+    return Database(config=config, level=level, revcache=revcache)
+
+
+def wrap_async(attr):
+    '''Returns an async version of a callable which runs it on a worker thread. Generator functions become 
+    async iterators. Anything that isn't callable is returned as is.
+    
+    attr: The attribute to wrap.
+    '''
+    if callable(attr) == False:
+        return attr
+    if inspect.isgeneratorfunction(attr):
+        async def iterate(*args, **kwargs):
+            generator = attr(*args, **kwargs)
+            done = object()
+            while True:
+                item = await asyncio.to_thread(next, generator, done)
+                if item is done:
+                    break
+                yield item
+        return iterate
+    async def call(*args, **kwargs):
+        return await asyncio.to_thread(attr, *args, **kwargs)
+    return call
+
+
 # ----------------------------------------------------------------------------
\ No newline at end of file
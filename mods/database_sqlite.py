@@ -0,0 +1,962 @@
+'''The module containing an embedded SQLite backend, for running DEHC without a CouchDB server.'''
+
+import base64
+import copy
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+from ibm_cloud_sdk_core import ApiException
+
+import mods.log as ml
+from mods.database import Database, RequestStats
+from mods.standin import collate, compile_map, field_get, matches, MISSING
+
+
+# ----------------------------------------------------------------------------
+
+class SQLiteDatabase(Database):
+    '''A Database kept in a single SQLite file instead of on a CouchDB server.
+
+    Has the same methods as Database, so DEHCDatabase can use either; see database_open. Each CouchDB database
+    becomes a table of JSON documents which keeps CouchDB's revisions, deletion tombstones and change sequence,
+    with a second table for their attachments' bytes.
+    Each view becomes a table of emitted rows, updated on every write, and MongoDB-style indexes become real
+    SQLite indexes. Failures raise an ApiException with the status code CouchDB would have responded with.
+
+    Also provides documents_walk, which follows a chain of documents in a single recursive statement.
+
+    attachment_tables: Databases whose attachments table is known to exist.
+    chunk_size: Max number of documents written in a single transaction.
+    conn: The SQLite connection object.
+    data: The connection config: {"backend": "sqlite", "path": "PATH"}
+    id_clocks: The last timestamp and counter used by id_create, as in Database.
+    id_epoch: The Unix time id_create counts seconds from.
+    id_lock: Lock guarding id_clocks.
+    index_cache: Cache of indexes that have been created.
+    lock: Lock serialising use of the connection between threads.
+    logger: The logger object used for logging.
+    maps: Cache of compiled view map functions, per database: {"DBNAME": {("DDOC", "VIEW"): function, ...}, ...}
+    metrics: Always empty, as no requests are made. Kept so operations can still be tracked; see Database.stats.
+    page_size: Default number of documents fetched at a time when iterating over a database.
+    rev_cache: Always None, as documents are local and cheap to fetch. Kept for compatibility with Database.
+    slow_queries: The most recent slow queries, as in Database. SQLite reports how many rows its prefilter examined.
+    slow_query_seconds: Queries taking at least this long are explained and recorded in slow_queries.
+    '''
+
+    def __init__(self, *, config: str, level: str = "NOTSET", revcache: bool = False):
+        '''Constructs a SQLiteDatabase object.
+
+        config: Path to .json file containing the path of the SQLite file: {"backend": "sqlite", "path": "PATH"}
+        level: Minimum level of logging messages to report; "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "NONE".
+        revcache: Ignored, as there's no round trip to save. Accepted for compatibility with Database.
+        '''
+        self.logger = ml.get("SQLiteDatabase", level=level)
+        self.logger.debug("SQLiteDatabase object instantiated")
+
+        self.logger.info(f"Loading database connection config from {config}")
+        with open(config, "r") as f:
+            self.data = json.loads(f.read())
+        self.data.setdefault("url", "sqlite:///"+self.data["path"])
+        self.logger.debug(f"Finished loading database connection config")
+
+        self.conn = sqlite3.connect(self.data["path"], check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.lock = threading.RLock()
+        self.logger.info(f"Connection to {self.data['url']} established")
+        self.attachment_tables = set()
+        self.id_clocks = {}
+        self.id_epoch = 1577836800  # 2020-01-01 UTC
+        self.id_lock = threading.Lock()
+        self.index_cache = {}
+        self.maps = {}
+        self.metrics = RequestStats(level=level)
+        self.chunk_size = 1000
+        self.page_size = 500
+        self.rev_cache = None
+        self.rev_cache_size = 0
+        self.rev_lock = threading.Lock()
+        self.rev_retries = 1
+        self.scan_warnings = set()
+        self.slow_queries = deque(maxlen=self.data.get('slow_queries', {}).get('size', 100))
+        self.slow_query_seconds = self.data.get('slow_queries', {}).get('seconds', 1.0)
+        self.transport = {}
+
+
+    def attachment_get(self, dbname: str, id: str, name: str, lazy: bool = False):
+        '''Retrieves an attachment of a document and returns its contents as bytes.
+
+        dbname: Name of database to fetch from.
+        id: The UUID of the document the attachment is on.
+        name: The name of the attachment.
+        lazy: If true, returns None instead of erroring if the document or attachment doesn't exist.
+        '''
+        table = self.attachments_table(dbname=dbname)
+        with self.lock:
+            row = self.conn.execute(f'SELECT data FROM {table} WHERE id = ? AND name = ?', (id, name)).fetchone()
+        if row != None:
+            self.logger.debug(f"Fetched attachment {dbname} {id} {name}")
+            return bytes(row[0])
+        if lazy == False:
+            raise ApiException(404, message="missing")
+        self.logger.debug(f"Could not fetch attachment {dbname} {id} {name}")
+        return None
+
+
+    def attachment_put(self, dbname: str, id: str, name: str, data: bytes, content_type: str, rev: str = None):
+        '''Adds or replaces an attachment of a document, creating the document if it doesn't exist, and returns the document's new revision.
+
+        dbname: Name of database the document is in.
+        id: The UUID of the document.
+        name: The name of the attachment.
+        data: The contents of the attachment.
+        content_type: The MIME type of the attachment, eg "image/jpeg".
+        rev: Ignored, as the current revision is read in the same transaction. Accepted for compatibility with Database.
+        '''
+        with self.lock, self.conn:
+            doc = self.document_fetch(dbname=dbname, id=id) or {"_id": id}
+            doc.setdefault("_attachments", {})[name] = {"content_type": content_type, "data": base64.b64encode(data).decode("utf-8")}
+            res = self.document_write(dbname=dbname, doc=doc)
+        self.logger.debug(f"Saved attachment {dbname} {id} {name}")
+        return res['rev']
+
+
+    def attachments_table(self, dbname: str):
+        '''Returns the quoted table name of a database's attachments, creating it for files made before attachments were supported.
+
+        dbname: Name of the database.
+        '''
+        if dbname not in self.attachment_tables:
+            self.table(dbname=dbname)
+            with self.lock, self.conn:
+                self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{dbname}/attachments" (id TEXT NOT NULL, name TEXT NOT NULL, data BLOB NOT NULL, PRIMARY KEY (id, name))')
+            self.attachment_tables.add(dbname)
+        return f'"{dbname}/attachments"'
+
+
+    def attachments_write(self, dbname: str, id: str, attachments: dict, revpos: int):
+        '''Stores the attachments listed in a new revision of a document, and returns the stubs to keep in its body.
+
+        Attachments with "data" are stored, stubs are kept, and any not listed are deleted, as in CouchDB.
+        Must be called holding lock, inside a transaction.
+
+        dbname: Name of the database the document is in.
+        id: The UUID of the document.
+        attachments: The document's "_attachments": {"NAME": {"content_type": "TYPE", "data": "BASE64"} or {"stub": True}, ...}
+        revpos: The revision number being written.
+        '''
+        table = self.attachments_table(dbname=dbname)
+        current = {}
+        if len(attachments) > 0:
+            row = self.conn.execute(f'SELECT deleted, body FROM {self.table(dbname=dbname)} WHERE id = ?', (id,)).fetchone()
+            if row != None and row[0] == 0:
+                current = json.loads(row[1]).get("_attachments", {})
+        stubs = {}
+        for name, attachment in attachments.items():
+            if "data" in attachment:
+                data = base64.b64decode(attachment["data"])
+                self.conn.execute(f'INSERT OR REPLACE INTO {table} (id, name, data) VALUES (?, ?, ?)', (id, name, data))
+                digest = "md5-" + base64.b64encode(hashlib.md5(data).digest()).decode("utf-8")
+                stubs[name] = {"content_type": attachment.get("content_type", "application/octet-stream"), "digest": digest, "length": len(data), "revpos": revpos, "stub": True}
+            elif name in current:
+                stubs[name] = current[name]
+            else:
+                raise ApiException(412, message=f"Invalid attachment stub in {id} for {name}")
+        self.conn.execute(f'DELETE FROM {table} WHERE id = ? AND name NOT IN ({", ".join("?"*len(stubs))})', (id, *stubs))
+        return stubs
+
+
+    def changes(self, dbname: str, since: str = "0", include_docs: bool = False, feed: str = "normal", timeout: int = None, limit: int = None):
+        '''Returns the changes made to a database since a sequence id, along with the new last sequence id.
+
+        dbname: Name of database to follow.
+        since: Sequence id to start from. "0" for the beginning, "now" for only the latest sequence id.
+        include_docs: If true, includes the current body of each changed document.
+        feed: "normal" to return immediately, "longpoll" to wait for a change before returning.
+        timeout: If feed is "longpoll", milliseconds to wait for a change before returning empty.
+        limit: If included, the max number of changes to return.
+        '''
+        table = self.table(dbname=dbname)
+        with self.lock:
+            last = self.conn.execute(f'SELECT COALESCE(MAX(seq), 0) FROM {table}').fetchone()[0]
+        since = last if str(since) == "now" else int(str(since).split("-")[0])
+        deadline = time.monotonic() + (timeout if timeout != None else 60000)/1000
+        while True:
+            with self.lock:
+                rows = self.conn.execute(f'SELECT id, rev, deleted, body, seq FROM {table} WHERE seq > ? ORDER BY seq LIMIT ?', (since, limit if limit != None else -1)).fetchall()
+            if len(rows) > 0 or feed != "longpoll" or time.monotonic() >= deadline:
+                break
+            time.sleep(0.1)
+        results = []
+        for id, rev, deleted, body, seq in rows:
+            result = {"seq": f"{seq}-sqlite", "id": id, "changes": [{"rev": rev}]}
+            if deleted == 1:
+                result["deleted"] = True
+            if include_docs == True:
+                result["doc"] = self.document_load(id=id, rev=rev, deleted=deleted, body=body)
+            results.append(result)
+        res = {"results": results, "last_seq": results[-1]["seq"] if len(results) > 0 else f"{since}-sqlite", "pending": 0}
+        self.logger.debug(f"Fetched {len(results)} changes to database {dbname} since {since}")
+        return res
+
+
+    def database_create(self, dbname: str, partitioned: bool = False):
+        '''Creates a new database.
+
+        dbname: Name of the database to create.
+        partitioned: If true, records that the database is partitioned. Partitions are UUID ranges, so this changes nothing else.
+        '''
+        if self.database_exists(dbname=dbname) == True:
+            raise ApiException(412, message="The database could not be created, the file already exists.")
+        with self.lock, self.conn:
+            self.conn.execute(f'CREATE TABLE "{dbname}" (id TEXT PRIMARY KEY, rev TEXT NOT NULL, deleted INTEGER NOT NULL DEFAULT 0, body TEXT NOT NULL, seq INTEGER NOT NULL)')
+            self.conn.execute(f'CREATE INDEX "{dbname}/seq" ON "{dbname}"(seq)')
+            self.conn.execute(f'CREATE TABLE "{dbname}/views" (ddoc TEXT NOT NULL, view TEXT NOT NULL, key TEXT, id TEXT NOT NULL, value TEXT)')
+            self.conn.execute(f'CREATE INDEX "{dbname}/views/key" ON "{dbname}/views"(ddoc, view, key, id)')
+            self.conn.execute(f'CREATE INDEX "{dbname}/views/id" ON "{dbname}/views"(id)')
+            self.conn.execute(f'CREATE TABLE "{dbname}/props" (key TEXT PRIMARY KEY, value TEXT)')
+            self.conn.execute(f'CREATE TABLE "{dbname}/attachments" (id TEXT NOT NULL, name TEXT NOT NULL, data BLOB NOT NULL, PRIMARY KEY (id, name))')
+            self.conn.execute(f'INSERT INTO "{dbname}/props" (key, value) VALUES (?, ?)', ("partitioned", json.dumps(partitioned == True)))
+        self.logger.debug(f"Created {'partitioned ' if partitioned == True else ''}database {dbname}")
+
+
+    def database_delete(self, dbname: str):
+        '''Deletes an existing database.
+
+        dbname: Name of the database to delete.
+        '''
+        table = self.table(dbname=dbname)
+        with self.lock, self.conn:
+            self.conn.execute(f'DROP TABLE {table}')
+            self.conn.execute(f'DROP TABLE IF EXISTS "{dbname}/views"')
+            self.conn.execute(f'DROP TABLE IF EXISTS "{dbname}/props"')
+            self.conn.execute(f'DROP TABLE IF EXISTS "{dbname}/attachments"')
+        self.attachment_tables.discard(dbname)
+        self.maps.pop(dbname, None)
+        self.index_cache.pop(dbname, None)
+        self.logger.debug(f"Deleted database {dbname}")
+
+
+    def database_exists(self, dbname: str):
+        '''Returns whether or not a database exists.
+
+        dbname: Name of the database to check.
+        '''
+        with self.lock:
+            row = self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (dbname,)).fetchone()
+        if row != None:
+            self.logger.debug(f"Database {dbname} exists")
+            return True
+        self.logger.debug(f"Database {dbname} does not exist or could not be reached")
+        return False
+
+
+    def database_list(self):
+        '''Returns a list of active databases.'''
+        with self.lock:
+            rows = self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE '%/views' AND name NOT LIKE '%/props' AND name NOT LIKE '%/attachments' ORDER BY name").fetchall()
+        self.logger.debug(f"Databases listed")
+        return [row[0] for row in rows]
+
+
+    def database_partitioned(self, dbname: str):
+        '''Returns whether or not a database was created partitioned.
+
+        dbname: Name of the database to check.
+        '''
+        self.table(dbname=dbname)
+        with self.lock:
+            exists = self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{dbname}/props",)).fetchone()
+            row = self.conn.execute(f'SELECT value FROM "{dbname}/props" WHERE key = ?', ("partitioned",)).fetchone() if exists != None else None
+        return row != None and json.loads(row[0]) == True
+
+
+    def document_create(self, dbname: str, doc: dict, id: str = None):
+        '''Creates a new document, returning its id.
+
+        dbname: Name of database to create document in.
+        doc: The contents of the document.
+        id: The UUID of the document. If omitted, one is generated.
+        '''
+        with self.lock, self.conn:
+            res = self.document_write(dbname=dbname, doc={**doc, "_id": id if id != None else self.id_create(length=32)[0]})
+        id = res['id']
+        self.logger.debug(f"Created document {dbname} {id}")
+        return id
+
+
+    def document_delete(self, dbname: str, id: str, lazy: bool = False):
+        '''Deletes an existing document.
+
+        dbname: Name of database to delete document in.
+        id: The UUID of document to delete.
+        lazy: If true, won't error if document doesn't exist.
+        '''
+        with self.lock, self.conn:
+            doc = self.document_fetch(dbname=dbname, id=id)
+            if doc != None:
+                self.document_write(dbname=dbname, doc={"_id": id, "_rev": doc["_rev"], "_deleted": True})
+                self.logger.debug(f"Deleted document {dbname} {id}")
+            elif lazy == False:
+                raise ApiException(404, message="missing")
+            else:
+                self.logger.debug(f"Could not lazy delete document {dbname} {id}")
+
+
+    def document_edit(self, dbname: str, doc: dict, id: str, lazy: bool = False):
+        '''Edits an existing document.
+
+        dbname: Name of database to edit document in.
+        doc: Fields and values to be edited.
+        id: The UUID of the document to edit.
+        lazy: If true, won't error if document doesn't exist.
+        '''
+        with self.lock, self.conn:
+            remote_doc = self.document_fetch(dbname=dbname, id=id)
+            if remote_doc != None:
+                remote_doc.update(doc)
+                remote_doc.update({"_id": id, "_rev": self.document_fetch(dbname=dbname, id=id)["_rev"]})
+                self.document_write(dbname=dbname, doc=remote_doc)
+                self.logger.debug(f"Edited document {dbname} {id}")
+            elif lazy == False:
+                raise ApiException(404, message="missing")
+            else:
+                self.logger.debug(f"Could not lazy edit document {dbname} {id}")
+
+
+    def document_exists(self, dbname: str, id: str):
+        '''Returns whether or not a document exists.
+
+        dbname: Name of database to look in.
+        id: The UUID of document to look for.
+        '''
+        if self.database_exists(dbname=dbname) == True and self.document_fetch(dbname=dbname, id=id) != None:
+            self.logger.debug(f"Document {dbname} {id} exists")
+            return True
+        self.logger.debug(f"Document {dbname} {id} does not exist")
+        return False
+
+
+    def document_fetch(self, dbname: str, id: str):
+        '''Returns the current revision of a document, or None if it doesn't exist or has been deleted.
+
+        dbname: Name of database to look in.
+        id: The UUID of the document.
+        '''
+        table = self.table(dbname=dbname)
+        with self.lock:
+            row = self.conn.execute(f'SELECT id, rev, deleted, body FROM {table} WHERE id = ?', (id,)).fetchone()
+        if row == None or row[2] == 1:
+            return None
+        return self.document_load(*row)
+
+
+    def document_get(self, dbname: str, id: str, lazy: bool = False):
+        '''Retrieves a document from a database and returns it.
+
+        dbname: Name of database to fetch from.
+        id: The UUID of document to fetch.
+        lazy: If true, won't error if document doesn't exist.
+        '''
+        remote_doc = self.document_fetch(dbname=dbname, id=id)
+        if remote_doc != None:
+            self.logger.debug(f"Fetched document {dbname} {id}")
+        elif lazy == False:
+            raise ApiException(404, message="missing")
+        else:
+            remote_doc = {}
+            self.logger.debug(f"Could not fetch document {dbname} {id}")
+        return remote_doc
+
+
+    def document_load(self, id: str, rev: str, deleted: int, body: str):
+        '''Returns a document, as CouchDB would, from its stored columns.
+
+        id: The UUID of the document.
+        rev: The document's revision.
+        deleted: 1 if the document is a deletion tombstone, otherwise 0.
+        body: The JSON body of the document, without _id and _rev.
+        '''
+        if deleted == 1:
+            return {"_id": id, "_rev": rev, "_deleted": True}
+        return {"_id": id, "_rev": rev, **json.loads(body)}
+
+
+    def document_save(self, dbname: str, doc: dict, id: str, rev: str = None):
+        '''Saves a document in full, creating it if it doesn't exist or replacing it if it does, and returns its new revision.
+
+        Replacing a document drops any attachments not listed in its "_attachments", eg as {"NAME": {"stub": True}}.
+
+        dbname: Name of database to save document in.
+        doc: The contents of the document.
+        id: The UUID of the document.
+        rev: Ignored, as the current revision is read in the same transaction. Accepted for compatibility with Database.
+        '''
+        with self.lock, self.conn:
+            remote_doc = self.document_fetch(dbname=dbname, id=id)
+            res = self.document_write(dbname=dbname, doc={**doc, "_id": id, "_rev": remote_doc["_rev"] if remote_doc != None else None})
+        self.logger.debug(f"Saved document {dbname} {id}")
+        return res['rev']
+
+
+    def document_write(self, dbname: str, doc: dict, lazy: bool = False):
+        '''Writes a new revision of a document, checking its revision like CouchDB does, and returns the result.
+
+        Must be called holding lock, inside a transaction.
+
+        dbname: Name of database to write to.
+        doc: The document, with "_rev" of the revision it replaces, and "_deleted" if it's being deleted.
+        lazy: If true, returns failures as {"id": "UUID", "error": "ERROR", "reason": "REASON"} instead of raising them.
+        '''
+        table = self.table(dbname=dbname)
+        id = doc.get("_id", None) or self.id_create(length=32)[0]
+        rev = doc.get("_rev", None)
+        current = self.conn.execute(f'SELECT rev, deleted FROM {table} WHERE id = ?', (id,)).fetchone()
+        live = current != None and current[1] == 0
+        error = None
+        if (live == True and rev != current[0]) or (live == False and rev != None and (current == None or rev != current[0])):
+            error = (409, "conflict", "Document update conflict.")
+        elif live == False and doc.get("_deleted", False) == True:
+            error = (404, "not_found", "deleted" if current != None else "missing")
+        if error != None:
+            if lazy == True:
+                return {"id": id, "error": error[1], "reason": error[2]}
+            raise ApiException(error[0], message=error[2])
+
+        number = int(current[0].split("-")[0])+1 if current != None else 1
+        new_rev = f"{number}-{uuid.uuid4().hex}"
+        deleted = 1 if doc.get("_deleted", False) == True else 0
+        body = {} if deleted == 1 else {key: value for key, value in doc.items() if key not in ["_id", "_rev", "_attachments"]}
+        attachments = self.attachments_write(dbname=dbname, id=id, attachments=doc.get("_attachments", {}) if deleted == 0 else {}, revpos=number)
+        if len(attachments) > 0:
+            body["_attachments"] = attachments
+        seq = self.conn.execute(f'SELECT COALESCE(MAX(seq), 0)+1 FROM {table}').fetchone()[0]
+        self.conn.execute(f'INSERT OR REPLACE INTO {table} (id, rev, deleted, body, seq) VALUES (?, ?, ?, ?, ?)', (id, new_rev, deleted, json.dumps(body), seq))
+        if id.startswith("_design/"):
+            self.maps.pop(dbname, None)
+            self.view_rebuild(dbname=dbname, ddoc=id[len("_design/"):])
+        else:
+            self.view_update(dbname=dbname, id=id, doc=None if deleted == 1 else {"_id": id, "_rev": new_rev, **body})
+        return {"ok": True, "id": id, "rev": new_rev}
+
+
+    def documents_create(self, dbname: str, docs: list, ids: list = None, workers: int = 1):
+        '''Creates multiple documents at once, returning the status of each: [{"id": "UUID", "ok": True, "rev": "REV"}, ...]
+
+        Failed creations are reported as {"id": "UUID", "error": "ERROR", "reason": "REASON"} instead.
+
+        dbname: Name of database to create documents in.
+        doc: A list of the contents of each document.
+        ids: A list of UUIDs of the documents. If omitted, they are generated.
+        workers: Ignored, as SQLite writes one transaction at a time. Accepted for compatibility with Database.
+        '''
+        ids = ids if ids != None else self.id_create(n=len(docs), length=32)
+        statuses = []
+        for start in range(0, len(docs), self.chunk_size):
+            with self.lock, self.conn:
+                for doc, id in zip(docs[start:start+self.chunk_size], ids[start:start+self.chunk_size]):
+                    re = self.document_write(dbname=dbname, doc={**doc, "_id": id}, lazy=True)
+                    if "error" in re:
+                        self.logger.warning(f"Could not bulk create document {dbname} {re['id']}: {re['error']}")
+                    else:
+                        self.logger.debug(f"Bulk created document {dbname} {re['id']}")
+                    statuses.append(re)
+        self.logger.debug(f"Finished bulk creating documents")
+        return statuses
+
+
+    def documents_delete(self, dbname: str, ids: str, lazy: bool = False, revs: dict = None):
+        '''Deletes multiple documents at once, returning the status of each: [{"id": "UUID", "ok": True}, ...]
+
+        Failed deletions are reported as {"id": "UUID", "error": "ERROR", "reason": "REASON"} instead.
+
+        dbname: Name of database to delete documents in.
+        ids: The UUIDs of the documents to delete.
+        lazy: If true, won't error if any documents doesn't exist.
+        revs: Ignored, as looking revisions up takes no requests here. Accepted for compatibility with Database.
+        '''
+        ids = list(dict.fromkeys(ids))
+        statuses = []
+        with self.lock, self.conn:
+            docs = {id: self.document_fetch(dbname=dbname, id=id) for id in ids}
+            missing = [id for id, doc in docs.items() if doc == None]
+            if lazy == False and len(missing) > 0:
+                raise RuntimeError(f"Can't bulk delete documents that don't exist in {dbname}: {missing}")
+            for id, doc in docs.items():
+                if doc == None:
+                    self.logger.debug(f"Could not bulk lazy delete document {dbname} {id}")
+                    statuses.append({"id": id, "ok": True})
+                else:
+                    statuses.append(self.document_write(dbname=dbname, doc={"_id": id, "_rev": doc["_rev"], "_deleted": True}, lazy=True))
+                    self.logger.debug(f"Bulk deleted document {dbname} {id}")
+        self.logger.debug(f"Finished bulk deleting documents")
+        return statuses
+
+
+    def documents_edit(self, dbname: str, docs: list, ids: list, lazy: bool = False):
+        '''Edits multiple documents at once, returning a list of id and rev numbers.
+
+        dbname: Name of database to edit documents in.
+        docs: Lists of fields and values to be edited.
+        ids:  List of IDs of documents being edited.
+        lazy: If true, won't error if any documents doesn't exist.
+        '''
+        edits = {}
+        for id, doc in zip(ids, docs):
+            edits.setdefault(id, doc)
+        res = []
+        with self.lock, self.conn:
+            remote_docs = {id: self.document_fetch(dbname=dbname, id=id) for id in edits}
+            missing = [id for id, doc in remote_docs.items() if doc == None]
+            if lazy == False and len(missing) > 0:
+                raise RuntimeError(f"Can't bulk edit documents that don't exist in {dbname}: {missing}")
+            for id, remote_doc in remote_docs.items():
+                if remote_doc == None:
+                    self.logger.debug(f"Could not bulk lazy edit document {dbname} {id}")
+                    continue
+                remote_doc.update(edits[id])
+                remote_doc.update({"_id": id, "_rev": self.document_fetch(dbname=dbname, id=id)["_rev"]})
+                res.append(self.document_write(dbname=dbname, doc=remote_doc, lazy=True))
+                self.logger.debug(f"Bulk edited document {dbname} {id}")
+        self.logger.debug(f"Finished bulk editing documents")
+        return res
+
+
+    def documents_get(self, dbname: str, ids: str, lazy: bool = False):
+        '''Retrieves multiple documents and returns them.
+
+        Documents that don't exist are skipped if lazy, otherwise returned as None.
+
+        dbname:  Name of database to get documents from.
+        ids: A list of UUIDs of documents to fetch.
+        lazy: If true, won't error if any documents don't exist.
+        '''
+        table = self.table(dbname=dbname)
+        found = {}
+        with self.lock:
+            for start in range(0, len(ids), self.chunk_size):
+                chunk = ids[start:start+self.chunk_size]
+                rows = self.conn.execute(f'SELECT id, rev, deleted, body FROM {table} WHERE deleted = 0 AND id IN (SELECT value FROM json_each(?))', (json.dumps(chunk),)).fetchall()
+                found.update({row[0]: row for row in rows})
+        doc_list = []
+        for id in ids:
+            if id in found:
+                doc_list.append(self.document_load(*found[id]))
+            elif lazy == False:
+                self.logger.debug(f"Could not bulk fetch {dbname} {id}")
+                doc_list.append(None)
+            else:
+                self.logger.debug(f"Could not bulk lazy fetch {dbname} {id}")
+        self.logger.debug(f"Finished bulk fetching documents")
+        return doc_list
+
+
+    def documents_ranges(self, dbname: str, ranges: list, include_docs: bool = False, limit: int = None):
+        '''Returns the rows of several UUID ranges in a database.
+
+        Returns a list of lists of rows, one list per range: [[{"id": "UUID", "key": "UUID", "value": {"rev": "REV"}}, ...], ...]
+
+        dbname: Name of database to fetch rows from.
+        ranges: A list of (startkey, endkey) pairs, each the first and last document UUID of a range.
+        include_docs: If true, includes each row's document under "doc".
+        limit: If included, the max number of rows to retrieve per range.
+        '''
+        results = [self.rows(dbname=dbname, startkey=startkey, endkey=endkey, include_docs=include_docs, limit=limit) for startkey, endkey in ranges]
+        self.logger.debug(f"Listed {len(ranges)} document ranges from database {dbname}")
+        return results
+
+
+    def documents_walk(self, dbname: str, starts: list, near: str, far: str):
+        '''Returns every document reachable by following links from some starting values, using one recursive query.
+
+        A document links its near field's value to its far field's value. For container docs, near="container" and
+        far="child" walks down the tree, and the reverse walks up it. Loops are followed only once.
+        Returns a list of {"_id": "UUID", NEAR: value, FAR: value}, in no particular order.
+
+        dbname: Name of database to walk.
+        starts: The values to start walking from.
+        near: The field a document is reached by.
+        far: The field a document leads on to.
+        '''
+        table = self.table(dbname=dbname)
+        near_path = self.field_path(field=near)
+        far_path = self.field_path(field=far)
+        with self.lock:
+            for field, path in [(near, near_path), (far, far_path)]:
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS "{dbname}/walk-{field}" ON {table}(json_extract(body, {path}))')
+            rows = self.conn.execute(f'''
+                WITH RECURSIVE walk(value) AS (
+                    SELECT value FROM json_each(?)
+                    UNION
+                    SELECT json_extract(d.body, {far_path}) FROM {table} d JOIN walk w ON json_extract(d.body, {near_path}) = w.value WHERE d.deleted = 0
+                )
+                SELECT id, json_extract(body, {near_path}), json_extract(body, {far_path}) FROM {table}
+                WHERE deleted = 0 AND json_extract(body, {near_path}) IN (SELECT value FROM walk)
+            ''', (json.dumps(list(starts)),)).fetchall()
+        self.logger.debug(f"Walked {len(rows)} documents in database {dbname} from {len(starts)} values")
+        return [{"_id": id, near: near_value, far: far_value} for id, near_value, far_value in rows]
+
+
+    def field_path(self, field: str):
+        '''Returns the quoted SQLite JSON path of a top level field, for use with json_extract.
+
+        field: The name of the field.
+        '''
+        label = field.replace('"', '\\"').replace("'", "''")
+        return f"'$.\"{label}\"'"
+
+
+    def id_get(self, n: int = 1, prefix: str = ""):
+        '''Generates new UUIDs, in the same format CouchDB uses, and returns them.
+
+        n: The number of UUIDs to generate.
+        prefix: Prefix to add to the UUID.
+        '''
+        response = [prefix+uuid.uuid4().hex for _ in range(0, n)]
+        self.logger.debug(f"{n} UUIDs generated by SQLite backend")
+        return response
+
+
+    def index_create(self, dbname: str, name: str, fields: list, partitioned: bool = None):
+        '''Creates a new index on document fields and returns its id (name).
+
+        dbname: Name of database to index.
+        name: Name of the index.
+        fields: List of dictionaries of form {"FIELDNAME" : "asc" | "desc"}, defining the index.
+        partitioned: Ignored, as every index serves both partition and global queries.
+        '''
+        table = self.table(dbname=dbname)
+        columns = []
+        for field in fields:
+            key, direction = next(iter(field.items()))
+            column = "id" if key == "_id" else f"json_extract(body, {self.field_path(field=key)})"
+            columns.append(f"{column} {'DESC' if direction.lower() == 'desc' else 'ASC'}")
+        with self.lock, self.conn:
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS "{dbname}/{name}" ON {table}({", ".join(columns)})')
+        self.index_cache.setdefault(dbname, [])
+        if name not in self.index_cache[dbname]:
+            self.index_cache[dbname].append(name)
+        self.logger.debug(f"Created index {dbname} {name}")
+        return name
+
+
+    def index_delete(self, dbname: str, name: str):
+        '''Deletes an existing index.
+
+        dbname: Name of database index is stored in.
+        name: Name of the index to be deleted.
+        '''
+        with self.lock, self.conn:
+            self.conn.execute(f'DROP INDEX "{dbname}/{name}"')
+        if name in self.index_cache.get(dbname, []):
+            self.index_cache[dbname].remove(name)
+        self.logger.debug(f"Deleted index {dbname} {name}")
+
+
+    def index_exists(self, dbname: str, name: str):
+        '''Returns whether or not an index exists.
+
+        dbname: Name of database index is stored in.
+        name: Name of the index to be checked.
+        '''
+        if name in self.index_cache.get(dbname, []):
+            return True
+        with self.lock:
+            row = self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = ?", (f"{dbname}/{name}",)).fetchone()
+        if row != None:
+            self.logger.debug(f"Index {dbname} {name} exists")
+            self.index_cache.setdefault(dbname, []).append(name)
+            return True
+        self.logger.debug(f"Index {dbname} {name} does not exist")
+        return False
+
+
+    def query(self, dbname: str, selector: dict = {}, fields: list = None, sort: list = None, limit: int = 25, partition: str = None):
+        '''Queries a database using MongoDB-style selectors.
+
+        Equality and $in conditions on strings and numbers are answered by SQLite, using any matching index. The
+        rest of the selector is then checked in Python, so results are the same as CouchDB's.
+
+        dbname: Name of database being queried.
+        selector: A MongoDB style selector: {"FIELDNAME" : {"OPERATOR": "VALUE"}, ... }. If omitted, returns no documents.
+        fields: List of fields to return: ["FIELD1", "FIELD2", ...]. If omitted, returns all fields.
+        sort: List defining sort order: [{"FIELD1": "ASC"}, {"FIELD2": "DESC"}, ...]. If omitted, returns in ascending UUID order.
+        limit: Number of docs to retrieve. Set arbitrary large to fetch all.
+        partition: If included, only queries documents whose UUID starts with "PARTITION:".
+        '''
+        sql, args = self.query_sql(dbname=dbname, selector=selector, partition=partition)
+        start = time.perf_counter()
+        with self.lock:
+            rows = self.conn.execute(sql, args).fetchall()
+        docs = [doc for doc in (self.document_load(*row) for row in rows) if matches(doc=doc, selector=selector) == True]
+        for field in reversed(sort if sort != None else []):
+            key, direction = next(iter(field.items()))
+            docs.sort(key=lambda doc: collate(None if field_get(doc=doc, field=key) is MISSING else field_get(doc=doc, field=key)), reverse=direction.lower() == "desc")
+        docs = docs[:limit]
+        if fields != None:
+            docs = [{field: doc[field] for field in fields if field in doc} for doc in docs]
+        seconds = time.perf_counter()-start
+        if seconds >= self.slow_query_seconds:
+            self.query_record(dbname=dbname, selector=selector, fields=fields, sort=sort, limit=limit, seconds=seconds, examined=len(rows), returned=len(docs), partition=partition)
+        log = f"Queried database {dbname} using {{'selector': {selector}"
+        log += f", 'fields': {fields}" if fields != None else ""
+        log += f", 'sort': {sort}" if sort != None else ""
+        log += f", 'limit': {limit}}}"
+        self.logger.debug(log.replace("'",'"'))
+        return docs
+
+
+    def query_explain(self, dbname: str, selector: dict = {}, fields: list = None, sort: list = None, limit: int = 25, partition: str = None):
+        '''Returns which index SQLite would use to prefilter a query: {"name": "NAME", "ddoc": None, "type": "json" | "special", "fields": []}
+
+        An index of type "special" named "_all_docs" means the query has to scan every document, or look them up by UUID.
+
+        dbname: Name of database being queried.
+        selector: A MongoDB style selector: {"FIELDNAME" : {"OPERATOR": "VALUE"}, ... }.
+        fields: Ignored, as SQLite fetches whole documents.
+        sort: Ignored, as SQLite doesn't sort by fields.
+        limit: Ignored, as SQLite doesn't limit the prefilter.
+        partition: If included, explains the query on documents whose UUID starts with "PARTITION:".
+        '''
+        sql, args = self.query_sql(dbname=dbname, selector=selector, partition=partition)
+        with self.lock:
+            plan = [row[-1] for row in self.conn.execute(f"EXPLAIN QUERY PLAN {sql}", args).fetchall()]
+        name = "_all_docs"
+        for detail in plan:
+            if f"INDEX {dbname}/" in detail:
+                name = detail.split(f"INDEX {dbname}/", 1)[1].split(" (")[0]
+                break
+        self.logger.debug(f"Explained query on database {dbname}; it uses index {name}")
+        return {"name": name, "ddoc": None, "type": "special" if name == "_all_docs" else "json", "fields": []}
+
+
+    def query_sql(self, dbname: str, selector: dict, partition: str = None):
+        '''Returns the SQL statement, and its arguments, which prefilters the documents a selector could match.
+
+        Equality and $in conditions on strings and numbers are included, so matching indexes are used.
+
+        dbname: Name of database being queried.
+        selector: A MongoDB style selector: {"FIELDNAME" : {"OPERATOR": "VALUE"}, ... }.
+        partition: If included, only includes documents whose UUID starts with "PARTITION:".
+        '''
+        table = self.table(dbname=dbname)
+        where = ["deleted = 0", "id NOT LIKE '\\_design/%' ESCAPE '\\'"]
+        args = []
+        if partition != None:
+            where.append("id >= ? AND id < ?")
+            args += [partition+":", partition+";"]
+        for field, condition in selector.items():
+            if field.startswith("$"):
+                continue
+            if isinstance(condition, dict) == False or any(key.startswith("$") for key in condition) == False:
+                condition = {"$eq": condition}
+            column = "id" if field == "_id" else f"json_extract(body, {self.field_path(field=field)})"
+            scalar = lambda value: isinstance(value, (str, int, float)) and isinstance(value, bool) == False
+            if scalar(condition.get("$eq", None)) == True:
+                where.append(f"{column} = ?")
+                args.append(condition["$eq"])
+            if isinstance(condition.get("$in", None), list) and len(condition["$in"]) > 0 and all(scalar(value) for value in condition["$in"]):
+                where.append(f"{column} IN (SELECT value FROM json_each(?))")
+                args.append(json.dumps(condition["$in"]))
+        return f'SELECT id, rev, deleted, body FROM {table} WHERE {" AND ".join(where)} ORDER BY id', args
+
+
+    def rows(self, dbname: str, startkey: str = None, endkey: str = None, include_docs: bool = False, limit: int = None, skip: int = 0, partition: str = None):
+        '''Returns the rows of a UUID range in a database, as CouchDB's _all_docs would.
+
+        dbname: Name of database to fetch rows from.
+        startkey: If included, document UUID to start fetching from.
+        endkey: If included, document UUID to stop fetching at.
+        include_docs: If true, includes each row's document under "doc".
+        limit: If included, the max number of rows to retrieve.
+        skip: Number of rows to skip first.
+        partition: If included, only fetches rows whose UUID starts with "PARTITION:".
+        '''
+        table = self.table(dbname=dbname)
+        where = ["deleted = 0"]
+        args = []
+        if partition != None:
+            where.append("id >= ? AND id < ?")
+            args += [partition+":", partition+";"]
+        if startkey != None:
+            where.append("id >= ?")
+            args.append(startkey)
+        if endkey != None:
+            where.append("id <= ?")
+            args.append(endkey)
+        with self.lock:
+            found = self.conn.execute(f'SELECT id, rev, deleted, body FROM {table} WHERE {" AND ".join(where)} ORDER BY id LIMIT ? OFFSET ?', args+[limit if limit != None else -1, skip]).fetchall()
+        rows = []
+        for row in found:
+            result = {"id": row[0], "key": row[0], "value": {"rev": row[1]}}
+            if include_docs == True:
+                result["doc"] = self.document_load(*row)
+            rows.append(result)
+        return rows
+
+
+    def scheduler_docs(self):
+        '''Returns the replication scheduler's docs. A SQLite file never replicates, so there are none.'''
+        return []
+
+
+    def server_check(self):
+        '''Returns whether or not the SQLite file is accessible.'''
+        try:
+            with self.lock:
+                self.conn.execute("SELECT 1").fetchone()
+            self.logger.debug(f"Database server is accessible.")
+            return True
+        except sqlite3.Error:
+            pass
+        self.logger.warning(f"Database server is not accessible.")
+        return False
+
+
+    def table(self, dbname: str):
+        '''Returns the quoted table name of a database, raising a 404 ApiException if it doesn't exist.
+
+        dbname: Name of the database.
+        '''
+        if self.database_exists(dbname=dbname) == False:
+            raise ApiException(404, message="Database does not exist.")
+        return f'"{dbname}"'
+
+
+    def transport_setup(self, profile: dict = {}):
+        '''Does nothing, as there's no HTTP transport. Accepted for compatibility with Database.'''
+        self.transport = {}
+
+
+    def view_maps(self, dbname: str):
+        '''Returns the compiled map functions of every view in a database: {("DDOC", "VIEW"): function, ...}
+
+        dbname: Name of database to look in.
+        '''
+        if dbname not in self.maps:
+            table = self.table(dbname=dbname)
+            maps = {}
+            with self.lock:
+                rows = self.conn.execute(f"SELECT id, body FROM {table} WHERE deleted = 0 AND id LIKE '\\_design/%' ESCAPE '\\'").fetchall()
+            for id, body in rows:
+                for view, definition in json.loads(body).get("views", {}).items():
+                    if isinstance(definition.get("map", None), str):
+                        maps[(id[len("_design/"):], view)] = compile_map(js=definition["map"])
+            self.maps[dbname] = maps
+        return self.maps[dbname]
+
+
+    def view_create(self, dbname: str, name: str, views: dict, version: int = None, lazy: bool = False, partitioned: bool = None):
+        '''Creates or replaces a design document of map-only views, and builds them.
+
+        dbname: Name of database to create the views in.
+        name: Name of the design document.
+        views: Dictionary of {"VIEWNAME": "MAP FUNCTION SOURCE", ...}, defining the views.
+        version: If included, stored in the design document to tell revisions of it apart.
+        lazy: If true, won't replace an existing design document with the same version.
+        partitioned: Ignored, as views can always be queried across the whole database.
+
+        Returns true if the design document was created or replaced, false if it already existed.
+        '''
+        id = "_design/"+name
+        with self.lock, self.conn:
+            remote_doc = self.document_fetch(dbname=dbname, id=id)
+            if lazy == True and remote_doc != None and remote_doc.get("version", None) == version:
+                self.logger.debug(f"Views {dbname} {name} version {version} already exist")
+                return False
+            ddoc = {"_id": id, "_rev": remote_doc["_rev"] if remote_doc != None else None, "language": "javascript", "views": {view: {"map": source} for view, source in views.items()}, "version": version}
+            self.document_write(dbname=dbname, doc=ddoc)
+        self.logger.debug(f"Created views {dbname} {name} version {version}")
+        return True
+
+
+    def view_query(self, dbname: str, name: str, view: str, keys: list = None, include_docs: bool = False, limit: int = None):
+        '''Queries a map-only view and returns its rows: [{"id": "DOC ID", "key": KEY, "value": VALUE}, ...].
+
+        Rows are sorted by key, then by the id of the document that emitted them.
+
+        dbname: Name of database the view is in.
+        name: Name of the design document the view is in.
+        view: Name of the view.
+        keys: If included, only returns rows emitted with these keys. Should be sorted to keep rows sorted.
+        include_docs: If true, includes the document that emitted each row.
+        limit: If included, the max number of rows to retrieve.
+        '''
+        if (name, view) not in self.view_maps(dbname=dbname):
+            raise ApiException(404, message="missing_named_view")
+        with self.lock:
+            if keys != None:
+                encoded = [json.dumps(key, sort_keys=True) for key in keys]
+                found = self.conn.execute(f'SELECT key, id, value FROM "{dbname}/views" WHERE ddoc = ? AND view = ? AND key IN (SELECT value FROM json_each(?))', (name, view, json.dumps(encoded))).fetchall()
+                order = {key: index for index, key in enumerate(encoded)}
+                found.sort(key=lambda row: (order[row[0]], row[1]))
+            else:
+                found = self.conn.execute(f'SELECT key, id, value FROM "{dbname}/views" WHERE ddoc = ? AND view = ?', (name, view)).fetchall()
+                found.sort(key=lambda row: (collate(json.loads(row[0])), row[1]))
+        rows = [{"id": id, "key": json.loads(key), "value": json.loads(value)} for key, id, value in found[:limit]]
+        if include_docs == True:
+            docs = self.documents_get(dbname=dbname, ids=[row["id"] for row in rows])
+            for row, doc in zip(rows, docs):
+                row["doc"] = doc
+        self.logger.debug(f"Queried view {dbname} {name}/{view}{f' for {len(keys)} keys' if keys != None else ''}")
+        return rows
+
+
+    def view_rebuild(self, dbname: str, ddoc: str):
+        '''Rebuilds the rows of every view in a design document from scratch.
+
+        Must be called holding lock, inside a transaction.
+
+        dbname: Name of database the design document is in.
+        ddoc: Name of the design document.
+        '''
+        table = self.table(dbname=dbname)
+        self.conn.execute(f'DELETE FROM "{dbname}/views" WHERE ddoc = ?', (ddoc,))
+        maps = {view: function for (name, view), function in self.view_maps(dbname=dbname).items() if name == ddoc}
+        if len(maps) == 0:
+            return
+        rows = self.conn.execute(f"SELECT id, rev, deleted, body FROM {table} WHERE deleted = 0 AND id NOT LIKE '\\_design/%' ESCAPE '\\'").fetchall()
+        for row in rows:
+            doc = self.document_load(*row)
+            for view, function in maps.items():
+                self.view_insert(dbname=dbname, ddoc=ddoc, view=view, id=doc["_id"], emitted=function(doc=copy.deepcopy(doc)))
+        self.logger.debug(f"Rebuilt views {dbname} {ddoc}")
+
+
+    def view_insert(self, dbname: str, ddoc: str, view: str, id: str, emitted: list):
+        '''Stores the rows a document emitted into a view.
+
+        dbname: Name of database the view is in.
+        ddoc: Name of the design document the view is in.
+        view: Name of the view.
+        id: The UUID of the document that emitted the rows.
+        emitted: The (key, value) pairs emitted.
+        '''
+        rows = [(ddoc, view, json.dumps(key, sort_keys=True), id, json.dumps(value)) for key, value in emitted]
+        self.conn.executemany(f'INSERT INTO "{dbname}/views" (ddoc, view, key, id, value) VALUES (?, ?, ?, ?, ?)', rows)
+
+
+    def view_update(self, dbname: str, id: str, doc: dict = None):
+        '''Replaces the rows a document emitted into every view of its database.
+
+        Must be called holding lock, inside a transaction.
+
+        dbname: Name of database the document is in.
+        id: The UUID of the document.
+        doc: The document's new body, or None if it's been deleted.
+        '''
+        maps = self.view_maps(dbname=dbname)
+        if len(maps) == 0:
+            return
+        self.conn.execute(f'DELETE FROM "{dbname}/views" WHERE id = ?', (id,))
+        if doc != None:
+            for (ddoc, view), function in maps.items():
+                self.view_insert(dbname=dbname, ddoc=ddoc, view=view, id=id, emitted=function(doc=copy.deepcopy(doc)))
+
+
+# ----------------------------------------------------------------------------
\ No newline at end of file
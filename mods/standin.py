@@ -0,0 +1,1040 @@
+'''The module containing a local stand-in for a CouchDB server, used for offline testing and benchmarking.
+
+Only the subset of the CouchDB HTTP API used by mods/database.py is implemented, kept in memory. Requests can be
+slowed down artificially, to mimic a server at the far end of a VPN.
+'''
+
+import base64
+import copy
+import gzip
+import hashlib
+import http.cookies
+import json
+import random
+import re
+import textwrap
+import threading
+import time
+import urllib.parse
+import uuid
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import mods.log as ml
+
+
+# ----------------------------------------------------------------------------
+
+class StandinError(Exception):
+    '''An error which is returned to the client as a CouchDB style error response.'''
+
+    def __init__(self, status: int, error: str, reason: str):
+        '''Constructs a StandinError object.
+
+        status: The HTTP status code.
+        error: The CouchDB error name, eg "not_found".
+        reason: The human readable reason.
+        '''
+        super().__init__(f"{status} {error}: {reason}")
+        self.status = status
+        self.error = error
+        self.reason = reason
+
+
+# ----------------------------------------------------------------------------
+
+class StandinHandler(BaseHTTPRequestHandler):
+    '''Handles a single HTTP request to a Standin server, passing it to the Standin object for an answer.
+
+    Connections are kept alive, and the headers and body of a response are written separately, so Nagle's algorithm
+    is disabled; otherwise every body waits on the client's delayed ACK, adding around 40ms to each request.
+    '''
+
+    disable_nagle_algorithm = True
+    protocol_version = "HTTP/1.1"
+
+
+    def do_DELETE(self):
+        '''Handles a DELETE request.'''
+        self.respond(method="DELETE")
+
+
+    def do_GET(self):
+        '''Handles a GET request.'''
+        self.respond(method="GET")
+
+
+    def do_HEAD(self):
+        '''Handles a HEAD request.'''
+        self.respond(method="HEAD")
+
+
+    def do_POST(self):
+        '''Handles a POST request.'''
+        self.respond(method="POST")
+
+
+    def do_PUT(self):
+        '''Handles a PUT request.'''
+        self.respond(method="PUT")
+
+
+    def log_message(self, format: str, *args):
+        '''Sends the server's access log to the Standin's logger instead of stderr.'''
+        self.server.standin.logger.debug(format % args)
+
+
+    def respond(self, method: str):
+        '''Reads the request, waits out any injected latency, then writes the response.
+
+        method: The HTTP method of the request.
+        '''
+        standin = self.server.standin
+        url = urllib.parse.urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding", "") == "gzip":
+            body = gzip.decompress(body)
+        status, headers, result = standin.handle(method=method, path=url.path, query=url.query, body=body, content_type=self.headers.get("Content-Type", "application/json"), cookie=self.headers.get("Cookie", ""), authorization=self.headers.get("Authorization", ""))
+        standin.delay(path=url.path)
+
+        content_type = headers.pop("Content-Type", "application/json")
+        if isinstance(result, bytes):
+            data = result
+        else:
+            data = json.dumps(result).encode("utf-8") if result != None else b""
+        if "gzip" in self.headers.get("Accept-Encoding", "") and len(data) > 1024 and content_type == "application/json":
+            data = gzip.compress(data)
+            headers["Content-Encoding"] = "gzip"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if method != "HEAD":
+            self.wfile.write(data)
+
+
+# ----------------------------------------------------------------------------
+
+class Standin:
+    '''An in-memory, in-process stand-in for a CouchDB server.
+
+    Implements the endpoints mods/database.py relies on: _up, _all_dbs, _uuids, _session, _scheduler/docs,
+    databases, documents, attachments, _all_docs (keys, ranges and queries), _bulk_docs, _find, _index, _changes and views, as well as
+    the _all_docs, _find and _explain endpoints of partitioned databases' partitions.
+    Views support simple map functions only, such as the ones in DEHCDatabase.views_prepare.
+    Every request but those to /, _up and _session must be authenticated, with the session cookie or Basic auth.
+    Still, design documents' map functions are run as Python, so the server should only listen on loopback.
+
+    changed: Condition notified whenever a document changes, used by longpoll _changes feeds.
+    counts: Number of requests received, per endpoint. See endpoint.
+    data: The databases: {"DBNAME": {"docs": {"UUID": doc, ...}, "seqs": {"UUID": seq, ...}, "seq": seq, "partitioned": bool, "attachments": {"UUID": {"NAME": bytes, ...}, ...}}, ...}
+    host: The address the server listens on.
+    jitter: Max number of extra seconds randomly added to each request's latency.
+    latencies: Seconds of latency to inject per endpoint, overriding latency: {"_find": 0.05, ...}
+    latency: Seconds of latency to inject into every request.
+    lock: Lock guarding data.
+    logger: The logger object used for logging.
+    maps: Cache of compiled view map functions, keyed by their source.
+    password: The password clients must log in with.
+    port: The port the server listens on.
+    server: The HTTP server object, while running.
+    thread: The thread serving requests, while running.
+    token: The value of the AuthSession cookie given to clients that log in.
+    user: The username clients must log in with.
+    '''
+
+    def __init__(self, *, host: str = "127.0.0.1", port: int = 0, user: str = "admin", password: str = "admin", latency: float = 0.0, jitter: float = 0.0, latencies: dict = {}, level: str = "NOTSET"):
+        '''Constructs a Standin object. Call start to start serving.
+
+        host: The address to listen on.
+        port: The port to listen on. If 0, a free port is picked when started.
+        user: The username clients must log in with.
+        password: The password clients must log in with.
+        latency: Seconds of latency to inject into every request.
+        jitter: Max number of extra seconds randomly added to each request's latency.
+        latencies: Seconds of latency to inject per endpoint, overriding latency: {"_find": 0.05, ...}
+        level: Minimum level of logging messages to report; "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "NONE".
+        '''
+        self.logger = ml.get(name="Standin", level=level)
+        self.logger.debug("Standin object instantiated")
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.token = uuid.uuid4().hex
+        self.latency = latency
+        self.jitter = jitter
+        self.latencies = dict(latencies)
+        self.data = {}
+        self.maps = {}
+        self.counts = {}
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.server = None
+        self.thread = None
+
+
+    def all_docs(self, dbname: str, params: dict, partition: str = None):
+        '''Returns the _all_docs response for a database.
+
+        dbname: Name of database to list.
+        params: Query parameters and body: keys, key, startkey, endkey, include_docs, attachments, limit, skip, descending, inclusive_end.
+        partition: If included, only lists documents in this partition.
+        '''
+        docs = self.database(dbname=dbname)["docs"]
+        include_docs = params.get("include_docs", False) == True
+        attachments = self.database(dbname=dbname).get("attachments", {}) if params.get("attachments", False) == True else None
+        rows = []
+        if params.get("keys", None) != None:
+            for key in params["keys"]:
+                doc = docs.get(key, None)
+                if doc == None:
+                    rows.append({"key": key, "error": "not_found"})
+                elif doc.get("_deleted", False) == True:
+                    row = {"id": key, "key": key, "value": {"rev": doc["_rev"], "deleted": True}}
+                    if include_docs == True:
+                        row["doc"] = None
+                    rows.append(row)
+                else:
+                    rows.append(self.row(doc=doc, include_docs=include_docs, attachments=attachments))
+        else:
+            ids = sorted(id for id, doc in docs.items() if doc.get("_deleted", False) == False and (partition == None or id.startswith(partition+":")))
+            ids = self.slice(keys=ids, params=params, collate=lambda key: key)
+            rows = [self.row(doc=docs[id], include_docs=include_docs, attachments=attachments) for id in ids]
+        live = len([doc for doc in docs.values() if doc.get("_deleted", False) == False])
+        return {"total_rows": live, "offset": params.get("skip", 0), "rows": rows}
+
+
+    def authorized(self, cookie: str = "", authorization: str = ""):
+        '''Returns whether or not a request carries a valid session cookie or Basic auth credentials.
+
+        cookie: The Cookie header of the request.
+        authorization: The Authorization header of the request.
+        '''
+        try:
+            session = http.cookies.SimpleCookie(cookie).get("AuthSession", None)
+        except http.cookies.CookieError:
+            session = None
+        if session != None and session.value == self.token:
+            return True
+        if authorization.startswith("Basic ") == True:
+            try:
+                credentials = base64.b64decode(authorization[len("Basic "):]).decode("utf-8")
+            except ValueError:
+                return False
+            return credentials == f"{self.user}:{self.password}"
+        return False
+
+
+    def changes(self, dbname: str, params: dict):
+        '''Returns the _changes response for a database, waiting for a change first if the feed is longpoll.
+
+        dbname: Name of database to follow.
+        params: Query parameters and body: since, include_docs, feed, timeout, limit, doc_ids.
+        '''
+        with self.changed:
+            database = self.database(dbname=dbname)
+            since = str(params.get("since", "0"))
+            since = database["seq"] if since == "now" else int(since.split("-")[0])
+            results = self.changes_since(dbname=dbname, since=since, params=params)
+            if len(results) == 0 and params.get("feed", "normal") == "longpoll":
+                self.changed.wait(timeout=int(params.get("timeout", 60000))/1000)
+                results = self.changes_since(dbname=dbname, since=since, params=params)
+            last_seq = results[-1]["seq"] if len(results) > 0 else f"{since}-standin"
+            pending = len(self.changes_since(dbname=dbname, since=int(last_seq.split("-")[0]), params={}))
+            return {"results": results, "last_seq": last_seq, "pending": pending}
+
+
+    def changes_since(self, dbname: str, since: int, params: dict):
+        '''Returns the latest change to each document changed after a sequence number, oldest first.
+
+        dbname: Name of database to look in.
+        since: The sequence number to start after.
+        params: Query parameters and body: include_docs, limit, doc_ids.
+        '''
+        database = self.database(dbname=dbname)
+        doc_ids = params.get("doc_ids", None)
+        changed = sorted((seq, id) for id, seq in database["seqs"].items() if seq > since and (doc_ids == None or id in doc_ids))
+        if params.get("limit", None) != None:
+            changed = changed[:int(params["limit"])]
+        results = []
+        for seq, id in changed:
+            doc = database["docs"][id]
+            result = {"seq": f"{seq}-standin", "id": id, "changes": [{"rev": doc["_rev"]}]}
+            if doc.get("_deleted", False) == True:
+                result["deleted"] = True
+            if params.get("include_docs", False) == True:
+                result["doc"] = copy.deepcopy(doc)
+            results.append(result)
+        return results
+
+
+    def config_write(self, path: str, transport: dict = None):
+        '''Writes a connection config pointing at this server, for use by Database objects.
+
+        path: Path of the .json file to write.
+        transport: If included, the transport profile to add to the config. See Database.transport_setup.
+        '''
+        config = {"user": self.user, "pass": self.password, "url": self.url()}
+        if transport != None:
+            config["transport"] = transport
+        with open(path, "w") as f:
+            f.write(json.dumps(config, indent=4))
+
+
+    def database(self, dbname: str):
+        '''Returns a database's data, raising a not_found error if it doesn't exist.
+
+        dbname: Name of the database.
+        '''
+        if dbname not in self.data:
+            raise StandinError(404, "not_found", "Database does not exist.")
+        return self.data[dbname]
+
+
+    def delay(self, path: str):
+        '''Sleeps for the latency configured for a request, if any.
+
+        path: The path of the request.
+        '''
+        latency = self.latencies.get(self.endpoint(path=path), self.latency)
+        if self.jitter > 0:
+            latency += random.uniform(0, self.jitter)
+        if latency > 0:
+            time.sleep(latency)
+
+
+    def endpoint(self, path: str):
+        '''Returns the name of the endpoint a path points to: the last path segment starting with "_", or "default".
+
+        Document ids are URL encoded, so design documents count as "_design", and other documents as "default".
+
+        path: The path of the request.
+        '''
+        name = "default"
+        for segment in path.split("/"):
+            if segment.startswith("_"):
+                name = segment
+        return name
+
+
+    def explain(self, dbname: str, body: dict, partition: str = None):
+        '''Returns the _explain response for a query on a database.
+
+        dbname: Name of database to query.
+        body: The query: selector, fields, sort, limit, skip.
+        partition: If included, explains the query on this partition.
+        '''
+        self.database(dbname=dbname)
+        return {
+            "dbname": dbname,
+            "index": self.index_choose(dbname=dbname, body=body, partition=partition),
+            "selector": body.get("selector", {}),
+            "fields": body.get("fields", "all_fields"),
+            "limit": int(body.get("limit", 25)),
+            "skip": int(body.get("skip", 0))
+        }
+
+
+    def find(self, dbname: str, body: dict, partition: str = None):
+        '''Returns the _find response for a database.
+
+        dbname: Name of database to query.
+        body: The query: selector, fields, sort, limit, skip, execution_stats.
+        partition: If included, only queries documents in this partition.
+        '''
+        start = time.perf_counter()
+        docs = self.database(dbname=dbname)["docs"]
+        selector = body.get("selector", {})
+        candidates = [doc for id, doc in docs.items() if doc.get("_deleted", False) == False and id.startswith("_design/") == False and (partition == None or id.startswith(partition+":"))]
+        results = [doc for doc in candidates if matches(doc=doc, selector=selector) == True]
+
+        sort = body.get("sort", [])
+        if len(sort) > 0:
+            fields = [next(iter(field)) if isinstance(field, dict) else field for field in sort]
+            if self.index_find(dbname=dbname, fields=fields, selector=selector, partition=partition) == None:
+                raise StandinError(400, "no_usable_index", "No index exists for this sort, try indexing by the sort fields.")
+            for field in reversed(sort):
+                name, direction = next(iter(field.items())) if isinstance(field, dict) else (field, "asc")
+                results.sort(key=lambda doc: collate(field_get(doc=doc, field=name)), reverse=direction.lower() == "desc")
+        else:
+            results.sort(key=lambda doc: doc["_id"])
+
+        skip = int(body.get("skip", 0))
+        limit = int(body.get("limit", 25))
+        results = results[skip:skip+limit]
+        if body.get("fields", None) != None:
+            results = [{field: doc[field] for field in body["fields"] if field in doc} for doc in results]
+        else:
+            results = copy.deepcopy(results)
+        response = {"docs": results, "bookmark": "nil"}
+        if self.index_choose(dbname=dbname, body=body, partition=partition)["type"] == "special":
+            response["warning"] = "No matching index found, create an index to optimize query time."
+        if body.get("execution_stats", False) == True:
+            response["execution_stats"] = {
+                "total_keys_examined": 0,
+                "total_docs_examined": len(candidates),
+                "total_quorum_docs_examined": 0,
+                "results_returned": len(results),
+                "execution_time_ms": (time.perf_counter()-start)*1000
+            }
+        return response
+
+
+    def handle(self, method: str, path: str, query: str = "", body: bytes = b"", content_type: str = "application/json", cookie: str = "", authorization: str = ""):
+        '''Answers a request, returning the HTTP status, extra headers and JSON body of the response.
+
+        The body is bytes instead for attachments, with their MIME type in the extra "Content-Type" header.
+
+        method: The HTTP method of the request.
+        path: The path of the request.
+        query: The query string of the request.
+        body: The raw body of the request.
+        content_type: The MIME type of the body. Bodies other than JSON and forms are attachments, passed on as {"content_type": "TYPE", "data": bytes}.
+        cookie: The Cookie header of the request. See authorized.
+        authorization: The Authorization header of the request. See authorized.
+        '''
+        name = self.endpoint(path=path)
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+        params = {}
+        for key, values in urllib.parse.parse_qs(query).items():
+            try:
+                params[key] = json.loads(values[-1])
+            except ValueError:
+                params[key] = values[-1]
+        try:
+            if len(body) > 0 and content_type.split(";")[0] not in ["application/json", "application/x-www-form-urlencoded"]:
+                body = {"content_type": content_type, "data": body}
+            elif len(body) > 0:
+                try:
+                    body = json.loads(body)
+                except ValueError:
+                    body = dict(urllib.parse.parse_qsl(body.decode("utf-8")))
+            else:
+                body = {}
+            segments = [urllib.parse.unquote(segment) for segment in path.strip("/").split("/") if segment != ""]
+            if len(segments) > 0 and segments[0] not in ["_session", "_up"] and self.authorized(cookie=cookie, authorization=authorization) == False:
+                raise StandinError(401, "unauthorized", "You are not authorized to access this db.")
+            return self.route(method=method, segments=segments, params=params, body=body)
+        except StandinError as e:
+            return e.status, {}, {"error": e.error, "reason": e.reason}
+
+
+    def index_choose(self, dbname: str, body: dict, partition: str = None):
+        '''Returns the index CouchDB would answer a query with, as described by _explain.
+
+        Queries with a sort use an index that can sort them; see index_sorts. Others use an index starting with one of
+        the selector's fields, or the special _all_docs index if there isn't one.
+
+        dbname: Name of database to query.
+        body: The query: selector, sort, ...
+        partition: If included, the partition being queried.
+        '''
+        sort = [next(iter(field)) if isinstance(field, dict) else field for field in body.get("sort", [])]
+        for id, doc in self.database(dbname=dbname)["docs"].items():
+            if self.index_usable(dbname=dbname, id=id, doc=doc, partition=partition) == True:
+                for name, view in doc.get("views", {}).items():
+                    indexed = [next(iter(field)) for field in view["options"]["def"]["fields"]]
+                    if (len(sort) > 0 and self.index_sorts(indexed=indexed, sort=sort, selector=body.get("selector", {})) == True) or (len(sort) == 0 and indexed[0] in body.get("selector", {})):
+                        return {"ddoc": id, "name": name, "type": "json", "def": view["options"]["def"]}
+        return {"ddoc": None, "name": "_all_docs", "type": "special", "def": {"fields": [{"_id": "asc"}]}}
+
+
+    def index_find(self, dbname: str, fields: list, selector: dict = {}, partition: str = None):
+        '''Returns the design doc of a Mango index that can sort by a list of fields, or None if there isn't one.
+
+        dbname: Name of database to look in.
+        fields: The fields to sort by.
+        selector: The query's selector. See index_sorts.
+        partition: If included, the partition being queried.
+        '''
+        for id, doc in self.database(dbname=dbname)["docs"].items():
+            if self.index_usable(dbname=dbname, id=id, doc=doc, partition=partition) == True:
+                for view in doc.get("views", {}).values():
+                    indexed = [next(iter(field)) for field in view["options"]["def"]["fields"]]
+                    if self.index_sorts(indexed=indexed, sort=fields, selector=selector) == True:
+                        return doc
+        return None
+
+
+    def index_sorts(self, indexed: list, sort: list, selector: dict):
+        '''Returns whether or not an index can sort a query, as in CouchDB.
+
+        The sort fields must come next in the index after any leading fields the selector fixes to one value with $eq,
+        eg an index on [category, name] can sort {"category": {"$eq": "Person"}} by name.
+
+        indexed: The fields of the index.
+        sort: The fields to sort by.
+        selector: The query's selector.
+        '''
+        fixed = lambda field: field in selector and (not isinstance(selector[field], dict) or list(selector[field]) == ["$eq"])
+        for start in range(len(indexed)):
+            if indexed[start:start+len(sort)] == sort:
+                return True
+            if fixed(indexed[start]) == False:
+                return False
+        return False
+
+
+    def index_usable(self, dbname: str, id: str, doc: dict, partition: str = None):
+        '''Returns whether or not a document is a Mango index design doc that a query can use.
+
+        In partitioned databases, partition queries can only use partitioned indexes, and global queries global ones.
+
+        dbname: Name of database being queried.
+        id: The document's UUID.
+        doc: The document.
+        partition: If included, the partition being queried.
+        '''
+        if id.startswith("_design/") == False or doc.get("_deleted", False) == True or doc.get("language", "") != "query":
+            return False
+        if self.database(dbname=dbname).get("partitioned", False) == False:
+            return True
+        return doc.get("options", {}).get("partitioned", True) == (partition != None)
+
+
+    def indexes(self, dbname: str):
+        '''Returns the _index listing for a database.
+
+        dbname: Name of database to list indexes of.
+        '''
+        indexes = [{"ddoc": None, "name": "_all_docs", "type": "special", "def": {"fields": [{"_id": "asc"}]}}]
+        for id, doc in sorted(self.database(dbname=dbname)["docs"].items()):
+            if id.startswith("_design/") and doc.get("_deleted", False) == False and doc.get("language", "") == "query":
+                for name, view in doc.get("views", {}).items():
+                    indexes.append({"ddoc": id, "name": name, "type": "json", "def": view["options"]["def"]})
+        return {"total_rows": len(indexes), "indexes": indexes}
+
+
+    def index_create(self, dbname: str, body: dict):
+        '''Creates a Mango index, returning the _index response.
+
+        dbname: Name of database to create the index in.
+        body: The index definition: index, ddoc, name, type, partitioned.
+        '''
+        fields = [field if isinstance(field, dict) else {field: "asc"} for field in body.get("index", {}).get("fields", [])]
+        if len(fields) == 0:
+            raise StandinError(400, "bad_request", "Index must have at least one field.")
+        ddoc = body.get("ddoc", None) or uuid.uuid4().hex
+        ddoc = ddoc if ddoc.startswith("_design/") else "_design/"+ddoc
+        name = body.get("name", None) or uuid.uuid4().hex
+        docs = self.database(dbname=dbname)["docs"]
+        existing = docs.get(ddoc, {})
+        if existing.get("_deleted", False) == False and name in existing.get("views", {}):
+            return {"result": "exists", "id": ddoc, "name": name}
+        view = {"map": {"fields": {next(iter(field)): "asc" for field in fields}}, "reduce": "_count", "options": {"def": {"fields": fields}}}
+        doc = {"_id": ddoc, "language": "query", "views": {name: view}}
+        if self.database(dbname=dbname).get("partitioned", False) == True:
+            doc["options"] = {"partitioned": body.get("partitioned", True) != False}
+        if ddoc in docs:
+            doc["_rev"] = docs[ddoc]["_rev"]
+        self.write(dbname=dbname, doc=doc)
+        return {"result": "created", "id": ddoc, "name": name}
+
+
+    def reset(self):
+        '''Deletes every database and clears the request counts.'''
+        with self.lock:
+            self.data = {}
+            self.counts = {}
+        self.logger.debug("Standin reset")
+
+
+    def route(self, method: str, segments: list, params: dict, body: dict):
+        '''Dispatches a request to the method implementing its endpoint.
+
+        method: The HTTP method of the request.
+        segments: The URL decoded segments of the request's path.
+        params: The parsed query parameters of the request.
+        body: The parsed JSON body of the request.
+        '''
+        with self.lock:
+            if len(segments) == 0:
+                return 200, {}, {"couchdb": "Welcome", "version": "3.1.1", "vendor": {"name": "DEHC standin"}}
+            top = segments[0]
+            if top == "_up":
+                return 200, {}, {"status": "ok"}
+            if top == "_all_dbs":
+                return 200, {}, sorted(self.data.keys())
+            if top == "_uuids":
+                return 200, {}, {"uuids": [uuid.uuid4().hex for _ in range(int(params.get("count", 1)))]}
+            if top == "_session":
+                return self.session(method=method, body=body)
+            if segments == ["_scheduler", "docs"]:
+                return 200, {}, {"total_rows": 0, "offset": 0, "docs": []}
+            if top.startswith("_"):
+                raise StandinError(400, "illegal_database_name", f"Name: '{top}'. Only lowercase characters (a-z), digits (0-9), and any of the characters _, $, (, ), +, -, and / are allowed. Must begin with a letter.")
+
+            dbname = top
+            if len(segments) == 1:
+                return self.route_database(method=method, dbname=dbname, params=params, body=body)
+            action = segments[1]
+            if action == "_partition" and len(segments) >= 4:
+                partition = segments[2]
+                if self.database(dbname=dbname).get("partitioned", False) == False:
+                    raise StandinError(400, "bad_request", f"database {dbname} is not partitioned")
+                if segments[3] == "_all_docs":
+                    return 200, {}, self.all_docs(dbname=dbname, params={**params, **body}, partition=partition)
+                if segments[3] == "_find":
+                    return 200, {}, self.find(dbname=dbname, body=body, partition=partition)
+                if segments[3] == "_explain":
+                    return 200, {}, self.explain(dbname=dbname, body=body, partition=partition)
+                raise StandinError(404, "not_found", "missing")
+            if action == "_all_docs":
+                if len(segments) == 3 and segments[2] == "queries":
+                    return 200, {}, {"results": [self.all_docs(dbname=dbname, params=query) for query in body.get("queries", [])]}
+                return 200, {}, self.all_docs(dbname=dbname, params={**params, **body})
+            if action == "_bulk_docs":
+                self.database(dbname=dbname)
+                return 201, {}, [self.write(dbname=dbname, doc=doc, lazy=True) for doc in body.get("docs", [])]
+            if action == "_find":
+                return 200, {}, self.find(dbname=dbname, body=body)
+            if action == "_explain":
+                return 200, {}, self.explain(dbname=dbname, body=body)
+            if action == "_changes":
+                return 200, {}, self.changes(dbname=dbname, params={**params, **body})
+            if action == "_index":
+                if method == "POST":
+                    return 200, {}, self.index_create(dbname=dbname, body=body)
+                if method == "DELETE":
+                    *ddoc, type, name = segments[2:]
+                    ddoc = "/".join(ddoc) if ddoc[0] == "_design" else "_design/"+ddoc[0]
+                    doc = self.database(dbname=dbname)["docs"].get(ddoc, {})
+                    if doc.get("_deleted", False) == True or name not in doc.get("views", {}):
+                        raise StandinError(404, "not_found", "Index not found.")
+                    self.write(dbname=dbname, doc={"_id": ddoc, "_rev": doc["_rev"], "_deleted": True})
+                    return 200, {}, {"ok": True}
+                return 200, {}, self.indexes(dbname=dbname)
+            if action == "_design":
+                id = "_design/"+segments[2]
+                if len(segments) == 5 and segments[3] == "_view":
+                    return 200, {}, self.view(dbname=dbname, ddoc=id, view=segments[4], params={**params, **body})
+                return self.route_document(method=method, dbname=dbname, id=id, params=params, body=body)
+            if len(segments) == 3:
+                return self.route_attachment(method=method, dbname=dbname, id=segments[1], name=segments[2], params=params, body=body)
+            return self.route_document(method=method, dbname=dbname, id="/".join(segments[1:]), params=params, body=body)
+
+
+    def route_attachment(self, method: str, dbname: str, id: str, name: str, params: dict, body: dict):
+        '''Answers a request about an attachment of a document.
+
+        method: The HTTP method of the request.
+        dbname: Name of the database the document is in.
+        id: The document's UUID.
+        name: The name of the attachment.
+        params: The parsed query parameters of the request.
+        body: The attachment being saved: {"content_type": "TYPE", "data": bytes}
+        '''
+        database = self.database(dbname=dbname)
+        doc = database["docs"].get(id, None)
+        live = doc != None and doc.get("_deleted", False) == False
+        if method in ["GET", "HEAD"]:
+            if live == False or name not in doc.get("_attachments", {}):
+                raise StandinError(404, "not_found", "Document is missing attachment" if live == True else "missing")
+            return 200, {"ETag": f'"{doc["_rev"]}"', "Content-Type": doc["_attachments"][name]["content_type"]}, database["attachments"][id][name]
+        if method == "PUT":
+            new_doc = copy.deepcopy(doc) if live == True else {"_id": id}
+            new_doc["_rev"] = params.get("rev", None)
+            new_doc.setdefault("_attachments", {})[name] = {"content_type": body.get("content_type", "application/octet-stream"), "data": base64.b64encode(body.get("data", b"")).decode("utf-8")}
+            result = self.write(dbname=dbname, doc=new_doc)
+            return 201, {"ETag": f'"{result["rev"]}"'}, result
+        if method == "DELETE":
+            if live == False or name not in doc.get("_attachments", {}):
+                raise StandinError(404, "not_found", "Document is missing attachment" if live == True else "missing")
+            new_doc = copy.deepcopy(doc)
+            new_doc["_rev"] = params.get("rev", None)
+            del new_doc["_attachments"][name]
+            result = self.write(dbname=dbname, doc=new_doc)
+            return 200, {"ETag": f'"{result["rev"]}"'}, result
+        raise StandinError(405, "method_not_allowed", "Only DELETE,GET,HEAD,PUT allowed")
+
+
+    def route_database(self, method: str, dbname: str, params: dict, body: dict):
+        '''Answers a request about a database itself, or creates a document in it.
+
+        method: The HTTP method of the request.
+        dbname: Name of the database.
+        params: The parsed query parameters of the request.
+        body: The parsed JSON body of the request.
+        '''
+        if method == "PUT":
+            if dbname in self.data:
+                raise StandinError(412, "file_exists", "The database could not be created, the file already exists.")
+            self.data[dbname] = {"docs": {}, "seqs": {}, "seq": 0, "partitioned": params.get("partitioned", False) == True, "attachments": {}}
+            return 201, {}, {"ok": True}
+        database = self.database(dbname=dbname)
+        if method == "DELETE":
+            del self.data[dbname]
+            return 200, {}, {"ok": True}
+        if method in ["GET", "HEAD"]:
+            live = len([doc for doc in database["docs"].values() if doc.get("_deleted", False) == False])
+            props = {"partitioned": True} if database.get("partitioned", False) == True else {}
+            return 200, {}, {"db_name": dbname, "doc_count": live, "doc_del_count": len(database["docs"])-live, "update_seq": f"{database['seq']}-standin", "props": props}
+        if method == "POST":
+            result = self.write(dbname=dbname, doc=body)
+            return 201, {"ETag": f'"{result["rev"]}"'}, result
+        raise StandinError(405, "method_not_allowed", "Only DELETE,GET,HEAD,POST,PUT allowed")
+
+
+    def route_document(self, method: str, dbname: str, id: str, params: dict, body: dict):
+        '''Answers a request about a single document.
+
+        method: The HTTP method of the request.
+        dbname: Name of the database the document is in.
+        id: The document's UUID.
+        params: The parsed query parameters of the request.
+        body: The parsed JSON body of the request.
+        '''
+        docs = self.database(dbname=dbname)["docs"]
+        doc = docs.get(id, None)
+        if method in ["GET", "HEAD"]:
+            if doc == None or doc.get("_deleted", False) == True:
+                raise StandinError(404, "not_found", "deleted" if doc != None else "missing")
+            return 200, {"ETag": f'"{doc["_rev"]}"'}, copy.deepcopy(doc)
+        if method == "PUT":
+            result = self.write(dbname=dbname, doc={**body, "_id": id, **({"_rev": params["rev"]} if "rev" in params else {})})
+            return 201, {"ETag": f'"{result["rev"]}"'}, result
+        if method == "DELETE":
+            if doc == None or doc.get("_deleted", False) == True:
+                raise StandinError(404, "not_found", "deleted" if doc != None else "missing")
+            result = self.write(dbname=dbname, doc={"_id": id, "_rev": params.get("rev", None), "_deleted": True})
+            return 200, {"ETag": f'"{result["rev"]}"'}, result
+        raise StandinError(405, "method_not_allowed", "Only DELETE,GET,HEAD,PUT allowed")
+
+
+    def row(self, doc: dict, include_docs: bool = False, attachments: dict = None):
+        '''Returns the _all_docs row of a document.
+
+        doc: The document.
+        include_docs: If true, includes a copy of the document in the row.
+        attachments: If included, the database's stored attachments, to include the document's inline: {"UUID": {"NAME": bytes, ...}, ...}
+        '''
+        row = {"id": doc["_id"], "key": doc["_id"], "value": {"rev": doc["_rev"]}}
+        if include_docs == True:
+            row["doc"] = copy.deepcopy(doc)
+            for name, data in (attachments or {}).get(doc["_id"], {}).items():
+                if name in row["doc"].get("_attachments", {}):
+                    stub = {key: value for key, value in row["doc"]["_attachments"][name].items() if key != "stub"}
+                    row["doc"]["_attachments"][name] = {**stub, "data": base64.b64encode(data).decode("utf-8")}
+        return row
+
+
+    def session(self, method: str, body: dict):
+        '''Answers a _session request, logging clients in and out.
+
+        method: The HTTP method of the request.
+        body: The login credentials: name or username, password.
+        '''
+        if method == "POST":
+            if body.get("name", body.get("username", None)) != self.user or body.get("password", None) != self.password:
+                raise StandinError(401, "unauthorized", "Name or password is incorrect.")
+            return 200, {"Set-Cookie": f"AuthSession={self.token}; Version=1; Max-Age=600; Path=/; HttpOnly"}, {"ok": True, "name": self.user, "roles": ["_admin"]}
+        if method == "DELETE":
+            return 200, {"Set-Cookie": "AuthSession=; Version=1; Path=/; HttpOnly"}, {"ok": True}
+        return 200, {}, {"ok": True, "userCtx": {"name": self.user, "roles": ["_admin"]}, "info": {"authenticated": "cookie"}}
+
+
+    def slice(self, keys: list, params: dict, collate):
+        '''Applies range, direction, skip and limit parameters to a sorted list of keys.
+
+        keys: The keys, sorted in ascending order.
+        params: The parameters: key, startkey, endkey, descending, inclusive_end, skip, limit.
+        collate: Function returning the sort key of a key.
+        '''
+        descending = params.get("descending", False) == True
+        if descending == True:
+            keys = list(reversed(keys))
+        if "key" in params:
+            keys = [key for key in keys if collate(key) == collate(params["key"])]
+        startkey = params.get("startkey", params.get("start_key", None))
+        endkey = params.get("endkey", params.get("end_key", None))
+        inclusive = params.get("inclusive_end", True) != False
+        before = (lambda a, b: a > b) if descending == True else (lambda a, b: a < b)
+        if startkey != None:
+            keys = [key for key in keys if before(collate(key), collate(startkey)) == False]
+        if endkey != None:
+            keys = [key for key in keys if before(collate(endkey), collate(key)) == False and (inclusive == True or collate(key) != collate(endkey))]
+        skip = int(params.get("skip", 0) or 0)
+        keys = keys[skip:]
+        if params.get("limit", None) != None:
+            keys = keys[:int(params["limit"])]
+        return keys
+
+
+    def start(self):
+        '''Starts serving requests on a background thread.'''
+        self.server = ThreadingHTTPServer((self.host, self.port), StandinHandler)
+        self.server.daemon_threads = True
+        self.server.standin = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="Standin", daemon=True)
+        self.thread.start()
+        self.logger.info(f"Standin serving at {self.url()}")
+
+
+    def stop(self):
+        '''Stops serving requests.'''
+        if self.server != None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+            self.thread = None
+            self.logger.info(f"Standin stopped")
+
+
+    def url(self):
+        '''Returns the URL of the server.'''
+        return f"http://{self.host}:{self.port}"
+
+
+    def view(self, dbname: str, ddoc: str, view: str, params: dict):
+        '''Returns the response of a view query.
+
+        dbname: Name of database to query.
+        ddoc: The UUID of the design document containing the view.
+        view: The name of the view.
+        params: Query parameters and body: keys, key, startkey, endkey, include_docs, limit, skip, descending.
+        '''
+        docs = self.database(dbname=dbname)["docs"]
+        design = docs.get(ddoc, None)
+        if design == None or design.get("_deleted", False) == True or view not in design.get("views", {}):
+            raise StandinError(404, "not_found", "missing_named_view")
+        source = design["views"][view]["map"]
+        if source not in self.maps:
+            self.maps[source] = compile_map(js=source)
+        rows = []
+        for doc_id, doc in docs.items():
+            if doc_id.startswith("_design/") == False and doc.get("_deleted", False) == False:
+                for key, value in self.maps[source](doc=copy.deepcopy(doc)):
+                    rows.append({"id": doc_id, "key": key, "value": value})
+        rows.sort(key=lambda row: (collate(row["key"]), row["id"]))
+        if params.get("keys", None) != None:
+            rows = [row for key in params["keys"] for row in rows if collate(row["key"]) == collate(key)]
+            skip = int(params.get("skip", 0) or 0)
+            rows = rows[skip:skip+int(params["limit"])] if params.get("limit", None) != None else rows[skip:]
+        else:
+            positions = self.slice(keys=list(range(len(rows))), params=params, collate=lambda position: collate(rows[position]["key"]) if isinstance(position, int) else collate(position))
+            rows = [rows[position] for position in positions]
+        if params.get("include_docs", False) == True:
+            for row in rows:
+                target = row["value"].get("_id", row["id"]) if isinstance(row["value"], dict) else row["id"]
+                doc = docs.get(target, None)
+                row["doc"] = copy.deepcopy(doc) if doc != None and doc.get("_deleted", False) == False else None
+        return {"total_rows": len(rows), "offset": params.get("skip", 0), "rows": rows}
+
+
+    def write(self, dbname: str, doc: dict, lazy: bool = False):
+        '''Saves a new revision of a document, enforcing revision checks, and returns the write result.
+
+        Attachments listed with base64 "data" are stored, stubs are kept, and any not listed are deleted, as in CouchDB.
+
+        dbname: Name of database to write to.
+        doc: The document, with "_rev" of the revision it replaces, and "_deleted" if it's being deleted.
+        lazy: If true, returns failures as {"id": "UUID", "error": "ERROR", "reason": "REASON"} instead of raising them.
+        '''
+        database = self.database(dbname=dbname)
+        id = doc.get("_id", None) or uuid.uuid4().hex
+        rev = doc.get("_rev", None)
+        current = database["docs"].get(id, None)
+        live = current != None and current.get("_deleted", False) == False
+        try:
+            if live == True and rev != current["_rev"]:
+                raise StandinError(409, "conflict", "Document update conflict.")
+            if live == False and rev != None and (current == None or rev != current["_rev"]):
+                raise StandinError(409, "conflict", "Document update conflict.")
+            if live == False and doc.get("_deleted", False) == True:
+                raise StandinError(404, "not_found", "deleted" if current != None else "missing")
+            if database.get("partitioned", False) == True and id.startswith(("_design/", "_local/")) == False and ":" not in id[1:]:
+                raise StandinError(400, "illegal_docid", "Doc id must be of form partition:id")
+            attachments = doc.get("_attachments", {}) if doc.get("_deleted", False) == False else {}
+            for name, attachment in attachments.items():
+                if "data" not in attachment and (live == False or name not in current.get("_attachments", {})):
+                    raise StandinError(412, "missing_stub", f"Invalid attachment stub in {id} for {name}")
+        except StandinError as e:
+            if lazy == True:
+                return {"id": id, "error": e.error, "reason": e.reason}
+            raise
+
+        number = int(current["_rev"].split("-")[0])+1 if current != None else 1
+        new_rev = f"{number}-{uuid.uuid4().hex}"
+        if doc.get("_deleted", False) == True:
+            new_doc = {"_id": id, "_rev": new_rev, "_deleted": True}
+        else:
+            new_doc = copy.deepcopy(doc)
+            new_doc.update({"_id": id, "_rev": new_rev})
+        stored = database.setdefault("attachments", {}).pop(id, {})
+        for name, attachment in attachments.items():
+            if "data" in attachment:
+                data = base64.b64decode(attachment["data"])
+                digest = "md5-" + base64.b64encode(hashlib.md5(data).digest()).decode("utf-8")
+                new_doc["_attachments"][name] = {"content_type": attachment.get("content_type", "application/octet-stream"), "digest": digest, "length": len(data), "revpos": number, "stub": True}
+                stored[name] = data
+            else:
+                new_doc["_attachments"][name] = current["_attachments"][name]
+        if len(attachments) > 0:
+            database["attachments"][id] = {name: stored[name] for name in attachments}
+        database["docs"][id] = new_doc
+        database["seq"] += 1
+        database["seqs"][id] = database["seq"]
+        self.changed.notify_all()
+        return {"ok": True, "id": id, "rev": new_rev}
+
+
+# ----------------------------------------------------------------------------
+
+def collate(value):
+    '''Returns a sort key approximating CouchDB's view collation: null, false, true, numbers, strings, arrays, objects.
+
+    value: The JSON value to sort.
+    '''
+    if value == None:
+        return (0,)
+    if value is False:
+        return (1,)
+    if value is True:
+        return (2,)
+    if isinstance(value, (int, float)):
+        return (3, value)
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, list):
+        return (5, tuple(collate(item) for item in value))
+    return (6, tuple((key, collate(item)) for key, item in value.items()))
+
+
+def compile_map(js: str):
+    '''Translates a simple JavaScript map function into a Python function returning the emitted (key, value) pairs.
+
+    Supports property access, if/else, &&, ||, !, ===, !==, for loops over arrays, and emit. Anything fancier
+    should be emulated in Python instead.
+
+    js: The source of the map function, eg "function (doc) { if (doc.a) { emit(doc.a, null); } }"
+    '''
+    body = js.strip()
+    body = body[body.index("{")+1:body.rindex("}")]
+    body = re.sub(r"\b(var|let|const)\s+", "", body)
+    body = re.sub(r"for \((\w+) = 0; \1 < (.+?)\.length; \1\+\+\)", r"for \1 in range(len(\2 or []))", body)
+    body = re.sub(r"doc((?:\.\w+)+)", lambda match: "doc" + "".join(f'.get("{part}")' for part in match.group(1)[1:].split(".")), body)
+    body = re.sub(r"Array\.isArray\((.+?)\)", r"isinstance(\1, list)", body)
+    body = body.replace("===", "==").replace("!==", "!=").replace("&&", " and ").replace("||", " or ")
+    body = re.sub(r"!(?!=)", " not ", body)
+    body = re.sub(r"\bnull\b", "None", body)
+    body = re.sub(r"\btrue\b", "True", body)
+    body = re.sub(r"\bfalse\b", "False", body)
+    lines = []
+    indent = 0
+    for token in re.split(r"([{};])", body):
+        token = token.strip()
+        if token == "{":
+            lines[-1] += ":"
+            indent += 1
+        elif token == "}":
+            indent -= 1
+        elif token not in [";", ""]:
+            token = re.sub(r"^(if|while) \((.*)\)$", r"\1 \2", token)
+            token = re.sub(r"^else if \((.*)\)$", r"elif \1", token)
+            lines.append("    "*indent + token)
+    source = "def map(doc, emit):\n" + textwrap.indent("\n".join(lines) + "\npass", "    ")
+    namespace = {}
+    exec(source, namespace)
+
+    def run(doc: dict):
+        emitted = []
+        namespace["map"](doc, lambda key, value=None: emitted.append((key, value)))
+        return emitted
+    return run
+
+
+def field_get(doc: dict, field: str):
+    '''Returns the value of a dotted field in a document, or a placeholder object if it's missing.
+
+    doc: The document.
+    field: The field, eg "a.b.c".
+    '''
+    value = doc
+    for part in field.split("."):
+        if isinstance(value, dict) == False or part not in value:
+            return MISSING
+        value = value[part]
+    return value
+
+
+def matches(doc: dict, selector: dict):
+    '''Returns whether or not a document matches a Mango selector.
+
+    Supports $and, $or, $nor, $not, $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin, $exists, $regex, $all, $size and $elemMatch.
+    As in CouchDB, only $exists matches fields a document doesn't have.
+
+    doc: The document.
+    selector: The selector: {"FIELD": {"OPERATOR": "VALUE"}, ...}
+    '''
+    for key, condition in selector.items():
+        if key == "$and":
+            if all(matches(doc=doc, selector=sub) for sub in condition) == False:
+                return False
+        elif key == "$or":
+            if any(matches(doc=doc, selector=sub) for sub in condition) == False:
+                return False
+        elif key == "$nor":
+            if any(matches(doc=doc, selector=sub) for sub in condition) == True:
+                return False
+        elif key == "$not":
+            if matches(doc=doc, selector=condition) == True:
+                return False
+        elif matches_field(value=field_get(doc=doc, field=key), condition=condition) == False:
+            return False
+    return True
+
+
+def matches_field(value, condition):
+    '''Returns whether or not a field's value satisfies a Mango condition.
+
+    value: The field's value, or MISSING.
+    condition: Either a literal to compare to, or {"OPERATOR": "VALUE", ...}
+    '''
+    if isinstance(condition, dict) == False or any(key.startswith("$") for key in condition) == False:
+        condition = {"$eq": condition}
+    for operator, argument in condition.items():
+        if operator == "$exists":
+            if (value is not MISSING) != argument:
+                return False
+            continue
+        if value is MISSING:
+            return False
+        if operator == "$eq" and collate(value) != collate(argument):
+            return False
+        if operator == "$ne" and collate(value) == collate(argument):
+            return False
+        if operator == "$gt" and (collate(value) > collate(argument)) == False:
+            return False
+        if operator == "$gte" and (collate(value) >= collate(argument)) == False:
+            return False
+        if operator == "$lt" and (collate(value) < collate(argument)) == False:
+            return False
+        if operator == "$lte" and (collate(value) <= collate(argument)) == False:
+            return False
+        if operator == "$in" and collate(value) not in [collate(item) for item in argument]:
+            return False
+        if operator == "$nin" and collate(value) in [collate(item) for item in argument]:
+            return False
+        if operator == "$regex" and (isinstance(value, str) == False or re.search(argument, value) == None):
+            return False
+        if operator == "$all" and (isinstance(value, list) == False or all(item in value for item in argument) == False):
+            return False
+        if operator == "$size" and (isinstance(value, list) == False or len(value) != argument):
+            return False
+        if operator == "$elemMatch" and (isinstance(value, list) == False or any(matches_field(value=item, condition=argument) if any(key.startswith("$") for key in argument) else matches(doc=item, selector=argument) for item in value) == False):
+            return False
+        if operator == "$not" and matches_field(value=value, condition=argument) == True:
+            return False
+    return True
+
+
+MISSING = object()
+
+
+# ----------------------------------------------------------------------------
\ No newline at end of file
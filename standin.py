@@ -0,0 +1,36 @@
+'''The script that starts a local stand-in for the CouchDB server, for offline testing and benchmarking.'''
+
+import argparse
+import sys
+import time
+
+import mods.log as ml
+import mods.standin as ms
+
+# ----------------------------------------------------------------------------
+
+parser = argparse.ArgumentParser(description='Starts an in-memory stand-in for the CouchDB server used by DEHC.')
+parser.add_argument('-a','--auth', type=str, default="", help="if included, writes a database authentication file pointing at the stand-in to this relative path", metavar="PATH")
+parser.add_argument('-j','--jitt', type=float, default=0.0, help="max number of extra seconds randomly added to each request's latency", metavar="SECS")
+# '-h' brings up help
+parser.add_argument('-l','--logg', default="INFO", help="minimum level of logging messages that are printed: DEBUG, INFO, WARNING, ERROR, CRITICAL, or NONE", choices=["DEBUG","INFO","WARNING","ERROR","CRITICAL","NONE"], metavar="LEVL")
+parser.add_argument('-p','--port', type=int, default=5985, help="the port to listen on", metavar="PORT")
+parser.add_argument('-t','--late', type=float, default=0.0, help="seconds of latency to inject into every request", metavar="SECS")
+parser.add_argument('-u','--user', type=str, default="admin", help="the username clients must log in with", metavar="USER")
+parser.add_argument('-w','--pass', type=str, default="admin", help="the password clients must log in with", metavar="PASS")
+args = parser.parse_args()
+
+logger = ml.get(name="Standin", level=args.logg)
+standin = ms.Standin(port=args.port, user=args.user, password=getattr(args, "pass"), latency=args.late, jitter=args.jitt, level=args.logg)
+standin.start()
+if args.auth != "":
+    standin.config_write(path=args.auth)
+    logger.info(f"Wrote database authentication file {args.auth}")
+
+try:
+    while True:
+        time.sleep(1)
+except KeyboardInterrupt:
+    standin.stop()
+
+sys.exit(0)
\ No newline at end of file
@@ -1,118 +1,361 @@
-'''A performance testing script.'''
+'''The script that benchmarks the database's hot paths, against the configured server or a local stand-in.'''
 
+import argparse
+import asyncio
+import json
+import os
 import random
 import sys
+import tempfile
+import threading
 import time
+
 import mods.database as md
+import mods.log as ml
+import mods.standin as ms
 
-# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------------
 
-# PREAMBLE
+DBVERSION = "RC1"
+parser = argparse.ArgumentParser(description='Benchmarks the DEHC database hot paths at several tree sizes, reporting wall time and HTTP round trips.')
+parser.add_argument('-a','--auth', type=str, default="", help="relative path to database authentication file. If omitted, benchmarks an in-memory stand-in server", metavar="PATH")
+parser.add_argument('-b','--benc', type=str, default="", help="comma separated names of the benchmarks to run. If omitted, runs them all", metavar="NAMES")
+parser.add_argument('-c','--comp', type=str, default="", help="relative path to the output of a previous run to compare this run against", metavar="PATH")
+parser.add_argument('-d','--dept', type=str, default="2,3", help="comma separated depths of container tree to benchmark", metavar="DEPTHS")
+parser.add_argument('-f','--fans', type=str, default="5,10", help="comma separated numbers of children per container to benchmark", metavar="FANOUTS")
+# '-h' brings up help
+parser.add_argument('-k','--keep', help="if included, doesn't delete the benchmark databases afterwards", action='store_true')
+parser.add_argument('-l','--logg', type=str, default="INFO", help="minimum level of logging messages that are printed: DEBUG, INFO, WARNING, ERROR, CRITICAL, or NONE", choices=["DEBUG","INFO","WARNING","ERROR","CRITICAL","NONE"], metavar="LEVL")
+parser.add_argument('-n','--name', type=str, default="bench", help="which database namespace to use. Its databases are deleted!", metavar="NAME")
+parser.add_argument('-o','--outp', type=str, default="", help="relative path to write the results to, as .json", metavar="PATH")
+parser.add_argument('-p','--part', help="if included, benchmarks databases partitioned by item category", action='store_true')
+parser.add_argument('-r','--reps', type=int, default=10, help="number of times to repeat each lookup", metavar="N")
+parser.add_argument('-s','--sche', type=str, default="db_schema.json", help="relative path to database schema file", metavar="PATH")
+parser.add_argument('-t','--late', type=float, default=0.0, help="seconds of latency the stand-in injects into every request", metavar="SECS")
+parser.add_argument('-v','--vers', type=str, default=DBVERSION, help="schema version to expect", metavar="VERS")
+args = parser.parse_args()
 
-t0 = time.time()
+logger = ml.get(name="Benchmark", level=args.logg)
+random.seed(0)
 
-n = 2000          # Number of documents to insert
-f = 20           # Number of fetches to make
-q = 20           # Number of queries to make
+standin = None
+config = args.auth
+if config == "":
+    standin = ms.Standin(latency=args.late, level="NONE")
+    standin.start()
+    config = os.path.join(tempfile.mkdtemp(), "db_auth_bench.json")
+    standin.config_write(path=config)
+    logger.info(f"Started stand-in server at {standin.url()}")
 
-dehc = md.DEHCDatabase(
-    config="db_auth.json", 
-    version="RC1", 
-    forcelocal=True, 
-    level="CRITICAL",
-    namespace="test",
-    overridedbversion=False,
-    schema="db_schema.json",
-    updateschema=False,
-    quickstart=False)
-db = dehc.db
+dehc = md.DEHCDatabase(config=config, version=args.vers, forcelocal=True, level="CRITICAL", namespace=args.name, partitioned=args.part, schema=args.sche, quickstart=False)
+dehc.schema_load(schema=args.sche)
 
-dehc.schema_load(schema="db_schema.json")
-dehc.databases_delete(lazy=True)
-dehc.databases_create(lazy=True)
+LEVELS = ["Station", "Lane", "Vessel", "Group"]  # Categories of the containers between the evacuation and its persons
+FLAG = "Md-Medical"
+PHOTO = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4z8AAAAMBAQDJ/pLvAAAAAElFTkSuQmCC"  # A 1x1 .png
+
+# ----------------------------------------------------------------------------
+
+results = []
+overruns = []
+failures = []
+selected = [name for name in args.benc.split(",") if name != ""]
+
+
+def async_check(levels: list):
+    '''Checks that the async interfaces return the same results as the blocking ones, recording any failures.
+
+    levels: The items of the benchmark tree, by level.
+    '''
+    if len(selected) > 0 and "async_check" not in selected:
+        return
+    leaves = levels[-1]
+    adehc = md.AsyncDEHCDatabase(dehc=dehc)
+    async def run():
+        exists, docs, walks, photos = await asyncio.gather(
+            adehc.db.document_exists(dbname=dehc.db_items, id=leaves[0]),
+            adehc.items_get(ids=leaves),
+            adehc.tree_walks(walks=[[levels[0][0]], levels[-2]]),
+            adehc.photos_load_base64(items=leaves)
+        )
+        ids = [doc['_id'] async for doc in adehc.db.documents_iter(dbname=dehc.db_items, page_size=max(1, len(leaves)//3))]
+        return exists, docs, walks, photos, ids
+    exists, docs, walks, photos, ids = asyncio.run(run())
+    checks = {
+        "document_exists": exists == True,
+        "items_get": [doc['_id'] for doc in docs] == [doc['_id'] for doc in dehc.items_get(ids=leaves)],
+        "tree_walks": [walk["ITEM"] for walk in walks] == [dehc.tree_walk(items=[levels[0][0]])["ITEM"], dehc.tree_walk(items=levels[-2])["ITEM"]],
+        "photos_load_base64": {item for item, photo in photos.items() if photo != None} == {item for item, _ in dehc.photos_load(items=leaves)},
+        "documents_iter": ids == [doc['_id'] for doc in dehc.db.documents_iter(dbname=dehc.db_items)]
+    }
+    for name, passed in checks.items():
+        if passed == False:
+            failures.append(f"async_check {name} returned different results to its blocking version")
+    logger.info(f"Checked {len(checks)} async methods against their blocking versions")
+
+
+def budgets(levels: list):
+    '''Checks that single item operations make no more requests than they should, recording any overruns.
+
+    levels: The items of the benchmark tree, by level.
+    '''
+    if trips() == None or (len(selected) > 0 and "budgets" not in selected):
+        return
+    leaves = levels[-1]
+    containers = levels[-2]
+    sibling = containers[1] if len(containers) > 1 else levels[0][0]
+    dehc.ids_edit(item=leaves[0], ids=["BUDGET-OLD"])  # So ids_edit, photo_load_base64 and item_delete take their longest path
+    dehc.photo_save_base64(item=leaves[0], img=PHOTO)
+    listed = leaves[:dehc.db.chunk_size]  # photos_load takes one request for their stubs, then one per photo
+    photographed = len([doc for doc in dehc.db.documents_get(dbname=dehc.db_files, ids=["photo-"+leaf for leaf in listed]) if doc != None])
+    checks = [
+        ("item_get", 1, lambda: dehc.item_get(id=leaves[0])),
+        ("get_item_by_any_id", 1, lambda: dehc.get_item_by_any_id(searchID=leaves[0])),
+        ("item_edit", 2, lambda: dehc.item_edit(id=leaves[0], data={"Notes": "Edited"})),
+        ("items_edit", 2, lambda: dehc.items_edit(ids=leaves, data=[{"Notes": "Edited"} for _ in leaves], lazy=True)),
+        ("container_add", 1, lambda: dehc.container_add(container=sibling, item=leaves[0])),
+        ("container_remove", 2, lambda: dehc.container_remove(container=sibling, item=leaves[0])),
+        ("container_move", 3, lambda: dehc.container_move(from_con=containers[0], to_con=sibling, item=leaves[0])),
+        ("ids_edit", 5, lambda: dehc.ids_edit(item=leaves[0], ids=["BUDGET"])),
+        ("photo_load_base64", 1, lambda: dehc.photo_load_base64(item=leaves[0])),
+        ("photos_load", 1+photographed, lambda: list(dehc.photos_load(items=listed, size=64))),
+        ("item_delete", 8, lambda: dehc.item_delete(id=leaves[0]))
+    ]
+    for operation, requests, function in checks:
+        try:
+            with dehc.db.metrics.budget(requests=requests, operation=operation):
+                function()
+        except AssertionError as e:
+            overruns.append(str(e))
+            logger.warning(e)
 
-def rand_name():
-    s = [random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(6)]
-    return "".join(s)
 
-def rand_id():
-    s = [random.choice("0123456789abcdef") for _ in range(12)]
-    return "".join(s)
+def ids_check(n: int, threads: int = 4, clients: int = 2, rounds: int = 100):
+    '''Checks that UUIDs generated concurrently never collide, and that each thread's come out in order, recording any failures.
 
-def rand_ids():
-    return [rand_id() for _ in range(random.randint(2,5))]
+    Threads share one Database object, then separate Database objects stand in for separate clients, such as laptops 
+    writing offline, each starting afresh in the same second as the others every round.
 
-def rand_doc():
-    return {"Name": rand_name(), "ID": rand_id(), "IDS": rand_ids(), "Notes": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. Sed luctus commodo vehicula."}
+    n: Number of UUIDs each thread generates.
+    threads: Number of threads generating them at once.
+    clients: Number of separate Database objects generating them at once.
+    rounds: Number of times the separate Database objects start afresh.
+    '''
+    if len(selected) > 0 and "ids_check" not in selected:
+        return
+    generated = [[] for _ in range(threads)]
+    def generate(index: int):
+        for _ in range(0, n, 1000):
+            generated[index].extend(dehc.db.id_create(n=min(1000, n-len(generated[index])), length=dehc.id_len, prefix="Person/"))
+    workers = [threading.Thread(target=generate, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    ids = [id for ids in generated for id in ids]
+    if len(set(ids)) != len(ids):
+        failures.append(f"ids_check generated {len(ids)-len(set(ids))} duplicate UUIDs out of {len(ids)}")
+    for index, ids in enumerate(generated):
+        if ids != sorted(ids):
+            failures.append(f"ids_check thread {index} generated UUIDs out of order")
+    logger.info(f"Checked {threads*n} UUIDs generated by {threads} threads for collisions")
 
-docs = [rand_doc() for _ in range(n)]
-t1 = time.time()
+    others = [md.database_open(config=config, level="CRITICAL") for _ in range(clients)]
+    collisions = 0
+    for _ in range(rounds):
+        ids = []
+        for other in others:
+            other.id_clocks = {}
+            ids += other.id_create(n=1000, length=dehc.id_len, prefix="Person/")
+        collisions += len(ids) - len(set(ids))
+    if collisions > 0:
+        failures.append(f"ids_check generated {collisions} duplicate UUIDs across {clients} separate clients")
+    logger.info(f"Checked {rounds*clients*1000} UUIDs generated by {clients} separate clients for collisions")
 
-# INSERTING
 
-ids = dehc.items_create(cat="test-person", docs=docs)
-t2 = time.time()
+def trips():
+    '''Returns the number of HTTP requests made so far, or None if the backend doesn't make any.'''
+    return dehc.stats()["requests"] if hasattr(dehc.db, "client") else None
 
-# FETCHING ONE
 
-for i in range(f):
-    dehc.item_get(id=ids[i])
-t3 = time.time()
-for i in range(f):
-    db.document_get(dbname="test-items", id=ids[i])
-t4 = time.time()
+def measure(name: str, scale: dict, function, reps: int = 1):
+    '''Times a function over some repetitions, recording its wall time and round trips.
 
-# FETCHING ALL
+    name: Name of the benchmark.
+    scale: The size of the tree it's run against: {"depth": DEPTH, "fanout": FANOUT, "items": ITEMS}
+    function: The function to time. Called with the repetition number.
+    reps: Number of times to call the function.
+    '''
+    if len(selected) > 0 and name not in selected:
+        return
+    times = []
+    start_trips = trips()
+    for rep in range(reps):
+        t0 = time.perf_counter()
+        function(rep)
+        times.append(time.perf_counter()-t0)
+    end_trips = trips()
+    result = {
+        "name": name,
+        **scale,
+        "reps": reps,
+        "seconds": sum(times),
+        "mean": sum(times)/reps,
+        "min": min(times),
+        "max": max(times),
+        "round_trips": (end_trips-start_trips)/reps if end_trips != None else None
+    }
+    results.append(result)
+    logger.info(f"{name} {scale['depth']}x{scale['fanout']}: {result['mean']*1000:.2f} ms, {result['round_trips'] if end_trips != None else '?'} round trips")
 
-for _ in range(f):
-    dehc.items_list()
-t5 = time.time()
-for _ in range(f):
-    db.documents_list(dbname="test-items", limit=n)
-t6 = time.time()
 
-# QUERY
+def tree_build(depth: int, fanout: int):
+    '''Builds a container tree, fanout wide at each level, with persons as the leaves. Returns its items by level.
 
-dehc.items_query(cat="Person", selector={'ID':{"$eq": docs[0]['ID']}}, fields=["name", "ID"], sort=[{"ID": "asc"}])
-dehc.items_query(cat="Person", selector={'IDS':{"$all": [docs[0]['IDS'][0]]}}, fields=["name", "IDS"], sort=[{"IDS": "asc"}])
-dehc.items_query(cat="Person", selector={'ID':{"$eq": docs[0]['ID']}}, fields=["name", "ID"], sort=[{"Name": "asc"}])
-dehc.items_query(cat="Person", selector={'IDS':{"$all": [docs[0]['IDS'][0]]}}, fields=["name", "IDS"], sort=[{"Name": "asc"}])
+    depth: Number of levels below the evacuation.
+    fanout: Number of children in each container.
+    '''
+    levels = [[dehc.item_create(cat="Evacuation", doc={"Display Name": "Benchmark"})]]
+    for level in range(depth):
+        cat = "Person" if level == depth-1 else LEVELS[min(level, len(LEVELS)-1)]
+        items = []
+        for container in levels[-1]:
+            docs = [{"Display Name": f"{cat} {len(items)+index}"} for index in range(fanout)]
+            children = dehc.items_create(cat=cat, docs=docs)
+            dehc.container_adds(container=container, items=children)
+            items += children
+        levels.append(items)
+    return levels
 
-t7 = time.time()
 
-for i in range(q):
-    dehc.items_query(cat="Person", selector={'ID':{"$eq": docs[i]['ID']}}, fields=["_id", "ID"], sort=[{"ID": "asc"}])
-t8 = time.time()
+def benchmark(depth: int, fanout: int):
+    '''Runs every benchmark against a fresh tree of a given size.
 
-for i in range(q):
-    dehc.items_query(cat="Person", selector={'ID':{"$eq": docs[i]['ID']}}, fields=["_id", "ID"], sort=[{"Name": "asc"}])
-t9 = time.time()
+    depth: Number of levels below the evacuation.
+    fanout: Number of children in each container.
+    '''
+    dehc.databases_clear(lazy=True)
+    dehc.databases_create(lazy=True)
+    dehc.index_prepare()
+    levels = tree_build(depth=depth, fanout=fanout)
+    root = levels[0][0]
+    leaves = levels[-1]
+    scale = {"depth": depth, "fanout": fanout, "items": sum(len(level) for level in levels)}
+    samples = [random.choice(leaves) for _ in range(args.reps)]
+    for index, leaf in enumerate(samples):
+        dehc.ids_edit(item=leaf, ids=[f"BENCH{index:06d}"])
+        dehc.photo_save_base64(item=leaf, img=PHOTO)
 
-for i in range(q):
-    dehc.items_query(cat="Person", selector={'IDS':{"$all": [docs[i]['IDS'][0]]}}, fields=["_id", "IDS"], sort=[{"IDS": "asc"}])
-ta = time.time()
+    measure("container_children_all", scale, lambda rep: dehc.container_children_all(container=root), reps=args.reps)
+    measure("item_parents_all", scale, lambda rep: dehc.item_parents_all(item=samples[rep]), reps=args.reps)
+    measure("get_item_by_any_id", scale, lambda rep: dehc.get_item_by_any_id(f"BENCH{rep:06d}"), reps=args.reps)
+    measure("get_items_by_any_ids", scale, lambda rep: dehc.get_items_by_any_ids([f"BENCH{index:06d}" for index in range(args.reps)]), reps=args.reps)
+    dehc.physid_cache = md.PhysidCache(db=dehc.db, dbname=dehc.db_ids, level="CRITICAL")
+    dehc.physid_cache.load()
+    measure("ids_find_lru", scale, lambda rep: dehc.ids_find(f"BENCH{rep:06d}"), reps=args.reps)
+    measure("get_item_by_any_id_lru", scale, lambda rep: dehc.get_item_by_any_id(f"BENCH{rep:06d}"), reps=args.reps)
+    dehc.physid_cache.stop()
+    dehc.physid_cache = None
+    measure("photo_load", scale, lambda rep: dehc.photo_load(item=samples[rep]), reps=args.reps)
+    measure("photo_load_thumb", scale, lambda rep: dehc.photo_load_bytes(item=samples[rep], size=64), reps=args.reps)
+    measure("photos_load_thumb", scale, lambda rep: list(dehc.photos_load(items=samples, size=64)), reps=args.reps)
+    measure("manifest", scale, lambda rep: manifest(vessel=levels[-2][rep % len(levels[-2])]), reps=args.reps)
+    measure("flag_assign_tree", scale, lambda rep: dehc.flag_assign_tree(container=root, flag=FLAG))
+    measure("id_create", scale, lambda rep: dehc.db.id_create(n=10000, length=dehc.id_len, prefix="Person/"), reps=args.reps)
+    measure("items_list_cat", scale, lambda rep: dehc.items_list(cat="Person"), reps=args.reps)
+    measure("items_query_cat", scale, lambda rep: dehc.items_query(cat="Person", selector={}, sort=[{key: "asc"} for key in dehc.schema_keys(cat="Person")]), reps=args.reps)
 
-for i in range(q):
-    dehc.items_query(cat="Person", selector={'IDS':{"$all": [docs[i]['IDS'][0]]}}, fields=["_id", "IDS"], sort=[{"Name": "asc"}])
-tb = time.time()
+    extra = [{"Display Name": f"Extra {index}"} for index in range(len(leaves))]
+    created = []
+    measure("items_create", scale, lambda rep: created.extend(dehc.items_create(cat="Person", docs=extra)))
+    created = created if len(created) > 0 else dehc.items_create(cat="Person", docs=extra)
+    measure("items_edit", scale, lambda rep: dehc.items_edit(ids=created, data=[{"Notes": "Edited"} for _ in created], lazy=True))
+    measure("items_delete", scale, lambda rep: dehc.items_delete(ids=created, lazy=True))
+    async_check(levels=levels)
+    budgets(levels=levels)
+    measure("items_delete_recur", scale, lambda rep: dehc.items_delete(ids=levels[-2], recur=True, lazy=True))
+    ids_check(n=scale['items']*100)
 
-# RESULTS
 
-places = 3  # Decimal places
-print(f"Preamble: {round(t1-t0, places)} seconds")
-print(f"Inserting {n} documents: {round(t2-t1, places)} seconds")
-print(f"Fetching one document {f} times using DEHC: {round(t3-t2, places)} seconds")
-print(f"Fetching one document {f} times using DB: {round(t4-t3, places)} seconds")
-print(f"Fetching ALL {n} documents {f} times using DEHC: {round(t5-t4, places)} seconds")
-print(f"Fetching ALL {n} documents {f} times using DB: {round(t6-t5, places)} seconds")
-print(f"Querying ID (indexed by ID) in {n} documents {q} times: {round(t8-t7, places)} seconds")
-print(f"Querying ID (indexed by Name) in {n} documents {q} times: {round(t9-t8, places)} seconds")
-print(f"Querying list of IDs (indexed by IDS) in {n} documents {q} times: {round(ta-t9, places)} seconds")
-print(f"Querying list of IDs (indexed by Name) in {n} documents {q} times: {round(tb-ta, places)} seconds")
+def conditions():
+    '''Returns what this run was measured against. Runs' times are only comparable if these match.'''
+    return {
+        "backend": type(dehc.db).__name__,
+        "latency": args.late if standin != None else None,
+        "partitioned": dehc.partitioned,
+        "server": "standin" if standin != None else dehc.db.data.get("url", "")
+    }
 
-input("Breakpoint. Press enter to delete databases and finish.")
 
-# POSTAMBLE
+def compare(path: str):
+    '''Prints how this run's results compare to a previous run's, warning if they weren't measured against the same conditions.
+
+    path: Path to the .json output of the previous run.
+    '''
+    with open(path, "r") as f:
+        output = json.loads(f.read())
+    previous = {(result['name'], result['depth'], result['fanout']): result for result in output['results']}
+    for key, value in conditions().items():
+        if output.get(key, None) != value:
+            print(f"Warning: the previous run's {key} was {output.get(key, None)}, but this run's is {value}, so the changes in time aren't only the code's")
+    print(f"{'benchmark':<24}{'scale':>8}{'before ms':>12}{'after ms':>12}{'change':>9}{'trips':>14}")
+    for result in results:
+        key = (result['name'], result['depth'], result['fanout'])
+        if key not in previous:
+            continue
+        before = previous[key]
+        change = f"{(result['mean']/before['mean']-1)*100:+.0f}%" if before['mean'] > 0 else "?"
+        trips = f"{before['round_trips']}->{result['round_trips']}"
+        print(f"{result['name']:<24}{str(result['depth'])+'x'+str(result['fanout']):>8}{before['mean']*1000:>12.2f}{result['mean']*1000:>12.2f}{change:>9}{trips:>14}")
+
+
+def manifest(vessel: str):
+    '''Fetches what the web services need to render a vessel's manifest.
+
+    vessel: The container whose persons are listed.
+    '''
+    evacuees = dehc.container_children_all(vessel, cat=["Person"], result="DOC")
+    for evacuee in evacuees:
+        dehc.schema_schema(cat=evacuee['category'])
+    return evacuees
+
+
+def report():
+    '''Prints this run's results as a table.'''
+    print(f"{'benchmark':<24}{'scale':>8}{'items':>8}{'mean ms':>12}{'min ms':>12}{'max ms':>12}{'trips':>8}")
+    for result in results:
+        trips = result['round_trips'] if result['round_trips'] != None else "?"
+        print(f"{result['name']:<24}{str(result['depth'])+'x'+str(result['fanout']):>8}{result['items']:>8}{result['mean']*1000:>12.2f}{result['min']*1000:>12.2f}{result['max']*1000:>12.2f}{trips:>8}")
+
+# ----------------------------------------------------------------------------
+
+dehc.databases_delete(lazy=True)
+for depth in [int(value) for value in args.dept.split(",")]:
+    for fanout in [int(value) for value in args.fans.split(",")]:
+        logger.info(f"Benchmarking a tree {depth} deep and {fanout} wide")
+        benchmark(depth=depth, fanout=fanout)
+if args.keep == False:
+    dehc.databases_delete(lazy=True)
+if standin != None:
+    standin.stop()
+
+report()
+if args.outp != "":
+    output = {
+        **conditions(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+        "overruns": overruns,
+        "failures": failures
+    }
+    with open(args.outp, "w") as f:
+        f.write(json.dumps(output, indent=4))
+    logger.info(f"Wrote results to {args.outp}")
+if args.comp != "":
+    compare(path=args.comp)
+for overrun in overruns:
+    print(f"Over budget: {overrun}")
+for failure in failures:
+    print(f"Failed: {failure}")
 
-dehc.databases_delete()
-sys.exit(0)
\ No newline at end of file
+sys.exit(1 if len(overruns) > 0 or len(failures) > 0 else 0)
\ No newline at end of file
@@ -43,7 +43,7 @@ good_sound = base64.b64encode(open('resources/Electronic_Chime-KevanGC-495939803
 
 
 level = "DEBUG"
-db = db = md.DEHCDatabase(config=args.auth, version=args.vers, forcelocal=args.forc, level=args.logg, namespace=args.name, overridedbversion=args.ovdb, schema=args.sche, updateschema=args.upda, quickstart=True)
+db = db = md.DEHCDatabase(config=args.auth, version=args.vers, forcelocal=args.forc, level=args.logg, namespace=args.name, overridedbversion=args.ovdb, photocache="cache/photos", physidcache=True, schema=args.sche, updateschema=args.upda, quickstart=True)
 
 
 # ----------------------------------------------------------------------------
@@ -113,7 +113,7 @@ class MyServer(BaseHTTPRequestHandler):
             gate_check_html_replace["#cleared#"] = "Not Permitted : see gate staff"
             gate_check_html_replace["#audio#"] = f'data:audio/wav;base64, {bad_sound}'             
         try:
-            photo = db.photo_load_base64(evacuee['_id'])
+            photo = db.photo_load_base64(evacuee['_id'], size=512)
         except:
             photo = ""
             
@@ -154,7 +154,7 @@ class MyServer(BaseHTTPRequestHandler):
             pass
 
         try:
-            photo = db.photo_load_base64(item_id)
+            photo = db.photo_load_base64(item_id, size=512)
         except:
             photo = ""
         #pprint(evacuee_data)
@@ -202,7 +202,7 @@ class MyServer(BaseHTTPRequestHandler):
             pass
 
         try:
-            photo = db.photo_load_base64(item_id)
+            photo = db.photo_load_base64(item_id, size=512)
         except:
             photo = ""
         #pprint(evacuee_data)
@@ -216,15 +216,18 @@ class MyServer(BaseHTTPRequestHandler):
             if (type(value) is list) and (key != "flags"): #flags man, who'se idea was that?
                 data_pane += f"<tr><td><b>{key}</b></td><td><table>"
                 #data_pane += f"<tr><td></td><td></td></tr>\r\n"
+                try:
+                    photos = {subitem: base64.b64encode(data).decode('utf-8') for subitem, data in db.photos_load(items=value, size=64)}
+                except:
+                    photos = {}
                 for subitem in value:
                     sub_item_data = db.get_item_by_any_id(subitem)
 
                     print(subitem)
-                    try:
-                        photo = db.photo_load_base64(subitem)
-                        data_pane += f'''<tr><td><img src="data:image/png;base64, {photo}" alt="photo_id" /></td>'''
+                    if subitem in photos:
+                        data_pane += f'''<tr><td><img src="data:image/png;base64, {photos[subitem]}" alt="photo_id" /></td>'''
 
-                    except:
+                    else:
                         data_pane += f'''<tr><td></td>'''
                                         
                     data_pane += f'''<td><a href="https://10.8.0.50:9000/lookupitem?physid={subitem}">{sub_item_data['Display Name']}</a></td></tr>\r\n'''